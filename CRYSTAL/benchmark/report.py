@@ -0,0 +1,144 @@
+import json
+import multiprocessing
+import platform
+import Queue
+import time
+import traceback
+
+import numpy as np
+
+###########
+# Globals #
+###########
+
+# time_function repeats a function until it has run for at least this many
+# seconds, or for MAX_REPEATS times.
+MIN_TIME = 0.2
+MAX_REPEATS = 100
+
+# Seconds between checks that a benchmark's child process is still alive
+CHILD_POLL_INTERVAL = 1.0
+
+def time_function(func, *args):
+
+    '''
+    Times func(*args), repeating it to time fast functions accurately.
+
+    Returns the best time of a single call, the number of calls made and
+    the result of the last call.
+    '''
+
+    best_time = float("inf")
+    total_time = 0.0
+    n_repeats = 0
+    while total_time < MIN_TIME and n_repeats < MAX_REPEATS:
+        st_time = time.time()
+        result = func(*args)
+        call_time = time.time() - st_time
+        best_time = min(best_time, call_time)
+        total_time += call_time
+        n_repeats += 1
+    return best_time, n_repeats, result
+
+def run_in_child(func, *args):
+
+    '''
+    Runs func(*args) in a forked child process and returns its result.
+
+    Each benchmark run is made in a fresh child so that its peak memory is
+    not hidden by an earlier, larger run's. If func raises, returns a dict
+    holding the traceback under "error". If the child dies without a result
+    (e.g. it is killed for running out of memory), returns a dict holding
+    its exit code under "error".
+    '''
+
+    queue = multiprocessing.Queue()
+
+    def run():
+        try:
+            queue.put(func(*args))
+        except Exception:
+            queue.put({"error": traceback.format_exc()})
+
+    child = multiprocessing.Process(target=run)
+    child.start()
+    while True:
+        try:
+            result = queue.get(timeout=CHILD_POLL_INTERVAL)
+            break
+        except Queue.Empty:
+            if child.is_alive():
+                continue
+            # The child may have put its result just before exiting
+            try:
+                result = queue.get(timeout=CHILD_POLL_INTERVAL)
+            except Queue.Empty:
+                result = {"error": "child exited with code {}".format(child.exitcode)}
+            break
+    child.join()
+    return result
+
+def get_system_info():
+
+    '''
+    Returns a description of the machine and software a benchmark ran on.
+    '''
+
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "machine": platform.machine(),
+            "cpu_count": multiprocessing.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__}
+
+def compare_to_baseline(runs, baseline_filename, key_fields, time_field):
+
+    '''
+    Compares each run's time with the matching run of a baseline report.
+
+    Runs match if they have the same values of key_fields. The baseline's
+    time_field and the speedup over it (baseline time / time) are added to
+    each run with a match.
+    '''
+
+    with open(baseline_filename, "r") as baseline_file:
+        baseline = json.load(baseline_file)
+
+    def get_key(run):
+        return tuple(json.dumps(run.get(field), sort_keys=True) for field in key_fields)
+
+    baseline_times = dict((get_key(run), run[time_field]) for run in baseline["runs"]
+                          if time_field in run)
+    for run in runs:
+        if time_field in run and get_key(run) in baseline_times:
+            run["baseline_" + time_field] = baseline_times[get_key(run)]
+            run["speedup"] = baseline_times[get_key(run)] / max(run[time_field], 1e-12)
+
+def get_scaling_exponent(sizes, times):
+
+    '''
+    Returns the exponent a of the power law time ~ size^a best fitting the times.
+
+    Returns None if there are fewer than two distinct sizes.
+    '''
+
+    sizes, times = np.asarray(sizes, dtype=float), np.asarray(times, dtype=float)
+    if len(np.unique(sizes)) < 2:
+        return None
+    return float(np.polyfit(np.log(sizes), np.log(np.maximum(times, 1e-12)), 1)[0])
+
+def write_report(filename, benchmark, settings, runs, extra=None):
+
+    '''
+    Writes a benchmark's runs out as a JSON report.
+
+    Items of the dict extra (e.g. a summary of the runs) are added to the
+    report.
+    '''
+
+    report = {"benchmark": benchmark,
+              "system": get_system_info(),
+              "settings": settings,
+              "runs": runs}
+    report.update(extra or {})
+    with open(filename, "w") as report_file:
+        json.dump(report, report_file, indent=2, sort_keys=True)
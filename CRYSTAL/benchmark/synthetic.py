@@ -0,0 +1,186 @@
+import os
+
+from astropy.io import fits
+import numpy as np
+
+import data_containers.shard as shi
+import data_containers.telluric_db as telluric_db
+
+###########
+# Globals #
+###########
+
+# Orders in a CHIRON fits file
+N_ORDERS = 62
+
+# Water and airmass-scaling lines injected into each order
+N_WATER_LINES = 25
+N_Z_LINES = 40
+
+# Ranges of the injected lines' width (px) and depth (optical depth at pwv
+# or airmass 1)
+LINE_WIDTH_RANGE = (0.5, 2.0)
+LINE_DEPTH_RANGE = (0.05, 0.4)
+
+# Optical depth of the lines injected at calibration pixels
+CALIBRATOR_DEPTH = 0.3
+
+# Ranges of the precipitable water vapour and airmass of synthetic spectra
+PWV_RANGE = (0.2, 1.5)
+Z_RANGE = (1.0, 2.0)
+
+# Relative noise of synthetic spectra
+NOISE = 0.003
+
+# Fraction of the records of a synthetic telluric db that are water pixels
+WATER_FRACTION = 0.4
+
+class Synthetic_Tellurics():
+
+    '''
+    A synthetic telluric spectrum for generating CHIRON-like fits files.
+
+    Each order is given N_WATER_LINES water lines, whose depths scale with
+    the precipitable water vapour (pwv), and N_Z_LINES lines whose depths
+    scale with airmass. A water line is also injected at each of the
+    config's calibrators and reduction calibrators, so the water calibrator
+    is found in synthetic spectra as in real ones.
+
+    Parameters
+    ----------
+    config: dict
+        Configuration. Its pixels_per_order and calibrators are used.
+
+    seed: int
+        Seed of the random lines.
+
+    Attributes
+    ----------
+    w_tau: array
+        The (N_ORDERS x pixels_per_order) optical depth of the water lines
+        at pwv 1.
+
+    z_tau: array
+        The (N_ORDERS x pixels_per_order) optical depth of the airmass
+        lines at airmass 1.
+    '''
+
+    def __init__(self, config, seed=0):
+        rs = np.random.RandomState(seed)
+        n_px = config["pixels_per_order"]
+        self.px = np.arange(n_px)
+        self.w_tau = np.zeros((N_ORDERS, n_px))
+        self.z_tau = np.zeros((N_ORDERS, n_px))
+        for order in range(N_ORDERS):
+            self.w_tau[order] = get_line_tau(self.px, *get_random_lines(rs, N_WATER_LINES, n_px))
+            self.z_tau[order] = get_line_tau(self.px, *get_random_lines(rs, N_Z_LINES, n_px))
+
+        for calibrator in config["calibrators"] + config["reduction_calibrators"]:
+            order = calibrator[0][shi.ORD_IND]
+            center = calibrator[0][shi.LOPX_IND] + calibrator[1]
+            self.w_tau[order] += get_line_tau(self.px, [center], [1.0], [CALIBRATOR_DEPTH])
+
+    def write_spectrum(self, filename, pwv, z, seed):
+
+        '''
+        Writes a synthetic spectrum with the given pwv and airmass to a fits file.
+
+        The file holds a (N_ORDERS x pixels_per_order x 2) array of each
+        pixel's wavelength and intensity, and the airmass in its AIRMASS
+        header keyword, as load_fits.load_fits_orders expects.
+        '''
+
+        rs = np.random.RandomState(seed)
+        orders = np.arange(N_ORDERS)[:, np.newaxis]
+        wavelength = get_wavelength(orders, self.px)
+        continuum = 1000*(1 + 0.3*np.sin(self.px/1500.0 + orders))
+        intensity = continuum*np.exp(-(pwv*self.w_tau + z*self.z_tau))
+        intensity *= 1 + rs.normal(0, NOISE, intensity.shape)
+
+        data = np.zeros(intensity.shape + (2,), dtype=np.float32)
+        data[:, :, 0] = wavelength
+        data[:, :, 1] = intensity
+        hdu = fits.PrimaryHDU(data)
+        hdu.header["AIRMASS"] = z
+        hdu.writeto(filename, overwrite=True)
+
+    def write_spectra(self, path, n_spectra, seed=0):
+
+        '''
+        Writes n_spectra synthetic spectra with random pwv and airmass to path.
+
+        Returns the filenames written.
+        '''
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        rs = np.random.RandomState(seed)
+        filenames = []
+        for i in range(n_spectra):
+            filename = os.path.join(path, "synthetic_{:05d}.fits".format(i))
+            self.write_spectrum(filename, rs.uniform(*PWV_RANGE), rs.uniform(*Z_RANGE),
+                                seed + i + 1)
+            filenames.append(filename)
+        return filenames
+
+def get_random_lines(rs, n_lines, n_px):
+
+    '''
+    Returns the centers, widths and depths of n_lines random lines.
+    '''
+
+    return (rs.uniform(20, n_px - 20, n_lines), rs.uniform(*LINE_WIDTH_RANGE, size=n_lines),
+            rs.uniform(*LINE_DEPTH_RANGE, size=n_lines))
+
+def get_line_tau(px, centers, widths, depths):
+
+    '''
+    Returns the optical depth at each pixel of a set of Gaussian lines.
+    '''
+
+    tau = np.zeros(len(px))
+    for center, width, depth in zip(centers, widths, depths):
+        tau += depth*np.exp(-0.5*((px - center)/width)**2)
+    return tau
+
+def get_wavelength(order, px):
+
+    '''
+    Returns the wavelength of pixels of synthetic spectra.
+    '''
+
+    return 4500 + order*40 + px*0.0125
+
+def gen_db(n_records, config, seed=0):
+
+    '''
+    Generates a synthetic telluric db with n_records records.
+
+    Records are placed at random pixels of the N_ORDERS orders, so a db can
+    have up to a record for every pixel of the CCD. WATER_FRACTION of them
+    are water pixels and the rest non-water pixels, with random PCCs,
+    regression coefficients and intensities in the range of real dbs.
+    '''
+
+    n_px = config["pixels_per_order"]
+    if n_records > N_ORDERS * n_px:
+        raise Exception("A db can have at most {} records".format(N_ORDERS * n_px))
+
+    rs = np.random.RandomState(seed)
+    addrs = np.sort(rs.choice(N_ORDERS * n_px, n_records, replace=False))
+    order, px = addrs // n_px, addrs % n_px
+    is_w = rs.uniform(size=n_records) < WATER_FRACTION
+    r_m = np.where(is_w, rs.uniform(0.05, 1.0, n_records), rs.uniform(-0.3, -0.01, n_records))
+    r_c = rs.uniform(-0.05, 0.05, n_records)
+
+    columns = {"order": order,
+               "px": px,
+               "wavelength": get_wavelength(order, px),
+               "cls": np.where(is_w, "w", "z"),
+               "PCC": rs.uniform(0.5, 1.0, n_records),
+               "r_m": r_m,
+               "r_c": r_c,
+               "med_intensity": r_m * np.where(is_w, -0.3, 1.3) + r_c}
+    for name, dtype in telluric_db.COLUMNS:
+        columns[name] = columns[name].astype(dtype)
+    return telluric_db.Telluric_DB(columns)
@@ -0,0 +1,128 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import yaml
+
+import benchmark.report as report
+import benchmark.synthetic as synthetic
+import calibration
+import data_containers.shard as shi
+import load_store.read_argv as read_argv
+import load_store.read_db as read_db
+import reduce_batch
+import utility.stage_timer as stage_timer
+
+###########
+# Globals #
+###########
+
+# Default numbers of spectra and of orders to calibrate on
+DEFAULT_SPECTRA_COUNTS = [10, 100, 500, 2000]
+DEFAULT_ORDER_COUNTS = [1, 10, 61]
+
+# Orders of CHIRON calibrated on
+CHIRON_ORDERS = 61
+
+def benchmark_calibration():
+
+    '''
+    Times each stage of calibration on synthetic spectra.
+
+    python CRYSTAL/benchmark_calibration.py <report json> [<spectra counts> [<order counts>]]
+
+    Calibrates on synthetic CHIRON spectra (see benchmark/synthetic) for
+    each combination of the comma separated numbers of spectra and orders
+    given, e.g. 10,100 1,61. Each calibration runs in a fresh process with
+    the settings of config/config.yml, except that plots, the shard cache
+    and incremental calibration are disabled. The wall time and peak memory
+    of each stage of each calibration are written to the report as JSON.
+    If --baseline=<report json> is given, each calibration's speedup over
+    the same calibration in that report is added.
+    '''
+
+    # 1) LOAD SETTINGS
+    config = yaml.safe_load(file("config/config.yml", "r"))
+    report_filename, grid, baseline_filename = read_argv.benchmark_read_argv(
+        sys.argv, [("spectra counts", DEFAULT_SPECTRA_COUNTS),
+                   ("order counts", DEFAULT_ORDER_COUNTS)])
+    spectra_counts, order_counts = grid
+    reduce_batch.disable_plots(config)
+    config["shard_cache_path"] = None
+    config["incremental_calibration"] = False
+
+    # 2) CALIBRATE ON EACH SIZE OF SYNTHETIC DATA
+    # Spectra are generated once for each number of spectra, with every
+    # order, and calibrated on with each number of orders.
+    tellurics = synthetic.Synthetic_Tellurics(config)
+    work_path = tempfile.mkdtemp(prefix="crystal_benchmark_")
+    runs = []
+    try:
+        for n_spectra in spectra_counts:
+            spectra_path = os.path.join(work_path, "spectra")
+            st_time = time.time()
+            tellurics.write_spectra(spectra_path, n_spectra)
+            generation_time = time.time() - st_time
+
+            for n_orders in order_counts:
+                run_config = dict(config)
+                run_config["cal_spectra_path"] = spectra_path
+                run_config["cal_db_path"] = work_path
+                run_config["orders"] = choose_orders(n_orders, config)
+                run = report.run_in_child(time_calibration, run_config)
+                run.update({"n_spectra": n_spectra, "n_orders": n_orders,
+                            "orders": run_config["orders"],
+                            "generation_time": generation_time})
+                runs.append(run)
+                print "{} spectra, {} orders: {}".format(
+                    n_spectra, n_orders, "{:.2f}s".format(run["wall_time"]) if "error" not in run
+                    else "FAILED\n" + run["error"])
+            shutil.rmtree(spectra_path)
+    finally:
+        shutil.rmtree(work_path)
+
+    # 3) WRITE REPORT
+    if baseline_filename is not None:
+        report.compare_to_baseline(runs, baseline_filename, ["n_spectra", "orders"], "wall_time")
+    report.write_report(report_filename, "calibration",
+                        {"workers": config["workers"], "io_threads": config["io_threads"],
+                         "keep_lin_y": config["keep_lin_y"]}, runs)
+
+def choose_orders(n_orders, config):
+
+    '''
+    Returns n_orders orders to calibrate on.
+
+    The orders of the calibrators are always included, and the rest are
+    spread evenly over CHIRON's orders.
+    '''
+
+    orders = set(calibrator[0][shi.ORD_IND] for calibrator in config["calibrators"])
+    spread = np.round(np.linspace(0, CHIRON_ORDERS - 1, n_orders)).astype(int).tolist()
+    for order in spread + range(CHIRON_ORDERS):
+        if len(orders) >= n_orders:
+            break
+        orders.add(order)
+    return sorted(orders)
+
+def time_calibration(config):
+
+    '''
+    Calibrates with config, and returns the time and memory of each stage.
+
+    The number of records in the database calibration writes is also
+    returned, as a check that tellurics were found in the synthetic data.
+    '''
+
+    timer = stage_timer.Stage_Timer()
+    calibration.calibration(config, timer)
+    run = timer.get_report()
+    run["n_db_records"] = len(read_db.read_db(config))
+    return run
+
+
+if __name__ == "__main__":
+    benchmark_calibration()
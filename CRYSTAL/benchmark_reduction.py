@@ -0,0 +1,165 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import yaml
+
+import benchmark.report as report
+import benchmark.synthetic as synthetic
+import load_store.load_fits as load_fits
+import load_store.read_argv as read_argv
+import load_store.read_db as read_db
+import load_store.write_db as write_db
+import load_store.write_spectrum as write_spectrum
+import model.fit_model as fit_model
+import model.generate_model as generate_model
+import preprocessing.divide_orders as divide_orders
+import preprocessing.normalize as normalize
+import preprocessing.x_correlate as x_correlate
+import reduce_batch
+
+###########
+# Globals #
+###########
+
+# Default numbers of db records (from the size of example_telluric_db.csv to
+# a record for every pixel of the CCD) and of calibration pixels
+DEFAULT_DB_SIZES = [6101, 25000, 100000, 198400]
+DEFAULT_CAL_COUNTS = [5, 20, 50, 200]
+
+def benchmark_reduction():
+
+    '''
+    Times each step of reduction against synthetic telluric dbs.
+
+    python CRYSTAL/benchmark_reduction.py <report json> [<db sizes> [<calibrator counts>]]
+
+    For each comma separated number of db records, e.g. 6101,198400, a
+    synthetic telluric db is generated (see benchmark/synthetic) and
+    reading it (as csv and binary), generate_model and write_spectrum (as
+    csv and binary) are timed. For each number of calibration pixels,
+    x_correlate and fit_model.get_mu are timed with that many of the db's
+    water pixels as calibrators, against a synthetic science spectrum.
+    Times are the best of repeated calls, with the db's indexes already
+    built (reads include building them.)
+
+    The report holds each time and, for each function, the exponent of the
+    power law its time follows in the number of records and the number of
+    calibration pixels. If --baseline=<report json> is given, each time's
+    speedup over the same time in that report is added.
+    '''
+
+    # 1) LOAD SETTINGS AND SCIENCE SPECTRUM
+    # The science spectrum is loaded and normalized once, in every order.
+    config = yaml.safe_load(file("config/config.yml", "r"))
+    report_filename, grid, baseline_filename = read_argv.benchmark_read_argv(
+        sys.argv, [("db sizes", DEFAULT_DB_SIZES), ("calibrator counts", DEFAULT_CAL_COUNTS)])
+    db_sizes, cal_counts = grid
+    reduce_batch.disable_plots(config)
+    config["orders"] = "all"
+
+    work_path = tempfile.mkdtemp(prefix="crystal_benchmark_")
+    runs = []
+    try:
+        sci_filename = os.path.join(work_path, "sci.fits")
+        synthetic.Synthetic_Tellurics(config).write_spectrum(sci_filename, 0.8, 1.3, seed=0)
+        shards = divide_orders.divide_orders(
+            load_fits.load_fits_orders([sci_filename], config, add_path=False), config)
+        normalize.normalize(shards)
+        shard_orders = set(shard.order for shard in shards.itervalues())
+
+        # 2) TIME EACH STEP ON EACH SIZE OF DB
+        for n_records in db_sizes:
+            db = synthetic.gen_db(n_records, config)
+            db_filename = os.path.join(work_path, "db")
+            write_db.write_csv_db(db, db_filename + ".csv")
+            write_db.write_binary_db(db, db_filename + write_db.BINARY_EXT)
+
+            def time_run(name, func, *args, **kwargs):
+                run_time, n_repeats, result = report.time_function(func, *args)
+                runs.append({"function": name, "n_records": n_records,
+                             "n_cal_pxs": kwargs.get("n_cal_pxs"), "time": run_time,
+                             "repeats": n_repeats})
+                print "{:<24} records:{:<7} cal pxs:{:<5} {:.6f}s".format(
+                    name, n_records, kwargs.get("n_cal_pxs"), run_time)
+                return result
+
+            time_run("read_db (csv)", read_and_index_db, db_filename + ".csv")
+            db = time_run("read_db (binary)", read_and_index_db,
+                          db_filename + write_db.BINARY_EXT)
+            model = time_run("generate_model", generate_model.generate_model, -0.3, 1.3, db,
+                             config)
+            time_run("write_spectrum (csv)", write_spectrum.write_csv_spectrum,
+                     os.path.join(work_path, "sci_tel.csv"), model)
+            time_run("write_spectrum (binary)", write_spectrum.write_binary_spectrum,
+                     os.path.join(work_path, "sci_tel.npy"), model)
+
+            for n_cal_pxs in cal_counts:
+                cal_pxs = choose_cal_pxs(db, n_cal_pxs, shard_orders)
+                shift = time_run("x_correlate", x_correlate.x_correlate, cal_pxs, shards, db,
+                                 config, n_cal_pxs=n_cal_pxs)
+                time_run("get_mu", fit_model.get_mu, cal_pxs, shift, shards, db, config,
+                         n_cal_pxs=n_cal_pxs)
+    finally:
+        shutil.rmtree(work_path)
+
+    # 3) WRITE REPORT
+    if baseline_filename is not None:
+        report.compare_to_baseline(runs, baseline_filename,
+                                   ["function", "n_records", "n_cal_pxs"], "time")
+    report.write_report(report_filename, "reduction",
+                        {"x_corr_shift": config["x_corr_shift"],
+                         "x_corr_mode": config["x_corr_mode"]},
+                        runs, {"scaling": get_scaling(runs)})
+
+def read_and_index_db(filename):
+
+    '''
+    Reads a telluric db and builds its (order, px) index.
+    '''
+
+    db = read_db.read_db_file(filename)
+    db.get_keys()
+    return db
+
+def choose_cal_pxs(db, n_cal_pxs, orders):
+
+    '''
+    Returns n_cal_pxs random water pixels of db in orders, as (order, px).
+    '''
+
+    rows = np.nonzero((db.cls == b"w") & np.in1d(db.order, list(orders)))[0]
+    rows = np.sort(np.random.RandomState(0).choice(rows, min(n_cal_pxs, len(rows)),
+                                                   replace=False))
+    return zip(db.order[rows].tolist(), db.px[rows].tolist())
+
+def get_scaling(runs):
+
+    '''
+    Summarizes how each function's time scales with the db and calibrator sizes.
+
+    For each function, returns the exponent of the power law its time
+    follows in the number of records (at the largest number of calibration
+    pixels, if it takes calibration pixels), and in the number of
+    calibration pixels (at the largest number of records.)
+    '''
+
+    scaling = {}
+    for function in sorted(set(run["function"] for run in runs)):
+        f_runs = [run for run in runs if run["function"] == function]
+        max_records = max(run["n_records"] for run in f_runs)
+        max_cal_pxs = max(run["n_cal_pxs"] for run in f_runs)
+        by_records = [run for run in f_runs if run["n_cal_pxs"] == max_cal_pxs]
+        by_cal_pxs = [run for run in f_runs if run["n_records"] == max_records]
+        scaling[function] = {
+            "records_exponent": report.get_scaling_exponent(
+                [run["n_records"] for run in by_records], [run["time"] for run in by_records]),
+            "cal_pxs_exponent": None if max_cal_pxs is None else report.get_scaling_exponent(
+                [run["n_cal_pxs"] for run in by_cal_pxs], [run["time"] for run in by_cal_pxs])}
+    return scaling
+
+
+if __name__ == "__main__":
+    benchmark_reduction()
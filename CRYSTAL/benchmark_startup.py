@@ -0,0 +1,100 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import benchmark.report as report
+import load_store.read_argv as read_argv
+
+###########
+# Globals #
+###########
+
+# Entry points timed, as the module each script runs
+ENTRY_POINTS = ["calibration", "generate_telluric_model", "reduce_batch", "reduction_service",
+                "plot_telluric_db", "plot_telluric_range", "convert_telluric_db"]
+
+# Packages which are slow to import, reported if an entry point imports them
+HEAVY_PACKAGES = ["astropy", "matplotlib", "scipy"]
+
+# Default number of times each entry point is started
+DEFAULT_REPEATS = 5
+
+# Run in a fresh interpreter to time importing an entry point. Prints the
+# time the import took and the top level packages imported, as JSON.
+IMPORT_CODE = """
+import json, sys, time
+st_time = time.time()
+sys.path.insert(0, {path!r})
+import {module}
+import_time = time.time() - st_time
+print(json.dumps({{"import_time": import_time,
+                  "packages": sorted(set(name.split(".")[0] for name in sys.modules))}}))
+"""
+
+def benchmark_startup():
+
+    '''
+    Times how long each entry point takes to start, before it does any work.
+
+    python CRYSTAL/benchmark_startup.py <report json> [<repeats>]
+
+    Each entry point's module is imported in a fresh interpreter, repeats
+    times (by default 5). The report holds, for each entry point, the best
+    and median time of the import, the best time of the whole interpreter
+    run (including starting and stopping the interpreter), and the slow to
+    import packages (HEAVY_PACKAGES) the import pulled in. A bare
+    interpreter run is timed too, as "python". If --baseline=<report json>
+    is given, each entry point's speedup over that report is added.
+    '''
+
+    # 1) LOAD SETTINGS
+    report_filename, grid, baseline_filename = read_argv.benchmark_read_argv(
+        sys.argv, [("repeats", [DEFAULT_REPEATS])])
+    repeats = max(grid[0])
+    path = os.path.dirname(os.path.abspath(__file__))
+
+    # 2) TIME EACH ENTRY POINT
+    runs = [time_startup("python", "pass", repeats)]
+    for module in ENTRY_POINTS:
+        runs.append(time_startup(module, IMPORT_CODE.format(path=path, module=module),
+                                 repeats))
+    for run in runs:
+        print "{:<24} import:{:.3f}s  process:{:.3f}s  {}".format(
+            run["entry_point"], run["import_time"], run["process_time"],
+            ", ".join(run["heavy_packages"]))
+
+    # 3) WRITE REPORT
+    if baseline_filename is not None:
+        report.compare_to_baseline(runs, baseline_filename, ["entry_point"], "import_time")
+    report.write_report(report_filename, "startup", {"repeats": repeats}, runs)
+
+def time_startup(entry_point, code, repeats):
+
+    '''
+    Runs code in a fresh interpreter repeats times, and returns its timings.
+    '''
+
+    import_times, process_times = [], []
+    packages = []
+    for i in range(repeats):
+        st_time = time.time()
+        output = subprocess.check_output([sys.executable, "-c", code])
+        process_times.append(time.time() - st_time)
+        if output.strip():
+            result = json.loads(output.strip().splitlines()[-1])
+            import_times.append(result["import_time"])
+            packages = result["packages"]
+
+    return {"entry_point": entry_point,
+            "import_time": min(import_times) if import_times else 0.0,
+            "median_import_time": float(np.median(import_times)) if import_times else 0.0,
+            "process_time": min(process_times),
+            "heavy_packages": [package for package in HEAVY_PACKAGES if package in packages]}
+
+
+if __name__ == "__main__":
+    benchmark_startup()
@@ -1,17 +1,59 @@
+import functools
+
 import yaml
 
 import load_store.load_fits as load_fits
+import load_store.read_stats as read_stats
+import load_store.shard_cache as shard_cache
 import load_store.write_db as write_db
+import load_store.write_stats as write_stats
 import model.cluster_analysis as cluster_analysis
 import model.regression_model as regression_model
+import model.sufficient_stats as sufficient_stats
 import model.telluric_identification as telluric_id
 import preprocessing.divide_orders as divide_orders
 import preprocessing.normalize as normalize
+import utility.parallel as parallel
+import utility.stage_timer as stage_timer
 import visualize.plot_PCCs as plot_PCCs
 import visualize.plot_regressions as plot_regressions
 import visualize.plot_shards as plot_shards
+import visualize.render as render
+
+def calibration(config=None, timer=None):
+
+    '''
+    Learns a telluric model from the calibration spectra and writes it to the db.
+
+    config defaults to config/config.yml. If a Stage_Timer is given, each
+    numbered stage below is timed with it. Otherwise, they are timed as
+    config's instrumentation settings ask (see utility/stage_timer), and a
+    run report is written at the end. If config's render_path is set, plots
+    render to files in the background (see visualize/render) and
+    calibration returns once they have all rendered.
+    '''
+
+    if config is None:
+        config = yaml.safe_load(file("config/config.yml", "r"))
+    is_run_report = timer is None
+    if is_run_report:
+        timer = stage_timer.get_timer(config)
+    render.start_renderer(config, "calibration")
+    if config["incremental_calibration"]:
+        incremental_calibration(config, timer)
+    else:
+        full_calibration(config, timer)
+    render.stop_renderer()
+    if is_run_report:
+        stage_timer.write_run_report(timer, "calibration", config,
+                                     {"orders": config["orders"],
+                                      "incremental": config["incremental_calibration"]})
 
-def calibration():
+def full_calibration(config, timer):
+
+    '''
+    Learns a telluric model from all of the calibration spectra.
+    '''
 
     # 1) LOAD DATA
     # Load external data for calibration. External data is: i) configuration
@@ -19,18 +61,31 @@ def calibration():
     # spectra. Loads calibration spectra contents into a data container for 
     # each order. These data containers are called shards. Produces a 
     # dictionary linking each processed order to its shard.
-    config = yaml.safe_load(file("config/config.yml", "r"))
+    timer.start("LOAD")
+    # If the calibration spectra's normalized shards are cached, they are 
+    # read from the cache instead, and loading and preprocessing are skipped.
     filenames = load_fits.get_fits_filenames_at_path(config)
-    order_shards = load_fits.load_fits_orders(filenames, config)
-    plot_shards.plot_shards(order_shards, "wavelength", "log", config["plot_spectra_by_order"])
+    cache_key = shard_cache.get_cache_key(filenames, config)
+    shards = shard_cache.read_shards(cache_key, config)
+    is_cached = shards is not None
+    if not is_cached:
+        order_shards = load_fits.load_fits_orders(filenames, config)
+        plot_shards.plot_shards(order_shards, "wavelength", "log", config["plot_spectra_by_order"])
 
     # 2) PREPROCESS DATA
     # i)  Subdivide each order shard into smaller shards based on sharding configuration given in
     #     the config file.
-    # ii) Normalize each smaller shard.
-    shards = divide_orders.divide_orders(order_shards, config)
-    plot_shards.plot_shards(shards, "wavelength", "log", config["plot_spectra_by_shard"])
-    normalize.normalize(shards)
+    # ii) Normalize each smaller shard, and cache the normalized shards.
+    # Steps 2-6 process each shard independently. Each chain of these steps
+    # between plots is run on all shards by a pool of config's workers.
+    timer.start("PREPROCESS")
+    if not is_cached:
+        shards = divide_orders.divide_orders(order_shards, config)
+        plot_shards.plot_shards(shards, "wavelength", "log", config["plot_spectra_by_shard"])
+    shard_pool = parallel.Shard_Pool(shards, config, timer)
+    if not is_cached:
+        shard_pool.run([normalize.normalize])
+        shard_cache.write_shards(cache_key, shards, config)
     plot_shards.plot_shards(shards, "wavelength", "log", config["plot_normalized_shards"], 
                             "after normalization")
 
@@ -41,39 +96,128 @@ def calibration():
     # iv)  Remove all telluric clusters not in the shape of a Gaussian trough.
     # v)   Remove all telluric clusters more than 1nm from another cluster.
     # vi)  Mark each cluster as non-water, water, or both.
+    timer.start("IDENTIFY")
     calibrators = telluric_id.generate_calibrators(shards, config)
-    k = telluric_id.compute_PCC_threshold(config["p_value"], config["threshold_k_db_path"])
-    telluric_id.flag_high_PCC_pixels(calibrators, k, shards, config)
-    cluster_analysis.identify_clusters(shards)
+    k = telluric_id.compute_PCC_threshold(config["p_value"], len(calibrators[0]), config)
+    shard_pool.run([functools.partial(telluric_id.flag_high_PCC_pixels, calibrators, k, 
+                                      config=config),
+                    cluster_analysis.identify_clusters])
     plot_PCCs.plot_PCCs(shards, "water", config["plot_water_PCCs"])
     plot_PCCs.plot_PCCs(shards, "airmass", config["plot_z_PCCs"])
     plot_PCCs.plot_PCCs_flag_sig(shards, "water", config["plot_water_PCCs_flag_sig"])
     plot_PCCs.plot_PCCs_flag_sig(shards, "airmass", config["plot_z_PCCs_flag_sig"])
-    cluster_analysis.remove_1_and_2_pixel_clusters(shards)
-    cluster_analysis.remove_non_trough_clusters(shards, config)
-    cluster_analysis.remove_isolated_clusters(shards)
+    shard_pool.run([cluster_analysis.remove_1_and_2_pixel_clusters,
+                    functools.partial(cluster_analysis.remove_non_trough_clusters, config=config),
+                    cluster_analysis.remove_isolated_clusters])
     
     # 4) EXPAND CLUSTERS
     # Expand each cluster by one pixel on either side to pick up pixels in its line's tail.
-    cluster_analysis.expand_clusters(shards)
+    timer.start("EXPAND")
+    shard_pool.run([cluster_analysis.expand_clusters])
     fp_ttl = "w/ fp removal (& expansion)"
     plot_PCCs.plot_PCCs_flag_sig(shards, "water", config["plot_water_PCCs_flag_sig_no_fp"], fp_ttl)
     plot_PCCs.plot_PCCs_flag_sig(shards, "airmass", config["plot_z_PCCs_flag_sig_no_fp"], fp_ttl)
 
     # 5) RESOLVE OVERLAPPING CLUSTERS
     # Resolve overlapping water and non-water clusters.
-    cluster_analysis.resolve_same_class_overlapping_clusters(shards)
-    cluster_analysis.resolve_diff_class_overlapping_clusters(shards)
+    timer.start("RESOLVE")
+    shard_pool.run([cluster_analysis.resolve_same_class_overlapping_clusters,
+                    cluster_analysis.resolve_diff_class_overlapping_clusters])
     plot_PCCs.plot_px_classification(shards, config["plot_px_classification"])
 
     # 6) GENERATE REGRESSION MODEL
     # Generate a regression model for each telluric pixel.
-    regression_model.find_regression_coeffs(shards, calibrators)
+    timer.start("REGRESSION")
+    shard_pool.run([functools.partial(regression_model.find_regression_coeffs, 
+                                      calibrators=calibrators)])
+    shard_pool.close()
     plot_regressions.plot_regressions(calibrators, shards, config)
     
     # 7) WRITE MODEL TO DATABASE
     # Write out model to database.
+    timer.start("WRITE")
     write_db.write_db(shards, calibrators, config)
-    
+    timer.stop()
+
+def incremental_calibration(config, timer):
+
+    '''
+    Updates the telluric model with calibration spectra new since the last run.
+
+    Instead of recalibrating from every spectrum, keeps running sums of each
+    pixel's statistics against the water calibrator and airmass on disk (see
+    data_containers/shard_stats), and only loads and sums spectra not yet
+    summed. If a spectrum already summed has been rewritten or removed
+    since, or the orders or shard ranges have changed, the sums are rebuilt
+    from every spectrum at the calibration path. PCCs, regression models and coadds are computed from the sums,
+    and cluster analysis and the database are rerun on them.
+    '''
+
+    # 1) LOAD DATA
+    # Load the statistics of the spectra summed so far, and the spectra at
+    # the calibration path not yet summed. The sums are discarded if any
+    # spectrum in them has changed or gone, or if they are of different
+    # shards than the config divides the orders into.
+    timer.start("LOAD")
+    summed_filenames, summed_signatures, shard_stats = read_stats.read_stats(config)
+    path_filenames = load_fits.get_fits_filenames_at_path(config)
+    changed = [filename for filename, signature in zip(summed_filenames, summed_signatures)
+               if filename not in path_filenames
+               or load_fits.get_file_signature(filename, config) != signature]
+    shard_addrs = divide_orders.get_shard_addrs(load_fits.get_orders(config), config)
+    if changed:
+        print "Rebuilding calibration stats: {} changed or removed since summed".format(
+            ", ".join(changed))
+        summed_filenames, summed_signatures, shard_stats = [], [], {}
+    elif summed_filenames and set(shard_stats.keys()) != shard_addrs:
+        print "Rebuilding calibration stats: orders or shard ranges changed since summed"
+        summed_filenames, summed_signatures, shard_stats = [], [], {}
+    filenames = [filename for filename in path_filenames if filename not in summed_filenames]
+    signatures = [load_fits.get_file_signature(filename, config) for filename in filenames]
+
+    # 2) PREPROCESS AND SUM NEW DATA
+    # Shard and normalize the new spectra, then add them and their 
+    # calibrators to the statistics.
+    timer.start("PREPROCESS")
+    if filenames:
+        order_shards = load_fits.load_fits_orders(filenames, config)
+        new_shards = divide_orders.divide_orders(order_shards, config)
+        normalize.normalize(new_shards)
+        new_calibrators = telluric_id.generate_calibrators(new_shards, config)
+        sufficient_stats.add_spectra(shard_stats, new_shards, new_calibrators)
+        write_stats.write_stats(summed_filenames + filenames, summed_signatures + signatures,
+                                shard_stats, config)
+
+    # 3) IDENTIFY TELLURIC PIXELS
+    # Identify pixels with significant PCC from the statistics, then run 
+    # cluster analysis as in calibration.
+    timer.start("IDENTIFY")
+    shards = sufficient_stats.get_shards(shard_stats)
+    k = telluric_id.compute_PCC_threshold(config["p_value"], 
+                                          len(summed_filenames) + len(filenames), config)
+    sufficient_stats.flag_high_PCC_pixels(k, shards)
+    cluster_analysis.identify_clusters(shards)
+    cluster_analysis.remove_1_and_2_pixel_clusters(shards)
+    cluster_analysis.remove_non_trough_clusters(shards, config)
+    cluster_analysis.remove_isolated_clusters(shards)
+
+    # 4) EXPAND CLUSTERS
+    timer.start("EXPAND")
+    cluster_analysis.expand_clusters(shards)
+
+    # 5) RESOLVE OVERLAPPING CLUSTERS
+    timer.start("RESOLVE")
+    cluster_analysis.resolve_same_class_overlapping_clusters(shards)
+    cluster_analysis.resolve_diff_class_overlapping_clusters(shards)
+
+    # 6) GENERATE REGRESSION MODEL
+    timer.start("REGRESSION")
+    sufficient_stats.find_regression_coeffs(shards)
+
+    # 7) WRITE MODEL TO DATABASE
+    timer.start("WRITE")
+    write_db.write_db(shards, None, config)
+    timer.stop()
+
 if __name__ == "__main__":
     calibration()
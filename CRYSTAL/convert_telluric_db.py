@@ -0,0 +1,24 @@
+import sys
+
+import load_store.read_argv as read_argv
+import load_store.read_db as read_db
+import load_store.write_db as write_db
+
+def convert_telluric_db():
+
+    '''
+    Converts a telluric database between the csv and binary formats.
+
+    The format of each database is given by its filename's extension:
+    databases ending in .tdb are binary, others are csv. E.g.
+
+    python CRYSTAL/convert_telluric_db.py example_telluric_db.csv example_telluric_db.tdb
+    '''
+
+    in_filename, out_filename = read_argv.convert_telluric_db_read_argv(sys.argv)
+    db = read_db.read_db_file(in_filename)
+    write_db.write_db_file(db, out_filename)
+
+
+if __name__ == "__main__":
+    convert_telluric_db()
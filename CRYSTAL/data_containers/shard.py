@@ -42,9 +42,43 @@ class Shard():
     hi_pixel: int
         (see parameters)
 
+    filenames: list (string)
+        The calibration filenames in the fixed order in which their spectra
+        are stored in the rows of lin_x, lin_y, log_y and z.
+
+    lin_x: array (float)
+        Wavelength data cube, with a row for each spectrum and a column for
+        each pixel in the shard.
+
+    lin_y: array (float)
+        Intensity data cube in linear space (see lin_x). None if linear
+        intensities were not kept after computing log_y.
+
+    log_y: array (float)
+        Intensity data cube in log space (see lin_x). Read only: it is only
+        changed through set_log_y, so that the shard's derived products are
+        recomputed when it changes.
+
+    log_y_version: int
+        The number of times log_y has been changed by set_log_y.
+
+    derived: dict
+        Maps the name of each product derived from the shard's spectra (e.g.
+        its coadded spectrum) to the log_y_version it was computed for and 
+        its value (see get_derived).
+
+    z: array (float)
+        The airmass of each spectrum.
+
     spectra: dict
         A dictionary mapping each calibration filename to a Spectrum_Data 
-        object which contains its data.
+        object which contains its data. Each Spectrum_Data object's arrays
+        are views of its row of the shard's data cubes.
+
+    stats: Shard_Stats
+        The sufficient statistics of the shard's calibration spectra if the 
+        shard was built from them in incremental calibration, and None 
+        otherwise (see data_containers/shard_stats).
 
     w_PCCs: list (floats)
         The PCC of each pixel in the shard with the water calibrator.
@@ -52,8 +86,9 @@ class Shard():
     w_tel: list (booleans)
         Flags denoting whether each pixel has a water telluric component.
 
-    w_clusters: list (tuples)
-        Tuples giving the range of each cluster of water pixels in a spectrum.
+    w_clusters: array (int)
+        An (n x 2) array whose rows give the range (start_px, end_px) of each
+        cluster of water pixels in a spectrum.
         Note that w, z, and composite clusters are non-overlapping after 
         processing.
 
@@ -63,25 +98,26 @@ class Shard():
     z_tel: list (booleans)
         Flags denoting whether each pixel has an air telluric component.
 
-    z_clusters: list (tuples)
-        Tuples giving the range of each cluster of z pixels in a spectrum.
+    z_clusters: array (int)
+        An (n x 2) array whose rows give the range of each cluster of z pixels
+        in a spectrum.
         Note that w, z, and composite clusters are non-overlapping after
         processing.
 
-    c_clusters: list (tuples)
-        Tuples giving the range of each cluster of composite w-z pixels in a 
-        spectrum. Note that w, z, and composite clusters are non-overlapping
-        after processing.
+    c_clusters: array (int)
+        An (n x 2) array whose rows give the range of each cluster of 
+        composite w-z pixels in a spectrum. Note that w, z, and composite
+        clusters are non-overlapping after processing.
 
-    w_coeffs: dict (int -> tuple)
-        Maps each water telluric pixel to a tuple containg the coeffcients
-        in its linear regression model against the selected calibration 
-        pixel. The tuple, t, represents the coefficients in the regression
-        as y = t[0]*x + t[1].
+    w_coeffs: array (float)
+        Row i holds the coefficients in pixel i's linear regression model 
+        against the selected calibration pixel if it is a water telluric
+        pixel, and is nan otherwise. The row, t, represents the coefficients
+        in the regression as y = t[0]*x + t[1].
 
-    z_coeffs: dict (int -> tuple)
-        Maps each water telluric pixel to a tuple containg the coeffcients
-        in its linear regression model against airmass (see w_coeffs).
+    z_coeffs: array (float)
+        Row i holds the coefficients in pixel i's linear regression model
+        against airmass if it is a non-water telluric pixel (see w_coeffs).
     '''
 
     def __init__(self, order, lo_px, hi_px):
@@ -89,16 +125,79 @@ class Shard():
         self.lo_px = lo_px
         self.hi_px = hi_px
 
+        self.filenames = []
+        self.lin_x = None
+        self.lin_y = None
+        self.log_y = None
+        self.log_y_version = 0
+        self.derived = {}
+        self.z = None
         self.spectra = {}
+        self.stats = None
         self.w_PCCs = np.zeros(hi_px - lo_px) + NULL_INT
         self.w_tel = np.zeros(hi_px - lo_px, dtype=bool)
-        self.w_clusters = []
+        self.w_clusters = np.zeros((0, 2), dtype=int)
         self.z_PCCs = np.zeros(hi_px - lo_px) + NULL_INT
         self.z_tel = np.zeros(hi_px - lo_px, dtype=bool)
-        self.z_clusters = []
-        self.c_clusters = []
-        self.w_coeffs = {}
-        self.z_coeffs = {}
+        self.z_clusters = np.zeros((0, 2), dtype=int)
+        self.c_clusters = np.zeros((0, 2), dtype=int)
+        self.w_coeffs = np.zeros((hi_px - lo_px, 2)) + np.nan
+        self.z_coeffs = np.zeros((hi_px - lo_px, 2)) + np.nan
+
+    def set_spectra(self, filenames, lin_x, lin_y, log_y, z):
+
+        '''
+        Stores the shard's data cubes and builds a view of each spectrum.
+
+        Row i of lin_x, lin_y and log_y and entry i of z hold the data of
+        filenames[i]. No data is copied, so slices of a larger shard's cubes
+        can be stored as views of it. The shard stores a read only view of 
+        log_y.
+        '''
+
+        self.filenames = list(filenames)
+        self.lin_x = lin_x
+        self.lin_y = lin_y
+        self.log_y = log_y.view()
+        self.log_y.flags.writeable = False
+        self.log_y_version += 1
+        self.z = z
+        self.spectra = {}
+        for i, filename in enumerate(self.filenames):
+            spectrum_lin_y = None if lin_y is None else lin_y[i]
+            self.spectra[filename] = Spectrum_Data(lin_x[i], spectrum_lin_y, self.log_y[i], z[i])
+
+    def set_log_y(self, log_y):
+
+        '''
+        Overwrites the shard's log intensity cube in place with log_y.
+
+        Every change to the shard's log intensities goes through here, and
+        invalidates any products derived from them.
+        '''
+
+        self.log_y.flags.writeable = True
+        self.log_y[:] = log_y
+        self.log_y.flags.writeable = False
+        self.log_y_version += 1
+
+    def get_derived(self, name, compute):
+
+        '''
+        Returns the product of the shard's spectra called name.
+
+        The product is computed by calling compute(shard) the first time it
+        is asked for, and again only after log_y has changed. Products are
+        shared by every caller, so they are returned read only.
+        '''
+
+        if name in self.derived and self.derived[name][0] == self.log_y_version:
+            return self.derived[name][1]
+        value = compute(self)
+        for array in (value if isinstance(value, tuple) else (value,)):
+            array.flags.writeable = False
+        self.derived[name] = (self.log_y_version, value)
+        return value
 
 class Spectrum_Data():
 
@@ -112,7 +211,7 @@ class Spectrum_Data():
         Spectrum wavelength data
     
     lin_y: array (float)
-        Spectrum intensity data in linear space
+        Spectrum intensity data in linear space (None if not kept)
 
     log_y: array (float)
         Spectrum intensity data in log space
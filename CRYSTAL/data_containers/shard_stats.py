@@ -0,0 +1,72 @@
+import numpy as np
+
+class Shard_Stats():
+
+    '''
+    Holds the sufficient statistics of the calibration spectra in a shard.
+
+    The PCCs, regression models and coadded spectrum of a shard's pixels
+    can all be computed from a handful of running sums over its spectra.
+    Adding a new spectrum to the calibration only requires adding its 
+    values to these sums.
+
+    Parameters
+    ----------
+    order: int
+        The Echelle order the shard's data comes from.
+
+    lo_px: int
+        The low pixel number in the shard's range of pixels.
+
+    hi_px: int
+        The high pixel number in the shard's range of pixels.
+
+    Attributes
+    ----------
+    order: int
+        (see parameters)
+
+    lo_px: int
+        (see parameters)
+
+    hi_px: int
+        (see parameters)
+
+    n: int
+        The number of spectra summed.
+
+    w_sum, w_sq_sum: float
+        The sum of the water calibrator over the spectra, and of its square.
+
+    z_sum, z_sq_sum: float
+        The sum of the spectra's airmasses, and of their squares.
+
+    wv_sum: array (float)
+        The sum of each pixel's wavelength over the spectra.
+
+    y_sum, y_sq_sum: array (float)
+        The sum of each pixel's log intensity over the spectra, and of its
+        square.
+
+    wy_sum: array (float)
+        The sum of each pixel's log intensity times the water calibrator.
+
+    zy_sum: array (float)
+        The sum of each pixel's log intensity times airmass.
+    '''
+
+    def __init__(self, order, lo_px, hi_px):
+        self.order = order
+        self.lo_px = lo_px
+        self.hi_px = hi_px
+
+        self.n = 0
+        self.w_sum = 0.0
+        self.w_sq_sum = 0.0
+        self.z_sum = 0.0
+        self.z_sq_sum = 0.0
+        self.wv_sum = np.zeros(hi_px - lo_px)
+        self.y_sum = np.zeros(hi_px - lo_px)
+        self.y_sq_sum = np.zeros(hi_px - lo_px)
+        self.wy_sum = np.zeros(hi_px - lo_px)
+        self.zy_sum = np.zeros(hi_px - lo_px)
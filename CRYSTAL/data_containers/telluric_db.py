@@ -0,0 +1,188 @@
+import numpy as np
+
+###########
+# Globals #
+###########
+
+# The name and type of each column of the telluric db, in the order of the
+# fields of its records (see load_store/db_indicies).
+COLUMNS = [("order", np.dtype("<i4")),
+           ("px", np.dtype("<i4")),
+           ("wavelength", np.dtype("<f8")),
+           ("cls", np.dtype("S1")),
+           ("PCC", np.dtype("<f8")),
+           ("r_m", np.dtype("<f8")),
+           ("r_c", np.dtype("<f8")),
+           ("med_intensity", np.dtype("<f8"))]
+
+# Each record's key is order * KEY_BASE + px. KEY_BASE is larger than any
+# pixel number, so records sorted by order and then by pixel have sorted keys.
+KEY_BASE = 1 << 20
+
+class Telluric_DB():
+
+    '''
+    Holds the telluric database as a set of columns.
+
+    The database has a record for each telluric pixel, sorted by order and
+    then by pixel. Each column holds one field of every record, so a column
+    can be a view of a memory mapped database file, and the database can be
+    opened without reading its records.
+
+    Iterating over the database yields each record as a list of its fields
+    in the order given in load_store/db_indicies. The list of records is
+    only built the first time the database is iterated over.
+
+    Records are looked up by row, the index of the record in the columns.
+    The database indexes the row of each (order, px) and the range of rows
+    of each shard, so reductions can select records with array lookups
+    rather than by scanning every record.
+
+    Parameters
+    ----------
+    columns: dict
+        Maps the name of each column in COLUMNS to an array of its values.
+
+    order_offsets: dict
+        Maps each order in the database to the range [start, end) of the
+        rows of its records. Computed from the order column if not given.
+
+    Attributes
+    ----------
+    order, px, wavelength, cls, PCC, r_m, r_c, med_intensity: array
+        The columns of the database. cls holds each record's class code:
+        "w" for water, "z" for non-water and "c" for composite.
+
+    order_offsets: dict
+        (see parameters)
+
+    keys: array
+        The key of each record (see KEY_BASE.) Computed on first lookup.
+
+    shard_rows: dict
+        Maps each (order, lo_px, hi_px) range looked up to the range
+        [start, end) of the rows of its records.
+    '''
+
+    def __init__(self, columns, order_offsets=None):
+        for name, dtype in COLUMNS:
+            setattr(self, name, columns[name])
+
+        if order_offsets is None:
+            orders, starts = np.unique(self.order, return_index=True)
+            ends = np.append(starts[1:], len(self.order))
+            order_offsets = dict((int(order), (int(start), int(end)))
+                                 for order, start, end in zip(orders, starts, ends))
+        self.order_offsets = order_offsets
+        self.records = None
+        self.keys = None
+        self.shard_rows = {}
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        if self.records is None:
+            self.records = [list(record) for record in
+                            zip(*[getattr(self, name).tolist() for name, dtype in COLUMNS])]
+        return iter(self.records)
+
+    def get_columns(self):
+
+        '''
+        Returns a dict mapping each column's name to its values.
+        '''
+
+        return dict((name, getattr(self, name)) for name, dtype in COLUMNS)
+
+    def get_keys(self):
+
+        '''
+        Returns the key of each record (see KEY_BASE.)
+        '''
+
+        if self.keys is None:
+            self.keys = self.order.astype(np.int64) * KEY_BASE + self.px
+        return self.keys
+
+    def get_rows(self, orders, pxs):
+
+        '''
+        Returns the row of the record of each (order, px), or -1 if it has none.
+        '''
+
+        keys = self.get_keys()
+        query_keys = np.asarray(orders, dtype=np.int64) * KEY_BASE + np.asarray(pxs)
+        rows = np.searchsorted(keys, query_keys)
+        is_found = rows < len(keys)
+        is_found[is_found] = keys[rows[is_found]] == query_keys[is_found]
+        return np.where(is_found, rows, -1)
+
+    def get_shard_rows(self, order, lo_px, hi_px):
+
+        '''
+        Returns the range [start, end) of rows of the records of a shard.
+
+        These are the records of order with lo_px <= px < hi_px.
+        '''
+
+        shard_addr = (order, lo_px, hi_px)
+        if shard_addr not in self.shard_rows:
+            keys = self.get_keys()
+            start, end = np.searchsorted(keys, [order * KEY_BASE + lo_px, order * KEY_BASE + hi_px])
+            self.shard_rows[shard_addr] = (int(start), int(end))
+        return self.shard_rows[shard_addr]
+
+    def get_calibrator_rows(self, cal_pxs):
+
+        '''
+        Returns the sorted rows of the water records of calibration pixels.
+
+        cal_pxs is a list of calibration pixels in the form (order, px).
+        Pixels without a water record are skipped.
+        '''
+
+        if len(cal_pxs) == 0:
+            return np.array([], dtype=int)
+        orders, pxs = zip(*cal_pxs)
+        rows = self.get_rows(orders, pxs)
+        rows = rows[rows >= 0]
+        return np.unique(rows[self.cls[rows] == b"w"])
+
+    def get_spectrum_log_y(self, rows, shift, shards):
+
+        '''
+        Returns a science spectrum's log intensity at the pixels of records.
+
+        The pixel of each record in rows is shifted by shift, and the log
+        intensity of the first spectrum of the shard containing the shifted
+        pixel is looked up. rows must be sorted. If shift is fractional, the
+        spectrum is linearly interpolated between the pixels either side of
+        each shifted pixel.
+
+        Returns the log intensity at each record, and a mask of the records
+        whose shifted pixel is in a shard (the log intensity of other
+        records is nan.)
+        '''
+
+        if shift != int(shift):
+            lo_shift = int(np.floor(shift))
+            frac = shift - lo_shift
+            lo_log_y, is_lo_found = self.get_spectrum_log_y(rows, lo_shift, shards)
+            hi_log_y, is_hi_found = self.get_spectrum_log_y(rows, lo_shift + 1, shards)
+            return (1 - frac)*lo_log_y + frac*hi_log_y, is_lo_found & is_hi_found
+
+        shift = int(shift)
+        rows = np.asarray(rows, dtype=int)
+        log_y = np.zeros(len(rows)) + np.nan
+        is_found = np.zeros(len(rows), dtype=bool)
+        for shard in shards.itervalues():
+            start, end = self.get_shard_rows(shard.order, shard.lo_px - shift,
+                                             shard.hi_px - shift)
+            lo, hi = np.searchsorted(rows, [start, end])
+            if lo == hi:
+                continue
+            spectrum = shard.spectra.itervalues().next()
+            log_y[lo:hi] = spectrum.log_y[self.px[rows[lo:hi]] + shift - shard.lo_px]
+            is_found[lo:hi] = True
+        return log_y, is_found
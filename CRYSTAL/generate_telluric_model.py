@@ -1,48 +1,89 @@
+import os
 import sys
 import yaml
 
 import load_store.load_fits as load_fits
 import load_store.read_db as read_db
+import load_store.shard_cache as shard_cache
 import load_store.write_spectrum as write_spectrum
 import model.fit_model as fit_model
 import model.get_calibrators as get_calibrators
 import model.generate_model as generate_model
-import model.telluric_identification as telluric_id
 import preprocessing.divide_orders as divide_orders
 import preprocessing.normalize as normalize
 import preprocessing.x_correlate as x_correlate
+import utility.stage_timer as stage_timer
 import visualize.plot_shards as plot_shards
 import visualize.plot_model as plot_model
+import visualize.render as render
 
 def generate_telluric_model():
 
-    # 0) DEFINE CONSTANTS
-    FILE_ARGIND = 1  #File to reduce is the first argument of the terminal call
-
     # 1) LOAD DATA
-    # Load external data for calibration. External data is: i) configuration
-    # file, ii) filename of spectrum to reduce, iii) content of calibration
-    # spectra. Loads calibration spectra contents into a data container for 
-    # each order. These data containers are called shards. Produces a 
-    # dictionary linking each processed order to its shard.
+    # Load external data for reduction. External data is: i) configuration
+    # file, ii) telluric database, iii) filename of spectrum to reduce. The
+    # calibration pixels are read from the configuration file.
+    # Reduction is timed as config's instrumentation settings ask (see
+    # utility/stage_timer), and a run report is written at the end. Plots
+    # render to files in the background if config's render_path is set 
+    # (see visualize/render.)
     config = yaml.safe_load(file("config/config.yml", "r"))
+    timer = stage_timer.get_timer(config)
+    filename = load_fits.get_fits_filename_from_argv(sys.argv)[0]
+    render.start_renderer(config, os.path.splitext(os.path.basename(filename))[0])
+    timer.start("LOAD DB")
     db = read_db.read_db(config)
-    filenames = load_fits.get_fits_filename_from_argv(sys.argv)
-    order_shards = load_fits.load_fits_orders(filenames, config, add_path=False)
-    plot_shards.plot_shards(order_shards, "wavelength", "log", config["plot_fspectrum_by_order"])
+    cal_pxs = get_calibrators.get_calibrators(config)
+
+    # 2) REDUCE SPECTRUM
+    shift, mu, z, model_filename = reduce_spectrum(filename, db, cal_pxs, config, timer)
+    render.stop_renderer()
+    stage_timer.write_run_report(timer, "generate_telluric_model", config,
+                                 {"filename": filename, "shift": shift, "mu": mu, "z": z,
+                                  "n_db_records": len(db)})
+
+def reduce_spectrum(filename, db, cal_pxs, config, timer=None):
+
+    '''
+    Fits the telluric model to a science spectrum and writes it out.
+
+    Returns the shift, mu and z fitted to the spectrum, and the filename of
+    the telluric model written. If a Stage_Timer is given, each numbered
+    stage below is timed with it.
+    '''
+
+    if timer is None:
+        timer = stage_timer.Stage_Timer()
+
+    # 1) LOAD DATA
+    # Loads the science spectrum's contents into a data container for each
+    # order. These data containers are called shards. Produces a dictionary
+    # linking each processed order to its shard. If the spectrum's normalized
+    # shards are cached, they are read from the cache instead, and loading
+    # and normalization are skipped.
+    timer.start("LOAD")
+    filenames = [filename]
+    cache_key = shard_cache.get_cache_key(filenames, config, add_path=False)
+    shards = shard_cache.read_shards(cache_key, config)
+    is_cached = shards is not None
+    if not is_cached:
+        order_shards = load_fits.load_fits_orders(filenames, config, add_path=False)
+        plot_shards.plot_shards(order_shards, "wavelength", "log", 
+                                config["plot_fspectrum_by_order"])
 
     # 2) PREPROCESS DATA
     # i)   Subdivide each order shard into smaller shards based on sharding configuration given in
     #      the config file.
-    # ii)  Normalize each smaller shard.
-    # iii) Get the calibration pixels from the config file.
-    # iv)  Cross correlate the telluric model with the science spectrum on the calibration pixels.
-    shards = divide_orders.divide_orders(order_shards, config)
-    plot_shards.plot_shards(shards, "wavelength", "log", config["plot_fspectrum_by_shard"])
-    normalize.normalize(shards)
+    # ii)  Normalize each smaller shard, and cache the normalized shards.
+    # iii) Cross correlate the telluric model with the science spectrum on the calibration pixels.
+    timer.start("PREPROCESS")
+    if not is_cached:
+        shards = divide_orders.divide_orders(order_shards, config)
+        plot_shards.plot_shards(shards, "wavelength", "log", config["plot_fspectrum_by_shard"])
+        normalize.normalize(shards)
+        shard_cache.write_shards(cache_key, shards, config)
     plot_shards.plot_shards(shards, "wavelength", "log", config["plot_normalized_fshards"], 
                             "after normalization")
-    cal_pxs = get_calibrators.get_calibrators(config)
     shift = x_correlate.x_correlate(cal_pxs, shards, db, config)
     plot_shards.plot_shards_vs_xcorr_tel(db, shift, shards, config["plot_fspectrum_model_xcorr"])
 
@@ -50,14 +91,18 @@ def generate_telluric_model():
     # i) Find spectrum mu by fitting the water calibrators' intensity to the science spectrum
     # ii) Retrieve z from science spectrum.
     # iii) Generate telluric spectrum for choice of mu and z
+    timer.start("GENERATE")
     mu = fit_model.get_mu(cal_pxs, shift, shards, db, config)
     z = fit_model.get_z(shards)
     model = generate_model.generate_model(mu, z, db, config)
     plot_model.plot_model(shift, shards, model, show=config["plot_fspectrum_model_fitted"])
     
     # 4) Write out model
-    # i) Writes model out as csv file
-    write_spectrum.write_spectrum(filenames, model)
+    # i) Writes model out in the configured model format
+    timer.start("WRITE")
+    model_filename = write_spectrum.write_spectrum(filenames, model, shift, mu, z, config)
+    timer.stop()
+    return shift, mu, z, model_filename
 
 if __name__ == "__main__":
     generate_telluric_model()
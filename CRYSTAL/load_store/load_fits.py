@@ -1,9 +1,11 @@
 import os
+from multiprocessing.pool import ThreadPool
 
-from astropy.io import fits
 import numpy as np
 
 import data_containers.shard as shard
+import preprocessing.divide_orders as divide_orders
+import utility.parallel as parallel
 
 def get_fits_filename_from_argv(argv):
 
@@ -31,36 +33,25 @@ def get_fits_filenames_at_path(config):
             filenames.append(filename)
     return filenames
 
+def get_file_signature(filename, config):
 
-def load_fits_orders(filenames, config, add_path=True):
+    '''
+    Returns the size and modification time of a file at the calibration path.
 
+    A file whose signature differs from an earlier one has been rewritten
+    or replaced since.
     '''
-    Loads spectra from the given fits files into a shard for each order.
-    
-    For details of the shard data container, see data_container/shard
 
-    Parameters
-    ----------
-    filenames: list (string)
-        A list of the files to load
+    file_stat = os.stat(os.path.join(config["cal_spectra_path"], filename))
+    return (file_stat.st_size, file_stat.st_mtime)
 
-    config: config
-       The config file
 
-    add_path: bool
-        If true, adds path to filenames before opening their file
-    '''
+def get_orders(config):
 
-    # 1) Open each file in filenames
-    file_dict = {}
-    for filename in filenames:
-        if add_path:
-            filename = os.path.join(config["cal_spectra_path"], filename)
-        f = fits.open(filename, do_not_scale_image_data=True)
-        file_dict[filename] = f
+    '''
+    Returns the orders to load, resolving the config's orders keywords.
+    '''
 
-    # 2) Resolve orders to read if the orders setting in config is a special
-    # keyword.
     FIRST_CHIRON_ORDER = 0
     LAST_BLUE_ORDER = 44
     FIRST_RED_ORDER = 45
@@ -68,32 +59,98 @@ def load_fits_orders(filenames, config, add_path=True):
         
     if config["orders"] == "blue":
         # Select the 44 bluest orders of CHIRON
-        orders = np.arange(FIRST_CHIRON_ORDER, LAST_BLUE_ORDER+1) 
+        return np.arange(FIRST_CHIRON_ORDER, LAST_BLUE_ORDER+1) 
     elif config["orders"] == "red":
         # Select the 16 redest orders of CHIRON
-        orders = np.arange(FIRST_RED_ORDER, LAST_CHIRON_ORDER) 
+        return np.arange(FIRST_RED_ORDER, LAST_CHIRON_ORDER) 
     elif config["orders"] == "all":
-        orders = np.arange(0, 61) # Select all CHIRON orders
+        return np.arange(0, 61) # Select all CHIRON orders
     else:
-        orders = config["orders"] # Otherwise config[orders] is a list of orders
+        return config["orders"] # Otherwise config[orders] is a list of orders
+
+def load_fits_orders(filenames, config, add_path=True):
 
-    # 3) Add each file's data for each selected order to that order's shard.
+    '''
+    Loads spectra from the given fits files into a shard for each order.
+
+    Each order's spectra are stored in contiguous (spectra x pixels) data
+    cubes, with files in the same fixed order for every order. Only the 
+    pixels of each order that are divided into shards are read; all other
+    pixels are nan.
+
+    Files are memory mapped and read by a bounded pool of config's 
+    io_threads threads, each of which streams a file's data straight into
+    the cubes and closes the file before opening the next one.
+    
+    For details of the shard data container, see data_container/shard
+
+    Parameters
+    ----------
+    filenames: list (string)
+        A list of the files to load
+
+    config: config
+       The config file
+
+    add_path: bool
+        If true, adds path to filenames before opening their file
+    '''
+
+    # 1) Resolve the path to each file in filenames. Files are stored in the
+    # cubes in sorted order.
+    if add_path:
+        filenames = [os.path.join(config["cal_spectra_path"], filename) for filename in filenames]
+    file_order = sorted(filenames)
+
+    # 2) Resolve orders to read, and the ranges of pixels to read in each order.
+    orders = get_orders(config)
+    order_px_ranges = dict((order, divide_orders.get_shard_ranges(order, config)) 
+                           for order in orders)
+
+    # 3) Preallocate each order's cubes. Wavelengths and log intensities are
+    # stored in shared memory if calibration runs in parallel. Linear
+    # intensities are read into a temporary cube, and are only kept if config
+    # keeps them.
+    cube_shape = (len(file_order), config["pixels_per_order"])
+    z = np.zeros(len(file_order))
+    lin_x, lin_y, log_y = {}, {}, {}
+    for order in orders:
+        lin_x[order] = parallel.shared_array(cube_shape, config)
+        lin_y[order] = np.empty(cube_shape)
+        log_y[order] = parallel.shared_array(cube_shape, config)
+        lin_x[order].fill(np.nan)
+        lin_y[order].fill(np.nan)
+
+    # 4) Read each file's data for each selected order into that order's cubes.
+    # astropy is imported here, as importing it takes longer than most 
+    # reductions' other work.
+    from astropy.io import fits
+    def read_file(i):
+        f = fits.open(file_order[i], memmap=True, do_not_scale_image_data=True)
+        try:
+            z[i] = float(f[0].header["AIRMASS"])
+            data = f[0].data
+            for order in orders:
+                for lo_px, hi_px in order_px_ranges[order]:
+                    lin_x[order][i, lo_px:hi_px] = data[order, lo_px:hi_px, 0]
+                    lin_y[order][i, lo_px:hi_px] = data[order, lo_px:hi_px, 1]
+            del data
+        finally:
+            f.close(output_verify = "warn")
+
+    io_pool = ThreadPool(max(1, min(config["io_threads"], len(file_order))))
+    try:
+        io_pool.map(read_file, range(len(file_order)))
+    finally:
+        io_pool.close()
+        io_pool.join()
+
+    # 5) Build each order's shard from its cubes.
     order_shards = {}
     for order in orders:
         order_shards[order] = shard.Shard(order, 0, config["pixels_per_order"])
-
-        for filename, f in file_dict.iteritems():
-            
-            order_data = f[0].data[order]
-            lin_x = np.array(order_data[:,0])
-            lin_y = np.array(order_data[:,1])
-            log_y = np.log(lin_y)
-            z = float(f[0].header["AIRMASS"])
-            f_data = shard.Spectrum_Data(lin_x, lin_y, log_y, z)
-            order_shards[order].spectra[filename] = f_data
-
-    # 3) Close spectrum files
-    for filename, f in file_dict.iteritems():
-        f.close(output_verify = "warn")
+        np.log(lin_y[order], out=log_y[order])
+        order_lin_y = lin_y[order] if config["keep_lin_y"] else None
+        order_shards[order].set_spectra(file_order, lin_x[order], order_lin_y, log_y[order], z)
 
     return order_shards
@@ -1,3 +1,5 @@
+import os
+
 def view_tellurics_read_argv(argv):
 
     '''
@@ -25,3 +27,83 @@ def view_tellurics_read_argv(argv):
         raise Exception("Start wavelength not less than end wavelength")
         
     return (st_wv, end_wv)
+
+def convert_telluric_db_read_argv(argv):
+
+    '''
+    Reads the argv for the convert_telluric_db function.
+
+    The convert_telluric_db function has two args in argv: argv[1] and 
+    argv[2], which are the filenames of the database to convert and of the
+    converted database.
+    '''
+
+    if len(argv) != 3:
+        raise Exception("python convert_telluric_db.py <input db> <output db>")
+
+    if argv[1] == argv[2]:
+        raise Exception("Input and output db are the same file")
+
+    return (argv[1], argv[2])
+
+def reduce_batch_read_argv(argv):
+
+    '''
+    Reads the argv for the reduce_batch function.
+
+    The reduce_batch function takes one or more args in argv, each of which
+    is a fits file or a directory. Returns the fits files given and the fits
+    files in each directory given, in order.
+    '''
+
+    if len(argv) < 2:
+        raise Exception("python reduce_batch.py <fits file or directory> ...")
+
+    filenames = []
+    for path in argv[1:]:
+        if os.path.isdir(path):
+            filenames += [os.path.join(path, filename) for filename in sorted(os.listdir(path))
+                          if filename.endswith(".fits")]
+        elif path.endswith(".fits"):
+            filenames.append(path)
+        else:
+            raise Exception("{} is not a fits file or a directory".format(path))
+    return filenames
+
+def benchmark_read_argv(argv, axes):
+
+    '''
+    Reads the argv for the benchmark functions.
+
+    The benchmark functions take a report filename in argv[1], followed by
+    an optional comma separated list of ints for each axis of the grid they
+    benchmark over. axes is a list of the (name, default values) of each
+    axis. An arg --baseline=<report json> anywhere in argv gives an earlier
+    report to compare against.
+
+    Returns the report filename, the values of each axis and the baseline
+    report filename (None if not given.)
+    '''
+
+    BASELINE_FLAG = "--baseline="
+
+    baseline_filename = None
+    args = []
+    for arg in argv[1:]:
+        if arg.startswith(BASELINE_FLAG):
+            baseline_filename = arg[len(BASELINE_FLAG):]
+        else:
+            args.append(arg)
+
+    if len(args) < 1 or len(args) > 1 + len(axes):
+        raise Exception("python {} <report json> {} [{}<report json>]".format(
+            os.path.basename(argv[0]), " ".join("[<{}>]".format(name) for name, _ in axes),
+            BASELINE_FLAG))
+
+    grid = [values for _, values in axes]
+    for i, arg in enumerate(args[1:]):
+        try:
+            grid[i] = [int(value) for value in arg.split(",")]
+        except ValueError:
+            raise Exception("{} is not a comma separated list of ints".format(arg))
+    return args[0], grid, baseline_filename
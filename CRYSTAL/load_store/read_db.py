@@ -1,22 +1,66 @@
-import csv
 import os
 
-import load_store.db_indicies as dbi
+import numpy as np
+
+import data_containers.telluric_db as telluric_db
+import load_store.write_db as write_db
 
 def read_db(config, read_calibrator_info=False):
 
-    csv_file = open(os.path.join(config["cal_db_path"], config["cal_db_filename"]), 'rb')
-    csv_reader = csv.reader(csv_file, delimiter=" ", quotechar="'")
-    db = []
-    current_record = csv_reader.next()
-    for record in csv_reader:
-        record[dbi.ORD_IND] = int(record[dbi.ORD_IND])
-        record[dbi.PX_IND] = int(record[dbi.PX_IND])
-        record[dbi.WV_IND] = float(record[dbi.WV_IND])
-        record[dbi.PCC_IND] = float(record[dbi.PCC_IND])
-        record[dbi.RM_IND] = float(record[dbi.RM_IND])
-        record[dbi.RC_IND] = float(record[dbi.RC_IND])
-        record[dbi.INT_IND] = float(record[dbi.INT_IND])
-        db.append(record)
-    return db
-    
+    '''
+    Reads the telluric database in cal_db_path named cal_db_filename.
+
+    Returns a Telluric_DB. Databases whose filename ends in
+    write_db.BINARY_EXT are memory mapped, other databases are read as csv.
+    '''
+
+    return read_db_file(os.path.join(config["cal_db_path"], config["cal_db_filename"]))
+
+def read_db_file(filename):
+
+    '''
+    Reads a telluric database from filename, in the format given by its extension.
+    '''
+
+    if os.path.splitext(filename)[1] == write_db.BINARY_EXT:
+        return read_binary_db(filename)
+    return read_csv_db(filename)
+
+def read_csv_db(filename):
+
+    '''
+    Reads a telluric database from a space delimited csv file.
+    '''
+
+    records = np.loadtxt(filename, dtype=telluric_db.COLUMNS, skiprows=1, ndmin=1)
+    columns = dict((name, records[name].copy()) for name, dtype in telluric_db.COLUMNS)
+    return telluric_db.Telluric_DB(columns)
+
+def read_binary_db(filename):
+
+    '''
+    Memory maps a telluric database from a binary file (see write_db.write_binary_db).
+
+    Only the file's header is read: each column is a read only view of the
+    mapped file, so opening the database takes the same time whatever its
+    size.
+    '''
+
+    db_map = np.memmap(filename, dtype=np.uint8, mode="r")
+    if db_map[:len(write_db.MAGIC)].tobytes() != write_db.MAGIC:
+        raise Exception("{} is not a binary telluric database".format(filename))
+
+    offset = len(write_db.MAGIC)
+    n_records, n_orders = db_map[offset:offset+16].view("<i8")
+    offset += 16
+    order_table = db_map[offset:offset+24*n_orders].view("<i8").reshape(-1, 3)
+    offset += 24*n_orders
+
+    columns = {}
+    for name, dtype in telluric_db.COLUMNS:
+        n_bytes = n_records * dtype.itemsize
+        columns[name] = db_map[offset:offset+n_bytes].view(dtype)
+        offset += n_bytes + (-n_bytes % write_db.ALIGNMENT)
+
+    order_offsets = dict((int(order), (int(start), int(end))) for order, start, end in order_table)
+    return telluric_db.Telluric_DB(columns, order_offsets)
@@ -0,0 +1,45 @@
+import numpy as np
+
+import load_store.write_spectrum as write_spectrum
+import model.generate_model as mi
+
+def read_binary_spectrum(model_filename):
+
+    '''
+    Memory maps a telluric spectrum written by write_spectrum.write_binary_spectrum.
+    '''
+
+    return np.load(model_filename, mmap_mode="r")
+
+def read_container(container_filename):
+
+    '''
+    Memory maps each row group of a model container.
+
+    See write_spectrum.write_container_spectrum for the container's layout.
+    Only the row groups' headers are read. Returns a list with an entry
+    (filename, shift, mu, z, model) for each row group, in the order they
+    were appended, where filename is the science spectrum's absolute path
+    and model is a read only record array of generate_model.MODEL_DTYPE 
+    mapped from the container.
+    '''
+
+    container = np.memmap(container_filename, dtype=np.uint8, mode="r")
+    magic = write_spectrum.CONTAINER_MAGIC
+    if container[:len(magic)].tobytes() != magic:
+        raise Exception("{} is not a model container".format(container_filename))
+
+    groups = []
+    offset = len(magic)
+    group_size = write_spectrum.CONTAINER_GROUP_DTYPE.itemsize
+    while offset < len(container):
+        group = container[offset:offset+group_size].view(write_spectrum.CONTAINER_GROUP_DTYPE)[0]
+        offset += group_size
+        n_bytes = int(group["n_rows"]) * mi.MODEL_DTYPE.itemsize
+        if offset + n_bytes > len(container):
+            raise Exception("{} ends in a partial row group".format(container_filename))
+        model = container[offset:offset+n_bytes].view(mi.MODEL_DTYPE)
+        offset += n_bytes
+        groups.append((group["filename"], float(group["shift"]), float(group["mu"]),
+                       float(group["z"]), model))
+    return groups
@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+
+import data_containers.shard_stats as shard_stats_container
+import load_store.write_stats as write_stats
+
+def read_stats(config):
+
+    '''
+    Reads the calibration's sufficient statistics from its stats file.
+
+    Returns the names of the calibration files already summed, each file's
+    signature when it was summed (see load_fits.get_file_signature, or None
+    if the stats file predates signatures) and a dict mapping each shard's
+    address to its Shard_Stats. If there is no stats file yet, no files
+    have been summed.
+
+    The sums are only valid for the calibrators they were computed with, so
+    an exception is raised if the config's calibrators have changed.
+    '''
+
+    stats_path = os.path.join(config["cal_db_path"], config["cal_stats_filename"])
+    if not os.path.exists(stats_path):
+        return [], [], {}
+
+    stats_file = np.load(stats_path)
+    if str(stats_file["calibrators"]) != str(config["calibrators"]):
+        raise Exception("Calibrators in config differ from those in {}".format(stats_path))
+
+    filenames = list(stats_file["filenames"])
+    signatures = [None] * len(filenames)
+    if "signatures" in stats_file:
+        signatures = [tuple(signature) for signature in stats_file["signatures"]]
+    shard_stats = {}
+    for shard_addr in stats_file["shard_addrs"]:
+        shard_addr = tuple(int(i) for i in shard_addr)
+        stats = shard_stats_container.Shard_Stats(*shard_addr)
+        for attr in write_stats.STATS_ATTRS:
+            value = stats_file[write_stats.get_key(shard_addr, attr)]
+            setattr(stats, attr, value if value.ndim > 0 else value.item())
+        shard_stats[shard_addr] = stats
+    stats_file.close()
+
+    return filenames, signatures, shard_stats
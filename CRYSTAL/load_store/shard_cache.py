@@ -0,0 +1,159 @@
+import hashlib
+import os
+import shutil
+
+import numpy as np
+
+import data_containers.shard as shard_container
+import load_store.load_fits as load_fits
+
+###########
+# Globals #
+###########
+
+# Bytes of each fits file read at a time when checksumming it
+CHUNK_SIZE = 1 << 20
+
+# Version of the code which loads, divides and normalizes the cached shards,
+# and of the cache's layout. It is part of every key, so bump it whenever
+# any of these change what is cached, and entries written before are never
+# read. (2: spectra normalized in one batched fit.)
+CACHE_VERSION = 2
+
+def get_cache_key(filenames, config, add_path=True):
+
+    '''
+    Returns the key of the normalized shards of a set of fits files.
+
+    The key is a checksum of CACHE_VERSION, the content of each file and
+    every config setting that affects the normalized shards: the orders
+    loaded, how they are divided into shards, and which arrays are kept.
+    Changing any file, any of these settings or the cache's version changes
+    the key. Returns None if the cache is
+    disabled.
+    '''
+
+    if config["shard_cache_path"] is None:
+        return None
+
+    file_checksums = []
+    for filename in filenames:
+        if add_path:
+            filename = os.path.join(config["cal_spectra_path"], filename)
+        file_checksum = hashlib.sha1()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                file_checksum.update(chunk)
+        file_checksums.append(file_checksum.hexdigest())
+
+    key = hashlib.sha1()
+    key.update(str(CACHE_VERSION))
+    for file_checksum in sorted(file_checksums):
+        key.update(file_checksum)
+    key.update(str([int(order) for order in load_fits.get_orders(config)]))
+    key.update(str(config["default_shard_ranges"]))
+    key.update(str(config["special_shard_ranges"]))
+    key.update(str(config["pixels_per_order"]))
+    key.update(str(config["keep_lin_y"]))
+    return key.hexdigest()
+
+def read_shards(key, config):
+
+    '''
+    Returns the cached normalized shards with the given key, or None.
+
+    Shards' arrays are memory mapped read only from the cache, so a cache
+    hit costs no reads until the arrays are used. Returns None if the cache
+    is disabled or has no entry for key.
+    '''
+
+    if key is None:
+        return None
+    entry_path = os.path.join(config["shard_cache_path"], key)
+    if not os.path.isdir(entry_path):
+        return None
+
+    # Mark the entry as recently used so that it is evicted last.
+    os.utime(entry_path, None)
+
+    filenames = list(np.load(os.path.join(entry_path, "filenames.npy")))
+    z = np.load(os.path.join(entry_path, "z.npy"))
+    shards = {}
+    for shard_addr in np.load(os.path.join(entry_path, "shard_addrs.npy")):
+        shard_addr = tuple(int(i) for i in shard_addr)
+        cubes = {}
+        for cube in ["lin_x", "lin_y", "log_y"]:
+            cube_path = os.path.join(entry_path, get_cube_filename(shard_addr, cube))
+            cubes[cube] = np.load(cube_path, mmap_mode="r") if os.path.exists(cube_path) else None
+        shards[shard_addr] = shard_container.Shard(*shard_addr)
+        shards[shard_addr].set_spectra(filenames, cubes["lin_x"], cubes["lin_y"], cubes["log_y"],
+                                       z)
+    return shards
+
+def write_shards(key, shards, config):
+
+    '''
+    Caches the normalized shards under the given key.
+
+    The entry is written to a temporary directory which is then renamed, so
+    a partially written entry is never read. Least recently used entries
+    are then evicted until the cache is within config's size limit.
+    '''
+
+    if key is None:
+        return
+    if not os.path.isdir(config["shard_cache_path"]):
+        os.makedirs(config["shard_cache_path"])
+
+    entry_path = os.path.join(config["shard_cache_path"], key)
+    tmp_path = entry_path + ".tmp"
+    if os.path.isdir(entry_path):
+        return
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    first_shard = shards.itervalues().next()
+    np.save(os.path.join(tmp_path, "filenames.npy"), np.array(first_shard.filenames))
+    np.save(os.path.join(tmp_path, "z.npy"), first_shard.z)
+    np.save(os.path.join(tmp_path, "shard_addrs.npy"), np.array(sorted(shards.keys())))
+    for shard_addr, shard in shards.iteritems():
+        for cube in ["lin_x", "lin_y", "log_y"]:
+            if getattr(shard, cube) is not None:
+                np.save(os.path.join(tmp_path, get_cube_filename(shard_addr, cube)),
+                        np.ascontiguousarray(getattr(shard, cube)))
+    os.rename(tmp_path, entry_path)
+
+    evict_entries(config)
+
+def evict_entries(config):
+
+    '''
+    Removes least recently used cache entries until the cache fits its limit.
+    '''
+
+    cache_path = config["shard_cache_path"]
+    entries = []
+    for key in os.listdir(cache_path):
+        entry_path = os.path.join(cache_path, key)
+        if not os.path.isdir(entry_path) or key.endswith(".tmp"):
+            continue
+        entry_size = sum(os.path.getsize(os.path.join(entry_path, filename))
+                         for filename in os.listdir(entry_path))
+        entries.append((os.path.getmtime(entry_path), entry_size, entry_path))
+
+    cache_size = sum(entry_size for _, entry_size, _ in entries)
+    max_size = config["shard_cache_size_mb"] * 2**20
+    for _, entry_size, entry_path in sorted(entries):
+        if cache_size <= max_size:
+            break
+        shutil.rmtree(entry_path)
+        cache_size -= entry_size
+
+def get_cube_filename(shard_addr, cube):
+
+    '''
+    Returns the name of the file a shard's data cube is cached in.
+    '''
+
+    return "{}_{}_{}_{}.npy".format(shard_addr[0], shard_addr[1], shard_addr[2], cube)
@@ -3,38 +3,30 @@ import os
 
 import numpy as np
 
+import data_containers.telluric_db as telluric_db
+import model.regression_model as regression_model
 import utility.utility as utility
 
-# Clusters are denoted by the 2-tuple (start_px, end_px). This set of globals
-# notes that the index of the start pixel, given by ST_IND, is 0, and the
-# index of the finish pixel, given by END_IND, is 1.
-global ST_IND
-ST_IND = 0
-global END_IND
-END_IND = 1
+###########
+# Globals #
+###########
 
-def gen_record(shard, px, coadd_x, coadd_y, PCCs, coeffs, clss):
+# Databases whose filename has this extension are written in the binary
+# format, others as csv.
+global BINARY_EXT
+BINARY_EXT = ".tdb"
 
-    '''
-    Generates a formatted record for a set of record values.
-    '''
-
-    order_fmt = "{:0=2d}".format(shard.order)
-    px_fmt = "{:0=4d}".format(px + shard.lo_px)
-    wv_fmt = "{:.2f}".format(coadd_x[px])
-    intensity_fmt = "{:.4f}".format(coadd_y[px])
+# The first bytes of every binary database
+global MAGIC
+MAGIC = b"CRYSTAL_TDB_v1\n\x00"
 
-    if clss == "w" or clss == "z":
-        r_m, r_c = coeffs[px]
-        PCC_fmt = "{:.3f}".format(PCCs[px])
-        r_m_fmt = "{:.5f}".format(r_m)
-        r_c_fmt = "{:.5f}".format(r_c)
-    elif clss == "c":
-        PCC_fmt = "-1"
-        r_m_fmt = "-1"
-        r_c_fmt = "-1"
+# Each column of a binary database starts on a multiple of this many bytes
+global ALIGNMENT
+ALIGNMENT = 8
 
-    return [order_fmt, px_fmt, wv_fmt, clss, PCC_fmt, r_m_fmt, r_c_fmt, intensity_fmt]
+# The value of the PCC, r_m and r_c of composite pixels
+global COMPOSITE_VALUE
+COMPOSITE_VALUE = -1
 
 def write_db(shards, calibrators, config):
     '''
@@ -49,15 +41,30 @@ def write_db(shards, calibrators, config):
         ordpx is the telluric pixel's pixel number in its order
         wavelength is the average wavelength of the pixel in the training data
         class flags whether the pixel is water, non-water or composite
-        PCC is the pixel's PCC with the relevant calibrator (0 for composite)
+        PCC is the pixel's PCC with the relevant calibrator (-1 for composite)
         r_m and r_c are its coefficients in in the linear regression model
 
         log(depth) = r_m * calibrator_value + r_c
 
         and med_intensity is pixel's median intensity in the training data
+
+    The database is written as csv, or in the binary format (see
+    write_binary_db) if cal_db_filename ends in BINARY_EXT.
     '''
-    
-    # 1) Sort shard addr in order of order, with shard_addr of the same order sorted by order of 
+
+    db = gen_db(shards)
+    write_db_file(db, os.path.join(config["cal_db_path"], config["cal_db_filename"]))
+
+def gen_db(shards):
+
+    '''
+    Generates the telluric database of a set of calibrated shards.
+
+    Returns a Telluric_DB with a record for each telluric pixel, sorted by
+    order and then by pixel.
+    '''
+
+    # 1) Sort shard addr in order of order, with shard_addr of the same order sorted by order of
     # start pixel. We accomplish this by first sorting by order of start pixel, and then using
     # a stable sort (mergesot) - a sort which is guarenteed to preserve the relative ordering of
     # elements with the same initial positioning, to sort by order.
@@ -65,41 +72,106 @@ def write_db(shards, calibrators, config):
     sorted_shard_addr = sorted_shard_addr[sorted_shard_addr[:,1].argsort()]
     sorted_shard_addr = sorted_shard_addr[sorted_shard_addr[:,0].argsort(kind='mergesort')]
 
-    # 2) Create a record for each telluric pixel in database in increasing order of wavelength
-    
-    csv_file = open(os.path.join(config["cal_db_path"], config["cal_db_filename"]), "wb")
-    csv_writer = csv.writer(csv_file, delimiter=" ", quotechar="'", quoting=csv.QUOTE_MINIMAL)
-    csv_writer.writerow(["order", "px", "wavelength", "class", "PCC", "r_m", "r_c", "med_intensity"])
-
+    # 2) Generate the columns of each shard's records. Clusters of different classes do not
+    # overlap, so sorting a shard's telluric pixels sorts its clusters in order of start pixel.
+    shard_columns = []
     for shard_addr in sorted_shard_addr:
         shard = shards[tuple(shard_addr)]
-        w_clusters = shard.w_clusters[:] + [[float("inf"), float("inf")]] #sentinel
-        z_clusters = shard.z_clusters[:] + [[float("inf"), float("inf")]]
-        c_clusters = shard.c_clusters[:] + [[float("inf"), float("inf")]]
-        w_i, z_i, c_i = 0, 0, 0
-
         coadd_x, coadd_y = utility.coadd_spectrum(shard)
-        while w_i < len(w_clusters) - 1 or z_i < len(z_clusters) - 1 or c_i < len(c_clusters) - 1:
-
-            # 2a) Write water telluric to db
-            if w_clusters[w_i] < z_clusters[z_i] and w_clusters[w_i] < c_clusters[c_i]:
-                for px in range(w_clusters[w_i][ST_IND], w_clusters[w_i][END_IND] + 1):
-                    rc = gen_record(shard, px, coadd_x, coadd_y, shard.w_PCCs, shard.w_coeffs, "w")
-                    csv_writer.writerow(rc)
-                w_i += 1
-            # 2b) Write non-water telluric to db
-            elif z_clusters[z_i] < w_clusters[w_i] and z_clusters[z_i] < c_clusters[c_i]:
-                for px in range(z_clusters[z_i][ST_IND], z_clusters[z_i][END_IND] + 1):
-                    rc = gen_record(shard, px, coadd_x, coadd_y, shard.z_PCCs, shard.z_coeffs, "z")
-                    csv_writer.writerow(rc)
-                z_i += 1
-            # 2c) Write composite telluric to db
-            else:
-                for px in range(c_clusters[c_i][ST_IND], c_clusters[c_i][END_IND] + 1):
-                    rc = gen_record(shard, px, coadd_x, coadd_y, None, None, "c")
-                    csv_writer.writerow(record)
-                c_i += 1
 
+        w_pxs = regression_model.get_cluster_pxs(shard.w_clusters)
+        z_pxs = regression_model.get_cluster_pxs(shard.z_clusters)
+        c_pxs = regression_model.get_cluster_pxs(shard.c_clusters)
+        pxs = np.concatenate([w_pxs, z_pxs, c_pxs]).astype(int)
+        cls = np.array(["w"]*len(w_pxs) + ["z"]*len(z_pxs) + ["c"]*len(c_pxs), dtype="S1")
+        c_values = np.zeros(len(c_pxs)) + COMPOSITE_VALUE
+        PCCs = np.concatenate([shard.w_PCCs[w_pxs], shard.z_PCCs[z_pxs], c_values])
+        r_m = np.concatenate([shard.w_coeffs[w_pxs, 0], shard.z_coeffs[z_pxs, 0], c_values])
+        r_c = np.concatenate([shard.w_coeffs[w_pxs, 1], shard.z_coeffs[z_pxs, 1], c_values])
+
+        sort_inds = pxs.argsort(kind='mergesort')
+        pxs = pxs[sort_inds]
+        shard_columns.append({"order": np.zeros(len(pxs), dtype=int) + shard.order,
+                              "px": pxs + shard.lo_px,
+                              "wavelength": coadd_x[pxs],
+                              "cls": cls[sort_inds],
+                              "PCC": PCCs[sort_inds],
+                              "r_m": r_m[sort_inds],
+                              "r_c": r_c[sort_inds],
+                              "med_intensity": coadd_y[pxs]})
+
+    # 3) Join the shards' columns
+    columns = {}
+    for name, dtype in telluric_db.COLUMNS:
+        columns[name] = np.concatenate([np.zeros(0, dtype=dtype)] +
+                                       [c[name] for c in shard_columns]).astype(dtype)
+    return telluric_db.Telluric_DB(columns)
+
+def write_db_file(db, filename):
+
+    '''
+    Writes a Telluric_DB to filename, in the format given by its extension.
+    '''
+
+    if os.path.splitext(filename)[1] == BINARY_EXT:
+        write_binary_db(db, filename)
+    else:
+        write_csv_db(db, filename)
+
+def write_csv_db(db, filename):
+
+    '''
+    Writes a Telluric_DB to a space delimited csv file.
+
+    The file is written to a temporary file which then replaces filename,
+    so a partially written database is never read.
+    '''
+
+    tmp_filename = filename + ".tmp"
+    csv_file = open(tmp_filename, "wb")
+    csv_writer = csv.writer(csv_file, delimiter=" ", quotechar="'", quoting=csv.QUOTE_MINIMAL)
+    csv_writer.writerow([name if name != "cls" else "class" for name, dtype in telluric_db.COLUMNS])
+    for order, px, wv, clss, PCC, r_m, r_c, intensity in db:
+        if clss == "w" or clss == "z":
+            PCC_fmt = "{:.3f}".format(PCC)
+            r_m_fmt = "{:.5f}".format(r_m)
+            r_c_fmt = "{:.5f}".format(r_c)
+        else:
+            PCC_fmt = r_m_fmt = r_c_fmt = str(COMPOSITE_VALUE)
+        csv_writer.writerow(["{:0=2d}".format(order), "{:0=4d}".format(px), "{:.2f}".format(wv),
+                             clss, PCC_fmt, r_m_fmt, r_c_fmt, "{:.4f}".format(intensity)])
     csv_file.close()
-            
-        
+    os.rename(tmp_filename, filename)
+
+def write_binary_db(db, filename):
+
+    '''
+    Writes a Telluric_DB to a binary file.
+
+    The file is laid out as:
+
+        MAGIC
+        the number of records and the number of orders, as int64s
+        an order table with a row (order, start, end) for each order, as
+        int64s, where [start, end) is the range of rows of its records
+        each column in telluric_db.COLUMNS, in turn
+
+    with each column padded to a multiple of ALIGNMENT bytes, so that
+    read_db can memory map every column in place. Values are stored at full
+    precision. The file is written in one write to a temporary file which
+    then replaces filename, so a partially written database is never read.
+    '''
+
+    orders = sorted(db.order_offsets.keys())
+    order_table = np.array([[order] + list(db.order_offsets[order]) for order in orders],
+                           dtype="<i8").reshape(-1, 3)
+    chunks = [MAGIC, np.array([len(db), len(orders)], dtype="<i8").tobytes(),
+              order_table.tobytes()]
+    for name, dtype in telluric_db.COLUMNS:
+        column = np.ascontiguousarray(getattr(db, name), dtype=dtype).tobytes()
+        chunks.append(column + b"\x00" * (-len(column) % ALIGNMENT))
+
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as db_file:
+        db_file.write(b"".join(chunks))
+    os.rename(tmp_filename, filename)
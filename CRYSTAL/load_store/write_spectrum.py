@@ -1,8 +1,23 @@
 import csv
+import fcntl
 import os
 
+import numpy as np
+
 import model.generate_model as mi
 
+###########
+# Globals #
+###########
+
+# The first bytes of every model container
+global CONTAINER_MAGIC
+CONTAINER_MAGIC = b"CRYSTAL_TMC_v1\n\x00"
+
+# The header of each row group in a model container
+CONTAINER_GROUP_DTYPE = np.dtype([("filename", "S256"), ("shift", "<f8"), ("mu", "<f8"),
+                                  ("z", "<f8"), ("n_rows", "<i8")])
+
 def format_record(r):
 
     '''
@@ -16,10 +31,64 @@ def format_record(r):
 
     return [order_fmt, px_fmt, wv_fmt, r[mi.CLS_IND], intensity_fmt]
 
-def write_spectrum(filenames, model):
+def write_spectrum(filenames, model, shift, mu, z, config):
+
+    '''
+    Writes the telluric spectrum fitted to a science spectrum.
+
+    The spectrum is written in model_format:
+        "csv": as filename_tel.csv (see write_csv_spectrum)
+        "binary": as filename_tel.npy (see write_binary_spectrum)
+        "container": appended to model_container_filename, with the fitted
+        shift, mu and z (see write_container_spectrum)
+    csv and binary spectra are written where get_model_filename says.
+
+    Returns the name of the file written.
+    '''
+
+    filename = filenames[0] #  Only one file in filenames
+    if config["model_format"] in ("csv", "binary"):
+        model_filename = get_model_filename(filename, config)
+        model_path = os.path.dirname(model_filename)
+        if model_path and not os.path.isdir(model_path):
+            os.makedirs(model_path)
+    if config["model_format"] == "csv":
+        return write_csv_spectrum(model_filename, model)
+    elif config["model_format"] == "binary":
+        return write_binary_spectrum(model_filename, model)
+    elif config["model_format"] == "container":
+        return write_container_spectrum(config["model_container_filename"], filename, model,
+                                        shift, mu, z)
+    raise Exception("Unknown model_format {}".format(config["model_format"]))
+
+def get_model_filename(filename, config):
+
+    '''
+    Returns the name of the csv or binary telluric spectrum of a science spectrum.
+
+    If model_output_path is null, spectra are written to the current
+    directory as <spectrum>_tel.csv or .npy. Otherwise, they are written
+    under model_output_path at the science spectrum's path, so spectra with
+    the same name in different directories don't overwrite each other. The
+    path is taken relative to the current directory, or in full if the
+    spectrum is outside it.
+    '''
+
+    ext = {"csv": ".csv", "binary": ".npy"}[config["model_format"]]
+    name = os.path.splitext(os.path.basename(filename))[0] + "_tel" + ext
+    if config["model_output_path"] is None:
+        return "./" + name
+
+    spectrum_path = os.path.dirname(os.path.abspath(filename))
+    rel_path = os.path.relpath(spectrum_path)
+    if rel_path == os.pardir or rel_path.startswith(os.pardir + os.sep):
+        rel_path = spectrum_path.lstrip(os.sep)
+    return os.path.normpath(os.path.join(config["model_output_path"], rel_path, name))
+
+def write_csv_spectrum(model_filename, model):
 
     '''
-    Writes the telluric spectrum for a single stellar line as filename_tel.csv
+    Writes the telluric spectrum for a single stellar line as a csv file.
 
     This database contains a single relation which contains a record for each
     telluric pixel detected. This relation's attributes are, in order:
@@ -31,10 +100,11 @@ def write_spectrum(filenames, model):
         wavelength is the average wavelength of the pixel in the training data
         class flags whether the pixel is water, non-water or composite
         and intensity is the telluric pixel's intensity
+
+    Returns the name of the file written.
     '''
-    
-    filename = filenames[0] #  Only one file in filenames
-    csv_file = open("./" + os.path.basename(os.path.splitext(filename)[0]) + "_tel.csv", "wb")
+
+    csv_file = open(model_filename, "wb")
     csv_writer = csv.writer(csv_file, delimiter=" ", quotechar="'", quoting=csv.QUOTE_MINIMAL)
     csv_writer.writerow(["order", "px", "wavelength", "class", "intensity"])
 
@@ -42,5 +112,64 @@ def write_spectrum(filenames, model):
         csv_writer.writerow(format_record(r))
 
     csv_file.close()
-            
-        
+    return model_filename
+
+def write_binary_spectrum(model_filename, model):
+
+    '''
+    Writes the telluric spectrum as a .npy file of the model's record array.
+
+    The file holds the same fields as the csv at full precision, in one
+    write, and can be memory mapped with np.load(mmap_mode="r").
+
+    Returns the name of the file written.
+    '''
+
+    np.save(model_filename, np.asarray(model, dtype=mi.MODEL_DTYPE))
+    return model_filename
+
+def write_container_spectrum(container_filename, filename, model, shift, mu, z):
+
+    '''
+    Appends the telluric spectrum as a row group of a model container.
+
+    A model container holds the telluric spectra of many science spectra,
+    e.g. a night's batch reduction. It is laid out as:
+
+        CONTAINER_MAGIC
+        a row group for each science spectrum, in the order they were
+        appended, each made up of:
+            a header of CONTAINER_GROUP_DTYPE, holding the science
+            spectrum's absolute path, its fitted shift, mu and z, and the 
+            number of rows in the group
+            the model's rows, as a record array of generate_model.MODEL_DTYPE
+
+    Each row group is appended in one write while holding an exclusive
+    lock on the container, so processes reducing spectra in parallel can
+    share a container. read_spectrum.read_container memory maps it.
+
+    Returns the name of the container.
+    '''
+
+    spectrum_path = os.path.abspath(filename)
+    if len(spectrum_path) > CONTAINER_GROUP_DTYPE["filename"].itemsize:
+        raise Exception("Path {} is too long to store in a model container".format(spectrum_path))
+
+    model = np.asarray(model, dtype=mi.MODEL_DTYPE)
+    group = np.zeros(1, dtype=CONTAINER_GROUP_DTYPE)
+    group["filename"] = spectrum_path
+    group["shift"], group["mu"], group["z"] = shift, mu, z
+    group["n_rows"] = len(model)
+
+    with open(container_filename, "ab") as container_file:
+        fcntl.flock(container_file, fcntl.LOCK_EX)
+        try:
+            container_file.seek(0, os.SEEK_END)
+            chunks = [group.tobytes(), model.tobytes()]
+            if container_file.tell() == 0:
+                chunks.insert(0, CONTAINER_MAGIC)
+            container_file.write(b"".join(chunks))
+            container_file.flush()
+        finally:
+            fcntl.flock(container_file, fcntl.LOCK_UN)
+    return container_filename
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+
+###########
+# Globals #
+###########
+
+# Attributes of Shard_Stats written to the stats file
+STATS_ATTRS = ["n", "w_sum", "w_sq_sum", "z_sum", "z_sq_sum", "wv_sum", "y_sum", "y_sq_sum",
+               "wy_sum", "zy_sum"]
+
+def get_key(shard_addr, attr):
+
+    '''
+    Returns the key of a shard's statistic in the stats file.
+    '''
+
+    return "{}_{}_{}_{}".format(shard_addr[0], shard_addr[1], shard_addr[2], attr)
+
+def write_stats(filenames, signatures, shard_stats, config):
+
+    '''
+    Writes the calibration's sufficient statistics out to its stats file.
+
+    The stats file is a numpy .npz archive holding the names of the 
+    calibration files summed, their signatures (size and modification time)
+    when summed, the calibrators they were summed against, and each shard's
+    statistics. It is written to a temporary file which then
+    replaces the old stats file, so an interrupted write never leaves 
+    partial statistics behind.
+    '''
+
+    arrays = {"filenames": np.array(filenames),
+              "signatures": np.array(signatures, dtype=float).reshape(-1, 2),
+              "calibrators": np.array(str(config["calibrators"])),
+              "shard_addrs": np.array(sorted(shard_stats.keys())).reshape(-1, 3)}
+    for shard_addr, stats in shard_stats.iteritems():
+        for attr in STATS_ATTRS:
+            arrays[get_key(shard_addr, attr)] = np.asarray(getattr(stats, attr))
+
+    stats_path = os.path.join(config["cal_db_path"], config["cal_stats_filename"])
+    tmp_path = stats_path + ".tmp"
+    with open(tmp_path, "wb") as stats_file:
+        np.savez(stats_file, **arrays)
+    os.rename(tmp_path, stats_path)
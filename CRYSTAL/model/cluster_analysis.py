@@ -1,17 +1,25 @@
-import matplotlib.pyplot as plt
 import numpy as np
 
 import utility.utility as utility
 
 
-# Clusters are denoted by the 2-tuple (start_px, end_px). This set of globals
-# notes that the index of the start pixel, given by ST_IND, is 0, and the 
-# index of the finish pixel, given by END_IND, is 1.
+# Each shard's clusters of each class are denoted by an (n x 2) array, with a
+# row (start_px, end_px) for each cluster in increasing order of start_px. 
+# This set of globals notes that the column of the start pixel, given by 
+# ST_IND, is 0, and the column of the finish pixel, given by END_IND, is 1.
 global ST_IND
 ST_IND = 0
 global END_IND
 END_IND = 1
 
+def to_cluster_array(clusters):
+
+    '''
+    Converts a list of [start_px, end_px] clusters to a cluster array.
+    '''
+
+    return np.array(clusters, dtype=int).reshape(-1, 2)
+
 def identify_clusters(shards):
 
     '''
@@ -19,15 +27,32 @@ def identify_clusters(shards):
     '''
 
     for shard in shards.itervalues():
-        for tel_flags, clusters in zip([shard.w_tel, shard.z_tel], 
-                                       [shard.w_clusters, shard.z_clusters]):
-            cluster_start = None
-            for i in range(shard.hi_px - shard.lo_px):
-                if tel_flags[i] and cluster_start is None: 
-                    cluster_start = i
-                elif (not tel_flags[i] or i+1 == shard.hi_px) and cluster_start is not None:
-                    clusters.append([cluster_start, i-1])
-                    cluster_start = None
+        shard.w_clusters = find_flagged_runs(shard.w_tel, shard)
+        shard.z_clusters = find_flagged_runs(shard.z_tel, shard)
+
+def find_flagged_runs(tel_flags, shard):
+
+    '''
+    Returns the clusters of consecutive flagged pixels in tel_flags.
+
+    Worker function of identify_clusters. Each run of flagged pixels starts
+    where the flags step up and ends where they step down. A run reaching 
+    the shard's last pixel is only kept if the shard starts at pixel 0, in
+    which case it ends at the shard's second last pixel.
+    '''
+
+    n_px = shard.hi_px - shard.lo_px
+    steps = np.diff(np.concatenate(([0], np.asarray(tel_flags, dtype=int), [0])))
+    starts = np.flatnonzero(steps == 1)
+    ends = np.flatnonzero(steps == -1) - 1
+
+    is_at_end = ends == n_px - 1
+    if n_px == shard.hi_px:
+        ends[is_at_end] = n_px - 2
+        is_kept = starts <= ends
+    else:
+        is_kept = ~is_at_end
+    return to_cluster_array(np.column_stack((starts[is_kept], ends[is_kept])))
                     
 def remove_1_and_2_pixel_clusters(shards):
 
@@ -36,11 +61,18 @@ def remove_1_and_2_pixel_clusters(shards):
     '''
 
     for shard in shards.itervalues():
-        for clusters in [shard.w_clusters, shard.z_clusters]:
-            clusters_copy = clusters[:]  #Separate list for iteration
-            for cluster in clusters_copy:
-                if cluster[END_IND] - cluster[ST_IND] + 1 < 3:
-                    clusters.remove(cluster)
+        shard.w_clusters = remove_small_clusters(shard.w_clusters)
+        shard.z_clusters = remove_small_clusters(shard.z_clusters)
+
+def remove_small_clusters(clusters):
+
+    '''
+    Returns the clusters of 3 or more pixels.
+
+    Worker function of remove_1_and_2_pixel_clusters.
+    '''
+
+    return clusters[clusters[:, END_IND] - clusters[:, ST_IND] + 1 >= 3]
 
 def remove_non_trough_clusters(shards, config):
 
@@ -53,15 +85,53 @@ def remove_non_trough_clusters(shards, config):
 
     for shard in shards.itervalues():
         coadded_x, coadded_log_y = utility.coadd_spectrum(shard)
-        for clusters in [shard.w_clusters, shard.z_clusters]:
-            clusters_copy = clusters[:]
-            for cluster in clusters_copy:
-                if not is_cluster_a_trough(coadded_x[cluster[ST_IND]-1:cluster[END_IND]+2], 
-                                           coadded_log_y[cluster[ST_IND]-1:cluster[END_IND]+2], 
-                                           config):
-                    clusters.remove(cluster)
-            
+        shard.w_clusters = shard.w_clusters[find_trough_clusters(coadded_x, coadded_log_y, 
+                                                                 shard.w_clusters, config)]
+        shard.z_clusters = shard.z_clusters[find_trough_clusters(coadded_x, coadded_log_y, 
+                                                                 shard.z_clusters, config)]
 
+def find_trough_clusters(coadded_x, coadded_log_y, clusters, config):
+
+    '''
+    Flags which clusters are in the shape of a trough.
+
+    Worker function of remove_non_trough_clusters. Applies the trough test of
+    is_cluster_a_trough (below) to every cluster at once. Each cluster is 
+    tested over its pixels and the pixel on either side, where its blocked
+    deltas are the coadd's differences over 2 pixels. A cluster is a trough
+    if the first of these below -threshold is followed by one above 
+    threshold, so the coadd's next below and last above blocked deltas at 
+    each pixel decide every cluster's test.
+    '''
+
+    grad_threshold = config["threshold_gradient"]
+    is_trough = np.zeros(len(clusters), dtype=bool)
+    if len(clusters) == 0:
+        return is_trough
+
+    # 1) Blocked delta i spans coadd pixels i to i+2. Find the index of the 
+    # next blocked delta at or after each pixel below -threshold, and of the
+    # last blocked delta at or before each pixel above threshold.
+    blocked_deltas = coadded_log_y[2:] - coadded_log_y[:-2]
+    delta_inds = np.arange(len(blocked_deltas))
+    no_delta = len(blocked_deltas)
+    next_below = np.where(blocked_deltas < -grad_threshold, delta_inds, no_delta)
+    next_below = np.minimum.accumulate(next_below[::-1])[::-1]
+    last_above = np.where(blocked_deltas > grad_threshold, delta_inds, -1)
+    last_above = np.maximum.accumulate(last_above)
+
+    # 2) Cluster [st, end]'s blocked deltas are those from st-1 to end-1.
+    # Clusters starting at pixel 0 are tested on the same slices as 
+    # is_cluster_a_trough.
+    starts, ends = clusters[:, ST_IND], clusters[:, END_IND]
+    is_inner = starts > 0
+    first_below = next_below[starts[is_inner] - 1]
+    is_trough[is_inner] = (first_below <= ends[is_inner] - 1) \
+                          & (last_above[ends[is_inner] - 1] > first_below)
+    for i in np.flatnonzero(~is_inner):
+        is_trough[i] = is_cluster_a_trough(coadded_x[starts[i]-1:ends[i]+2],
+                                           coadded_log_y[starts[i]-1:ends[i]+2], config)
+    return is_trough
 
 def is_cluster_a_trough(px_x, px_y, config):
 
@@ -97,6 +167,7 @@ def is_cluster_a_trough(px_x, px_y, config):
     # This plot is useful if you are debugging the peak finding algorithm.
     show_cluster_analysis = False
     if show_cluster_analysis:
+        import matplotlib.pyplot as plt
         fig = plt.figure(facecolor="white")
         plt.plot(px_x, px_y, color="k")
         if has_peak:
@@ -117,19 +188,22 @@ def remove_isolated_clusters(shards):
 
     for shard in shards.itervalues():
         coadded_x, coadded_log_y = utility.coadd_spectrum(shard)
-        for clusters in [shard.w_clusters, shard.z_clusters]:
-            clusters_copy = clusters[:]
-            for i in range(len(clusters_copy)):
-                # If there is a cluster < 5A to the left
-                if i > 0 and (coadded_x[clusters_copy[i][ST_IND]] \
-                        - coadded_x[clusters_copy[i-1][END_IND]]) <= 5:
-                    pass
-                # If there is a cluster < 5A to the right
-                elif i < len(clusters_copy)-1 and (coadded_x[clusters_copy[i+1][ST_IND]] \
-                        - coadded_x[clusters_copy[i][END_IND]]) <= 5:
-                    pass
-                else:
-                    clusters.remove(clusters_copy[i])
+        shard.w_clusters = shard.w_clusters[find_unisolated_clusters(coadded_x, shard.w_clusters)]
+        shard.z_clusters = shard.z_clusters[find_unisolated_clusters(coadded_x, shard.z_clusters)]
+
+def find_unisolated_clusters(coadded_x, clusters):
+
+    '''
+    Flags the clusters with a neighbouring cluster <= 5A away.
+
+    Worker function of remove_isolated_clusters.
+    '''
+
+    if len(clusters) == 0:
+        return np.zeros(0, dtype=bool)
+    gaps = coadded_x[clusters[1:, ST_IND]] - coadded_x[clusters[:-1, END_IND]]
+    is_close = gaps <= 5
+    return np.concatenate(([False], is_close)) | np.concatenate((is_close, [False]))
 
 def expand_clusters(shards):
 
@@ -138,11 +212,8 @@ def expand_clusters(shards):
     '''
     for shard in shards.itervalues():
         for clusters in [shard.w_clusters, shard.z_clusters]:
-            for i in range(len(clusters)):
-                if clusters[i][ST_IND] > 0:
-                    clusters[i][ST_IND] -= 1
-                if clusters[i][END_IND] < shard.hi_px - shard.lo_px:
-                    clusters[i][END_IND] += 1
+            clusters[clusters[:, ST_IND] > 0, ST_IND] -= 1
+            clusters[clusters[:, END_IND] < shard.hi_px - shard.lo_px, END_IND] += 1
 
 def resolve_same_class_overlapping_clusters(shards):
 
@@ -151,119 +222,174 @@ def resolve_same_class_overlapping_clusters(shards):
     '''
 
     for shard in shards.itervalues():
-        for clusters in [shard.w_clusters, shard.z_clusters]:
-            i = 0
-            while i < len(clusters) - 1:
-                if clusters[i+1][ST_IND] <= clusters[i][END_IND]:
-                    clusters[i][END_IND] = clusters[i+1][END_IND]
-                    clusters.remove(clusters[i+1])
-                else:
-                    i += 1
+        shard.w_clusters = merge_overlapping_clusters(shard.w_clusters)
+        shard.z_clusters = merge_overlapping_clusters(shard.z_clusters)
+
+def merge_overlapping_clusters(clusters):
+
+    '''
+    Merges each run of overlapping clusters into a single cluster.
+
+    Worker function of resolve_same_class_overlapping_clusters. A cluster
+    starting at or before the previous cluster's end is merged into it, and
+    the merged cluster ends where the last cluster merged into it ends.
+    '''
+
+    if len(clusters) == 0:
+        return clusters
+    is_new = np.concatenate(([True], clusters[1:, ST_IND] > clusters[:-1, END_IND]))
+    is_last = np.concatenate((is_new[1:], [True]))
+    return np.column_stack((clusters[is_new, ST_IND], clusters[is_last, END_IND]))
                 
-def find_diff_class_overlapping_clusters(w_clusters, z_clusters):
+def have_overlapping_clusters(a_clusters, b_clusters):
+
     '''
-    Returns overlapping diff class cluster pair if present, and None otherwise.
+    Returns whether any cluster in a_clusters overlaps any in b_clusters.
+
+    Each class's clusters are disjoint, so any overlap between the classes
+    shows up as a cluster starting before the end of the cluster before it
+    once both classes' clusters are sorted together.
     '''
 
-    for w_i in w_clusters:
-        for z_i in z_clusters:
-            if not ((w_i[ST_IND] < z_i[ST_IND] and w_i[END_IND] < z_i[ST_IND])
-                    or (z_i[END_IND] < w_i[ST_IND] and z_i[END_IND] < w_i[ST_IND])):
-                return (w_i, z_i)
-    return None
+    clusters = np.concatenate((a_clusters, b_clusters))
+    clusters = clusters[np.argsort(clusters[:, ST_IND], kind="mergesort")]
+    return bool((clusters[1:, ST_IND] <= clusters[:-1, END_IND]).any())
 
 def resolve_diff_class_overlapping_clusters(shards):
     
     '''
     Resolve overlapping water and non-water clusters.
+
+    Sweeps through the water clusters in order. Since the non-water clusters
+    are sorted and disjoint, each water cluster's overlapping non-water
+    clusters follow each other, and non-water clusters ending before a water
+    cluster can never overlap a later one. Each overlapping pair is resolved
+    in turn by resolve_cluster_pair (below).
     '''
     
     for shard in shards.itervalues():
         
-        # While there are overlapping clusters left, removing them as follows
-        while find_diff_class_overlapping_clusters(shard.w_clusters, shard.z_clusters) != None:
-            w_i, z_i = find_diff_class_overlapping_clusters(shard.w_clusters, shard.z_clusters)
-            
-            # 1) If one cluster is a subset of another cluster, remove it
-            if z_i[ST_IND] <= w_i[ST_IND] and w_i[END_IND] <= z_i[END_IND]:
-                shard.w_clusters.remove(w_i)
-                continue
-            elif w_i[ST_IND] <= z_i[ST_IND] and z_i[END_IND] <= w_i[END_IND]:
-                shard.z_clusters.remove(z_i)
-                continue
-
-            # 2) Identify the left and right clusters
-            if w_i[ST_IND] < z_i[ST_IND]:
-                L, L_PCCs = w_i, shard.w_PCCs
-                R, R_PCCs = z_i, shard.z_PCCs
-            else:
-                L, L_PCCs = z_i, shard.z_PCCs 
-                R, R_PCCs = w_i, shard.w_PCCs
-    
-            # 3) Now, the two clusters in their overlap region look like this:
-            #
-            #             L cluster | overlap region | R cluster
-            #
-            # We now check to see if the pixel adjacent to the L cluster has
-            # a bigger L_PCC than R_PCC. If it does, we expand the L cluster's
-            # bound by 1, and we check the next pixel, until we either reach
-            # the end of the overlap region or we arrive at a pixel with a 
-            # bigger R_PCC than L_PCC. We then repeat the process for the 
-            # L_PCC. At the end of this step, the boundary between the L
-            # cluster and the overlap region is a pixel with bigger R_PCC than
-            # L_PCC, and vice versa.
-            #
-            # As an example, denoting pixels where L_PCC > R_PCC as L and the
-            # reverse as R, if the pixels in the clusters and overlap region 
-            # initially look like this:
-            #
-            #             L cluster [ overlap region ] R cluster
-            #             LLLLLLLLLL[LLLLRRLRLLRLRRRR]RRRRRRRRR
-            # 
-            # then, they now look like this:
-            #             L cluster     [ overlap]    R cluster
-            #             LLLLLLLLLLLLLL[RRLRLLRL]RRRRRRRRRRRRR
-            #
-            # The overlap region is bounded to the left by a "R" pixel and
-            # to the right by a "L" pixel.
-
-            #Shrink the overlap from the left
-            while L[END_IND] >= R[ST_IND] and L_PCCs[R[ST_IND]] >= R_PCCs[R[ST_IND]]:
-                R[ST_IND] += 1
-
-            #Shrink the overlap from the right
-            while L[END_IND] >= R[ST_IND] and R_PCCs[L[END_IND]] >= L_PCCs[L[END_IND]]:
-                L[END_IND] -= 1
-
-            # 4) Now, an assignment is made for the overlap region, if one exists. If the overlap
-            # region is >75% R pixels, it is assigned to the R cluster. If the overlap region is 
-            # >75% L pixels, it is assigned to the L cluster. Otherwise, it is marked as a 
-            # composite region
-            if L[END_IND] >= R[ST_IND]:
-                L_px, R_px = 0, 0
-                for i in range(R[ST_IND], L[END_IND] + 1):
-                    if L_PCCs[i] >= R_PCCs[i]:
-                        L_px += 1
-                    else:
-                        R_px += 1
-                if (L_px / float(L_px + R_px)) >= 0.75:
-                    R[ST_IND] = L[END_IND] + 1
-                elif (R_px / float(L_px + R_px)) >= 0.75:
-                    L[END_IND] = R[ST_IND] - 1
+        w_clusters, z_clusters = shard.w_clusters, shard.z_clusters
+        is_w_kept = np.ones(len(w_clusters), dtype=bool)
+        is_z_kept = np.ones(len(z_clusters), dtype=bool)
+        c_clusters = shard.c_clusters.tolist()
+
+        z_i = 0
+        for w_i in range(len(w_clusters)):
+            w_cluster = w_clusters[w_i]
+
+            # Skip the non-water clusters ending before the water cluster
+            while z_i < len(z_clusters) and (not is_z_kept[z_i] 
+                                             or z_clusters[z_i][END_IND] < w_cluster[ST_IND]):
+                z_i += 1
+
+            z_j = z_i
+            while z_j < len(z_clusters) and z_clusters[z_j][ST_IND] <= w_cluster[END_IND]:
+                z_cluster = z_clusters[z_j]
+                if not is_z_kept[z_j] or z_cluster[END_IND] < w_cluster[ST_IND]:
+                    z_j += 1
+                    continue
+
+                # 1) If one cluster is a subset of another cluster, remove it
+                if z_cluster[ST_IND] <= w_cluster[ST_IND] and w_cluster[END_IND] <= z_cluster[END_IND]:
+                    is_w_kept[w_i] = False
+                    break
+                elif w_cluster[ST_IND] <= z_cluster[ST_IND] and z_cluster[END_IND] <= w_cluster[END_IND]:
+                    is_z_kept[z_j] = False
                 else:
-                    composite_cluster = [R[ST_IND], L[END_IND]]
-                    L[END_IND] = composite_cluster[ST_IND] - 1
-                    R[ST_IND] = composite_cluster[END_IND] + 1
-                    shard.c_clusters.append(composite_cluster)
-        
-        #end while
-        if find_diff_class_overlapping_clusters(shard.w_clusters, shard.z_clusters) != None:
+                    resolve_cluster_pair(w_cluster, z_cluster, shard, c_clusters)
+                z_j += 1
+
+        shard.w_clusters = w_clusters[is_w_kept]
+        shard.z_clusters = z_clusters[is_z_kept]
+        shard.c_clusters = to_cluster_array(c_clusters)
+
+        if have_overlapping_clusters(shard.w_clusters, shard.z_clusters):
             raise Exception("Cluster resolution finished with overlapping w and z clusters")
 
-        if find_diff_class_overlapping_clusters(shard.w_clusters, shard.c_clusters) != None:
+        if have_overlapping_clusters(shard.w_clusters, shard.c_clusters):
             raise Exception("Cluster resolution finished with overlapping w and c clusters")
 
-        if find_diff_class_overlapping_clusters(shard.z_clusters, shard.c_clusters) != None:
+        if have_overlapping_clusters(shard.z_clusters, shard.c_clusters):
             raise Exception("Cluster resolution finished with overlapping z and c clusters")
 
-        
+def resolve_cluster_pair(w_cluster, z_cluster, shard, c_clusters):
+
+    '''
+    Resolves a pair of overlapping water and non-water clusters.
+
+    Worker function of resolve_diff_class_overlapping_clusters. Neither 
+    cluster may be a subset of the other. The clusters are shrunk in place,
+    and any composite cluster made is appended to c_clusters.
+    '''
+
+    # 2) Identify the left and right clusters
+    if w_cluster[ST_IND] < z_cluster[ST_IND]:
+        L, L_PCCs = w_cluster, shard.w_PCCs
+        R, R_PCCs = z_cluster, shard.z_PCCs
+    else:
+        L, L_PCCs = z_cluster, shard.z_PCCs 
+        R, R_PCCs = w_cluster, shard.w_PCCs
+
+    # 3) Now, the two clusters in their overlap region look like this:
+    #
+    #             L cluster | overlap region | R cluster
+    #
+    # We now check to see if the pixel adjacent to the L cluster has
+    # a bigger L_PCC than R_PCC. If it does, we expand the L cluster's
+    # bound by 1, and we check the next pixel, until we either reach
+    # the end of the overlap region or we arrive at a pixel with a 
+    # bigger R_PCC than L_PCC. We then repeat the process for the 
+    # L_PCC. At the end of this step, the boundary between the L
+    # cluster and the overlap region is a pixel with bigger R_PCC than
+    # L_PCC, and vice versa.
+    #
+    # As an example, denoting pixels where L_PCC > R_PCC as L and the
+    # reverse as R, if the pixels in the clusters and overlap region 
+    # initially look like this:
+    #
+    #             L cluster [ overlap region ] R cluster
+    #             LLLLLLLLLL[LLLLRRLRLLRLRRRR]RRRRRRRRR
+    # 
+    # then, they now look like this:
+    #             L cluster     [ overlap]    R cluster
+    #             LLLLLLLLLLLLLL[RRLRLLRL]RRRRRRRRRRRRR
+    #
+    # The overlap region is bounded to the left by a "R" pixel and
+    # to the right by a "L" pixel.
+
+    #Shrink the overlap from the left
+    overlap = slice(R[ST_IND], L[END_IND] + 1)
+    R[ST_IND] += count_leading_true(L_PCCs[overlap] >= R_PCCs[overlap])
+
+    #Shrink the overlap from the right
+    overlap = slice(R[ST_IND], L[END_IND] + 1)
+    L[END_IND] -= count_leading_true((R_PCCs[overlap] >= L_PCCs[overlap])[::-1])
+
+    # 4) Now, an assignment is made for the overlap region, if one exists. If the overlap
+    # region is >75% R pixels, it is assigned to the R cluster. If the overlap region is 
+    # >75% L pixels, it is assigned to the L cluster. Otherwise, it is marked as a 
+    # composite region
+    if L[END_IND] >= R[ST_IND]:
+        overlap = slice(R[ST_IND], L[END_IND] + 1)
+        L_px = int(np.count_nonzero(L_PCCs[overlap] >= R_PCCs[overlap]))
+        R_px = (L[END_IND] - R[ST_IND] + 1) - L_px
+        if (L_px / float(L_px + R_px)) >= 0.75:
+            R[ST_IND] = L[END_IND] + 1
+        elif (R_px / float(L_px + R_px)) >= 0.75:
+            L[END_IND] = R[ST_IND] - 1
+        else:
+            composite_cluster = [int(R[ST_IND]), int(L[END_IND])]
+            L[END_IND] = composite_cluster[ST_IND] - 1
+            R[ST_IND] = composite_cluster[END_IND] + 1
+            c_clusters.append(composite_cluster)
+
+def count_leading_true(flags):
+
+    '''
+    Returns the number of True flags before the first False flag.
+    '''
+
+    if flags.all():
+        return len(flags)
+    return int(np.argmin(flags))
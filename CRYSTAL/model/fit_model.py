@@ -1,8 +1,6 @@
-import matplotlib.pyplot as plt
 import numpy as np
 
 import data_containers.shard as shi
-import load_store.db_indicies as dbi
 
 
 def get_z(shards):
@@ -20,9 +18,8 @@ def get_mu(cal_pxs, shift, shards, db, config):
 
     The water calibration line may be blended with a stellar line, making
     it difficult to measure directly. However, since all water lines grow
-    proportionally to each other, we can experiment by scaling the water
-    telluric spectrum by different values of mu and examining its fit to
-    the science spectrum's water tellurics.
+    proportionally to each other, we can scale the water telluric spectrum
+    by mu and examine its fit to the science spectrum's water tellurics.
 
     Fitting to blended telluric lines, however, can throw off the overall
     fit. To remove blended calibration lines, we fit the telluric spectrum
@@ -36,103 +33,62 @@ def get_mu(cal_pxs, shift, shards, db, config):
 
     lo_range = config["lo_mu"] # The low end of range of mu to search
     hi_range = config["hi_mu"] # The high end of range of mu to search
-    epsilon = config["mu_epsilon"] # When mu's error is less than this value, stop search
     MIN_RNG = 0.004  # When all points have less than this fitting error, stop iteratively fitting
     STD_RNG = 1.5 # Points with error more than STD_RNG std dev from the mean error and considered
                   # anomolous and removed.
 
-    measured_cal_pxs = cal_pxs[:]
+    # 1: Look up the water record of each calibration pixel, and the science spectrum's
+    # intensity at its shifted pixel. Neither depends on mu, so both are found once.
+    cal_rows = db.get_calibrator_rows(cal_pxs)
+    s_y, is_found = db.get_spectrum_log_y(cal_rows, shift, shards)
+    r_m, r_c, s_y = db.r_m[cal_rows][is_found], db.r_c[cal_rows][is_found], s_y[is_found]
+    is_measured = np.ones(len(s_y), dtype=bool)
 
     while True:
-        
-        mu, mu_errs = minimize_mu_err(measured_cal_pxs, lo_range, hi_range, 
-                                      epsilon, shift, shards, db)
-
-        mean, std = np.mean(mu_errs.values()), np.std(mu_errs.values())
-        hi_threshold = mean+1.5*max(std,MIN_RNG)
-        lo_threshold = mean-1.5*max(std,MIN_RNG)
-
-        #print "mu_errs:{}".format(sorted( ((v,k) for k,v in mu_errs.iteritems()), reverse=True))
-        #print "std:{}".format(std)
-        #print "+/- 1:{},{}".format(mean-std, mean+std)
-        #print "+/- 1.5:{},{}".format(mean-1.5*std, mean+1.5*std)
-        #print "+/- 2:{},{}".format(mean-2*std, mean+2*std)
-        #print "+/- 3:{},{}".format(mean-3*std, mean+3*std)
-        #print "threshold:{},{}".format(lo_threshold, hi_threshold)
 
-        new_measured_cal_pxs = [cal_px for cal_px in mu_errs.keys() 
-                                if mu_errs[cal_px] < hi_threshold 
-                                and mu_errs[cal_px] > lo_threshold]
+        # 2: Fit mu to the measured calibration pixels, and find each pixel's error
+        mu = solve_mu(r_m[is_measured], r_c[is_measured], s_y[is_measured], lo_range, hi_range)
+        mu_errs = r_m * mu + r_c - s_y
+
+        # 3: Remove measured pixels whose error is an outlier
+        mean, std = np.mean(mu_errs[is_measured]), np.std(mu_errs[is_measured])
+        hi_threshold = mean+STD_RNG*max(std,MIN_RNG)
+        lo_threshold = mean-STD_RNG*max(std,MIN_RNG)
+        new_is_measured = is_measured & (mu_errs < hi_threshold) & (mu_errs > lo_threshold)
 
-        #print "cal_pxs:{}".format(measured_cal_pxs)
-        #print "new_cal_pxs:{}".format(new_measured_cal_pxs)
-        #plot_mu_spectrum(measured_cal_pxs, mu, shift, db, shards)
+        #print "mu:{} errs:{}".format(mu, mu_errs[is_measured])
+        #print "threshold:{},{}".format(lo_threshold, hi_threshold)
 
-        if set(measured_cal_pxs) == set(new_measured_cal_pxs):
+        if np.array_equal(is_measured, new_is_measured):
             break
 
-        measured_cal_pxs = new_measured_cal_pxs
+        is_measured = new_is_measured
 
     return mu
 
-def minimize_mu_err(measured_cal_pxs, lo_range, hi_range, epsilon, shift, shards, db):
+def solve_mu(r_m, r_c, s_y, lo_range, hi_range):
 
     '''
-    Find mu that minimizes error between model and spectrum cal px.
-
-    Conducts binary search to find a value for mu that minimizes the mean error
-    between the telluric model and the science spectrum's calibration pixels.
+    Find mu with zero mean error between model and spectrum cal px.
+
+    Each calibration pixel's error with the telluric model, 
+    r_m * mu + r_c - s_y, is linear in mu, so the mu where the mean error
+    is zero is sum(s_y - r_c) / sum(r_m). This is the mu a binary search 
+    between lo_range and hi_range converges to, and is clipped to that 
+    range in the same way: if the mean error does not grow with mu, the
+    search ends at whichever end of the range its first step moves to. 
+    With no calibration pixels, the search ends at hi_range.
     '''
-    
-    # 1: Perform binary search between hi_range and lo_range to find a mu that best fits 
-    # calibration pixels
-    while hi_range - lo_range > epsilon:
-
-        # 2: Pick mu as the center of the current range of mus, and find the error of its 
-        # corresponding telluric spectrum at each calibrator pixel
-        mu = (hi_range + lo_range) / 2.0
-        mu_errs_dict = find_mu_errs(measured_cal_pxs, mu, shift, db, shards)
 
-        # 3: If err is positive, mu is too large. Search for mu in the inverval (lo_range,
-        # current mu). If err is negative, mu is too small. Search for mu in the interval
-        # (current mu, hi_range)
-        if np.mean(mu_errs_dict.values()) > 0:
-            hi_range = mu
-        else:
-            lo_range = mu
+    if len(r_m) == 0:
+        return hi_range
 
-    return mu, mu_errs_dict
+    slope = np.sum(r_m)
+    if slope <= 0:
+        mid_mu = (lo_range + hi_range) / 2.0
+        return lo_range if np.sum(r_m * mid_mu + r_c - s_y) > 0 else hi_range
 
-def find_mu_errs(measured_cal_pxs, mu, shift, db, shards):
-
-    '''
-    Water telluric model with PVW mu's error with a science spectrum.
-
-    Build a water telluric model with PVW mu and calculate the signed, squared
-    error of each of the science spectrum's calibration pixels with this model.
-    Returns a dict mapping each calibration pixel to its error.
-    '''
-
-    mu_errs_dict = {}
-    for r in db:
-
-        # 1: For each record, extract its order, px, and intensity with mu
-        r_order = r[dbi.ORD_IND]
-        r_x = r[dbi.PX_IND] + shift
-        r_y = r[dbi.RM_IND] * mu + r[dbi.RC_IND]
-
-        # 2: Check if record is a calibrator (check unshifted pixel since calibrators
-        # selected from telluric spectrum.)
-        if (r_order, r[dbi.PX_IND]) in measured_cal_pxs and r[dbi.CLS_IND] == "w":
-
-            # 3: If it is, find the corresponding pixel in shards, and calculate the
-            # telluric spectrum's squared, signed error at that pixel with mu
-            for shard in shards.itervalues():
-                if shard.order == r_order and shard.lo_px <= r_x and r_x < shard.hi_px:
-                    s_y = shard.spectra.itervalues().next().log_y[r_x - shard.lo_px]
-                    mu_errs_dict[(r_order, r[dbi.PX_IND])] = (r_y - s_y)
-
-    return mu_errs_dict
+    return min(max(np.sum(s_y - r_c) / slope, lo_range), hi_range)
 
 
 def plot_mu_spectrum(measured_cal_pxs, mu, shift, db, shards):
@@ -144,32 +100,28 @@ def plot_mu_spectrum(measured_cal_pxs, mu, shift, db, shards):
     measured shown above them.
     '''
 
+    import matplotlib.pyplot as plt
     for shard in shards.itervalues():
 
         # 1: Get the science spectrum.
         spectrum = shard.spectra.itervalues().next()
+        shift = int(round(shift)) #plot sub-pixel shifts to the nearest pixel
 
         # 2: Compute the telluric spectrum associated with mu and the index of any calibration
         # pixel in the shard.
         db_spectrum = np.ones(len(spectrum.log_y))
-        cal_px_inds = []
-
-        for r in db:
-            
-            # 2a: Don't plot non-water lines
-            if r[dbi.CLS_IND] != "w":
-                continue
-            
-            # 2b: Calculate the intensity of each telluric pixel in the order
-            r_x = r[dbi.PX_IND] + shift
-            if r[dbi.ORD_IND] == shard.order and shard.lo_px <= r_x and r_x < shard.hi_px:
-                db_spectrum[r_x - shard.lo_px] = np.exp(r[dbi.RM_IND] * mu + r[dbi.RC_IND])
-
-                # 2c: If telluric pixel was a calibration pixel, record its index
-                if (r[dbi.ORD_IND], r[dbi.PX_IND]) in measured_cal_pxs:
-                    cal_px_inds.append(r_x - shard.lo_px)
-        
-        cal_px_inds = np.array(cal_px_inds)
+
+        # 2a: Find the water records whose shifted pixel is in the shard
+        start, end = db.get_shard_rows(shard.order, shard.lo_px - shift, shard.hi_px - shift)
+        rows = np.arange(start, end)
+        rows = rows[db.cls[rows] == b"w"]
+
+        # 2b: Calculate the intensity of each telluric pixel in the shard
+        inds = db.px[rows] + shift - shard.lo_px
+        db_spectrum[inds] = np.exp(db.r_m[rows] * mu + db.r_c[rows])
+
+        # 2c: Record the index of each telluric pixel that was a calibration pixel
+        cal_px_inds = inds[np.in1d(rows, db.get_calibrator_rows(measured_cal_pxs))]
 
         # 3: Plot telluric spectrum and errors against science spectrum
         fig = plt.figure(facecolor = 'white')
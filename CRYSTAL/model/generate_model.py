@@ -1,7 +1,5 @@
 import numpy as np
 
-import load_store.db_indicies as dbi
-
 ###########
 # Globals #
 ###########
@@ -13,26 +11,63 @@ WV_IND = 2
 CLS_IND = 3
 INT_IND = 4
 
+# The name and type of each field of the spectrum model, in the order of the
+# indices above
+MODEL_DTYPE = np.dtype([("order", "<i4"), ("px", "<i4"), ("wavelength", "<f8"),
+                        ("cls", "S1"), ("intensity", "<f8")])
+
+# The intensity of composite pixels, whose depth the model does not predict
+global COMPOSITE_INTENSITY
+COMPOSITE_INTENSITY = -1
+
 def generate_model(mu, z, db, config):
 
     '''
     Combine mu and z values with telluric db to generate telluric model
+
+    Water pixels' intensity is exp(r_m*mu + r_c), and non-water pixels'
+    exp(r_m*z + r_c). Pixels shallower than min_model_depth are left out of
+    the model. Composite pixels are always in the model, with intensity
+    COMPOSITE_INTENSITY.
+
+    Returns the model as a record array of MODEL_DTYPE with a row for each
+    pixel, in the order of the db. A row's fields can be indexed by the
+    indices above.
     '''
 
-    model = []
-
-    for record in db:
-        if record[dbi.CLS_IND] == "w":
-            f_w  = np.poly1d([record[dbi.RM_IND], record[dbi.RC_IND]])
-            lin_intensity = np.exp(f_w(mu))
-        elif record[dbi.CLS_IND] == "z":
-            f_z  = np.poly1d([record[dbi.RM_IND], record[dbi.RC_IND]])
-            lin_intensity = np.exp(f_z(z))
-        elif record[dbi.CLS_IND] == "c":
-            intensity = -1
-        if record[dbi.CLS_IND] == "c" or lin_intensity < 1.0 - config["min_model_depth"]:
-            model.append(record[dbi.ORD_IND:dbi.CLS_IND+1] + [lin_intensity])
+    # 1) Evaluate every water and non-water pixel's intensity at once
+    is_w, is_z, is_c = db.cls == b"w", db.cls == b"z", db.cls == b"c"
+    x = np.where(is_w, mu, z)
+    with np.errstate(invalid="ignore", over="ignore"):
+        lin_intensity = np.exp(db.r_m * x + db.r_c)
+    lin_intensity[is_c] = COMPOSITE_INTENSITY
+
+    # 2) Keep composite pixels, and pixels deeper than min_model_depth
+    is_modelled = is_c | ((is_w | is_z) & (lin_intensity < 1.0 - config["min_model_depth"]))
+
+    model = np.zeros(np.count_nonzero(is_modelled), dtype=MODEL_DTYPE)
+    model["order"] = db.order[is_modelled]
+    model["px"] = db.px[is_modelled]
+    model["wavelength"] = db.wavelength[is_modelled]
+    model["cls"] = db.cls[is_modelled]
+    model["intensity"] = lin_intensity[is_modelled]
     return model
-            
-        
-        
+
+def gen_dense_model(model, config):
+
+    '''
+    Lays out a telluric model as an array of intensities for each order.
+
+    Returns a dict mapping each order in the model to an array of length
+    pixels_per_order holding the model's intensity at each pixel, with nan
+    at pixels without a telluric, so a spectrum's order can be corrected by
+    indexing its array directly. Composite pixels are nan too, since their
+    depth is not predicted.
+    '''
+
+    dense_model = {}
+    for order in np.unique(model["order"]):
+        in_order = (model["order"] == order) & (model["cls"] != b"c")
+        dense_model[int(order)] = np.zeros(config["pixels_per_order"]) + np.nan
+        dense_model[int(order)][model["px"][in_order]] = model["intensity"][in_order]
+    return dense_model
@@ -0,0 +1,142 @@
+import os
+
+import numpy as np
+
+###########
+# Globals #
+###########
+
+# Random numbers drawn per batch of trials. Trials are simulated in
+# batches of about this many samples, to bound the memory used.
+global BATCH_SIZE
+BATCH_SIZE = 1 << 22
+
+# Trials needed beyond a threshold for it to be reliable. Thresholds are
+# tabulated for p values down to MIN_TAIL_TRIALS / trials.
+global MIN_TAIL_TRIALS
+MIN_TAIL_TRIALS = 10
+
+# p values thresholds are tabulated for, from the largest down to the
+# smallest reliable p value (log spaced.)
+global MAX_P_VALUE
+MAX_P_VALUE = 0.5
+global N_P_VALUES
+N_P_VALUES = 1000
+
+# Seed of the simulations, so a table is the same whenever it is simulated.
+global SEED
+SEED = 0
+
+# Tables read or simulated by this process, by (n, trials).
+global _tables
+_tables = {}
+
+def simulate_PCCs(n, trials, seed=SEED):
+
+    '''
+    Simulates the PCCs of n samples of two uncorrelated variables.
+
+    Returns the PCC of each of trials pairs of n Gaussian samples, sorted.
+    Trials are simulated as (trials x n) matrices in batches, and each
+    batch's PCCs are computed at once from the rows' centered samples.
+    '''
+
+    rs = np.random.RandomState(seed)
+    batch_trials = max(1, BATCH_SIZE // n)
+    PCCs = np.empty(trials)
+    for start in range(0, trials, batch_trials):
+        end = min(start + batch_trials, trials)
+        x = rs.standard_normal((end - start, n))
+        y = rs.standard_normal((end - start, n))
+        x -= x.mean(axis=1)[:, np.newaxis]
+        y -= y.mean(axis=1)[:, np.newaxis]
+        PCCs[start:end] = (np.einsum("ij,ij->i", x, y) /
+                           np.sqrt(np.einsum("ij,ij->i", x, x) * np.einsum("ij,ij->i", y, y)))
+    PCCs.sort()
+    return PCCs
+
+def gen_threshold_table(n, trials):
+
+    '''
+    Simulates the PCC thresholds of n samples at a range of p values.
+
+    Returns a (N_P_VALUES x 2) array of p values, decreasing from
+    MAX_P_VALUE to MIN_TAIL_TRIALS / trials, and the PCC that a p value's
+    fraction of the simulated PCCs exceed.
+    '''
+
+    if n < 3:
+        raise Exception("Can't simulate PCC thresholds for fewer than 3 spectra")
+    if trials * MAX_P_VALUE < MIN_TAIL_TRIALS:
+        raise Exception("Need at least {} trials to simulate PCC thresholds".format(
+            int(np.ceil(MIN_TAIL_TRIALS / MAX_P_VALUE))))
+
+    PCCs = simulate_PCCs(n, trials)
+    p_values = np.logspace(np.log10(MAX_P_VALUE), np.log10(float(MIN_TAIL_TRIALS) / trials),
+                           N_P_VALUES)
+    return np.column_stack([p_values, np.percentile(PCCs, 100 * (1 - p_values))])
+
+def get_threshold_table(n, trials, cache_path):
+
+    '''
+    Returns the table of PCC thresholds for n samples from trials trials.
+
+    Tables are cached in cache_path as pcc_threshold_n<n>_t<trials>.npy, so
+    each is only simulated once. If cache_path is None, tables are only
+    kept for the life of the process. A table is written to cache_path
+    whenever it is missing there, even if it was already in memory.
+    '''
+
+    key = (n, trials)
+    filename = None
+    if cache_path is not None:
+        filename = os.path.join(cache_path, "pcc_threshold_n{}_t{}.npy".format(n, trials))
+
+    # A table kept in memory may have been simulated without a cache path,
+    # so it is still written to this cache if missing from it.
+    if key in _tables:
+        table = _tables[key]
+    elif filename is not None and os.path.isfile(filename):
+        table = np.load(filename)
+    else:
+        table = gen_threshold_table(n, trials)
+    if filename is not None and not os.path.isfile(filename):
+        write_threshold_table(table, filename)
+
+    _tables[key] = table
+    return table
+
+def write_threshold_table(table, filename):
+
+    '''
+    Writes a threshold table to the cache.
+
+    The table is written to a temporary file and renamed into place, so
+    concurrent calibrations never read a partly written table.
+    '''
+
+    cache_path = os.path.dirname(filename)
+    if cache_path and not os.path.isdir(cache_path):
+        os.makedirs(cache_path)
+    tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+    with open(tmp_filename, "wb") as table_file:
+        np.save(table_file, table)
+    os.rename(tmp_filename, filename)
+
+def get_PCC_threshold(p_value, n, trials, cache_path):
+
+    '''
+    Returns the PCC that n samples of uncorrelated variables exceed with p_value.
+
+    The threshold is interpolated from the table of thresholds for n samples
+    (see get_threshold_table), linearly in log p value.
+    '''
+
+    table = get_threshold_table(n, trials, cache_path)
+    p_values, thresholds = table[:, 0], table[:, 1]
+    if p_value > p_values[0] or p_value < p_values[-1]:
+        raise Exception("p_value must be between {:g} and {:g} for {} PCC threshold trials".format(
+            p_values[-1], p_values[0], trials))
+
+    # np.interp needs increasing x, and p values decrease through the table.
+    return float(np.interp(np.log(p_value), np.log(p_values[::-1]), thresholds[::-1]))
@@ -16,9 +16,9 @@ def find_regression_coeffs(shards, calibrators):
 
     Notes
     -----
-    The order in which spectrum appear in each calibrator is saved, and 
-    spectra's depths' at the current telluric pixel are appended in that order
-    to make sure that the regression's x and y values are in the right order.
+    Each shard's log intensity cube stores its spectra in the same order as
+    the calibrators, so the regression's x and y values are in the right 
+    order. All of a shard's cluster pixels are regressed at once.
     '''
 
     w_calibrator, z_calibrator, f_order = calibrators
@@ -28,12 +28,38 @@ def find_regression_coeffs(shards, calibrators):
         for clusters, coeffs, calibrator in zip([shard.w_clusters, shard.z_clusters],
                                                 [shard.w_coeffs, shard.z_coeffs],
                                                 [w_calibrator, z_calibrator]):
-            for cluster in clusters:
-                for px in range(cluster[ST_IND], cluster[END_IND]+1):
-                    px_depth = []
-                    for filename in f_order:
-                        px_depth.append(shard.spectra[filename].log_y[px])
-                    m, c = np.polyfit(calibrator, px_depth, 1)
-                    coeffs[px] = (m, c)
-
-                
+            pxs = get_cluster_pxs(clusters)
+            if len(pxs) > 0:
+                coeffs[pxs] = fit_lines(calibrator, shard.log_y[:, pxs])
+
+def get_cluster_pxs(clusters):
+
+    '''
+    Returns the index of each pixel in clusters.
+    '''
+
+    pxs = [np.arange(cluster[ST_IND], cluster[END_IND]+1) for cluster in clusters]
+    if not pxs:
+        return np.array([], dtype=int)
+    return np.concatenate(pxs)
+
+def fit_lines(x, Y):
+
+    '''
+    Fits a line to each column of Y against x by least squares.
+
+    Solves for the slope and intercept of every column of Y (e.g. the depths
+    of each pixel of a shard or an order in each spectrum) in closed form,
+    giving the same fit as np.polyfit(x, Y[:, i], 1) for each column i.
+
+    Returns an array with a row (m, c) for each column of Y, where the 
+    column's line is y = m*x + c.
+    '''
+
+    x = np.asarray(x, dtype=float)
+    x_mean = x.mean()
+    Y_mean = Y.mean(axis=0)
+    x_dev = x - x_mean
+    m = np.dot(x_dev, Y - Y_mean) / np.dot(x_dev, x_dev)
+    c = Y_mean - m * x_mean
+    return np.column_stack((m, c))
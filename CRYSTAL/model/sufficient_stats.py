@@ -0,0 +1,115 @@
+import numpy as np
+
+import data_containers.shard as shard_container
+import data_containers.shard_stats as shard_stats_container
+import model.regression_model as regression_model
+
+def add_spectra(shard_stats, shards, calibrators):
+
+    '''
+    Adds the normalized spectra in shards to each shard's statistics.
+
+    Parameters
+    ----------
+    shard_stats: dict
+        Maps each shard's address to its Shard_Stats. Statistics are created
+        for any shard in shards without them.
+
+    shards: dict
+        The shards holding the spectra to add.
+
+    calibrators: tuple
+        The spectra's water and airmass calibrators (see 
+        telluric_identification.generate_calibrators).
+    '''
+
+    w_calibrator, z_calibrator, f_order = calibrators
+    w_calibrator = np.asarray(w_calibrator, dtype=float)
+    z_calibrator = np.asarray(z_calibrator, dtype=float)
+
+    for shard_addr, shard in shards.iteritems():
+        if shard_addr not in shard_stats:
+            shard_stats[shard_addr] = shard_stats_container.Shard_Stats(*shard_addr)
+        stats = shard_stats[shard_addr]
+
+        stats.n += len(f_order)
+        stats.w_sum += w_calibrator.sum()
+        stats.w_sq_sum += np.dot(w_calibrator, w_calibrator)
+        stats.z_sum += z_calibrator.sum()
+        stats.z_sq_sum += np.dot(z_calibrator, z_calibrator)
+        stats.wv_sum += shard.lin_x.sum(axis=0)
+        stats.y_sum += shard.log_y.sum(axis=0)
+        stats.y_sq_sum += (shard.log_y ** 2).sum(axis=0)
+        stats.wy_sum += np.dot(w_calibrator, shard.log_y)
+        stats.zy_sum += np.dot(z_calibrator, shard.log_y)
+
+def get_shards(shard_stats):
+
+    '''
+    Creates a shard for each shard's statistics.
+
+    The shards hold no spectra. Their coadded spectrum and the results of
+    the calibration stages are computed from their statistics.
+    '''
+
+    shards = {}
+    for shard_addr, stats in shard_stats.iteritems():
+        shards[shard_addr] = shard_container.Shard(*shard_addr)
+        shards[shard_addr].stats = stats
+    return shards
+
+def flag_high_PCC_pixels(k, shards):
+
+    '''
+    Flag pixels with high PCC with either the water calibrator or airmass.
+
+    Equivalent of telluric_identification.flag_high_PCC_pixels for shards 
+    created from statistics by get_shards.
+    '''
+
+    for shard in shards.itervalues():
+        stats = shard.stats
+        PCCs = compute_PCCs(stats.n, stats.w_sum, stats.w_sq_sum, stats.y_sum, stats.y_sq_sum,
+                            stats.wy_sum)
+        shard.w_PCCs[:] = PCCs
+        shard.w_tel[:] = PCCs > k
+
+        PCCs = compute_PCCs(stats.n, stats.z_sum, stats.z_sq_sum, stats.y_sum, stats.y_sq_sum,
+                            stats.zy_sum)
+        shard.z_PCCs[:] = -PCCs
+        shard.z_tel[:] = (-PCCs) > k
+
+def find_regression_coeffs(shards):
+
+    '''
+    Build a regression model for each telluric pixel & save regression coeffs.
+
+    Equivalent of regression_model.find_regression_coeffs for shards created
+    from statistics by get_shards.
+    '''
+
+    for shard in shards.itervalues():
+        stats = shard.stats
+        for clusters, coeffs, x_sum, x_sq_sum, xy_sum in \
+                zip([shard.w_clusters, shard.z_clusters], [shard.w_coeffs, shard.z_coeffs],
+                    [stats.w_sum, stats.z_sum], [stats.w_sq_sum, stats.z_sq_sum],
+                    [stats.wy_sum, stats.zy_sum]):
+            pxs = regression_model.get_cluster_pxs(clusters)
+            if len(pxs) == 0:
+                continue
+            y_sum = stats.y_sum[pxs]
+            m = (stats.n * xy_sum[pxs] - x_sum * y_sum) / (stats.n * x_sq_sum - x_sum ** 2)
+            c = (y_sum - m * x_sum) / stats.n
+            coeffs[pxs] = np.column_stack((m, c))
+
+def compute_PCCs(n, x_sum, x_sq_sum, y_sum, y_sq_sum, xy_sum):
+
+    '''
+    Computes the PCC of x with each pixel's y from their sums.
+    '''
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = n * xy_sum - x_sum * y_sum
+        x_var = n * x_sq_sum - x_sum ** 2
+        y_var = n * y_sq_sum - y_sum ** 2
+        return cov / np.sqrt(x_var * y_var)
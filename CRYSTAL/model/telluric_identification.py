@@ -1,8 +1,6 @@
-import csv
-
 import numpy as np
-import scipy.interpolate as interpolate
-import scipy.stats as stats
+
+import model.pcc_threshold as pcc_threshold
 
 def generate_calibrators(shards, config):
     '''
@@ -13,36 +11,26 @@ def generate_calibrators(shards, config):
     '''
 
     # 1) Generate list of spectrum airmasses, and records the spectra's 
-    # ordering.
-    z_calibrator = []
-    f_order = []
-    for filename, spectrum in shards.itervalues().next().spectra.iteritems():
-        z_calibrator.append(spectrum.z)
-        f_order.append(filename)
+    # ordering. Every shard stores its spectra in the same file order.
+    first_shard = shards.itervalues().next()
+    z_calibrator = list(first_shard.z)
+    f_order = list(first_shard.filenames)
 
     # 2) Generate list of the average height of the water calibration pixels
     # in each spectrum in the recorded order.
     if not config["calibrators"]:
         raise Exception("No calibration lines given in config.")
 
-    w_calibrator = None
+    w_calibrator = np.zeros(len(f_order))
     for shardloc, px in config["calibrators"]:
-        shard = shards[tuple(shardloc)]
-        px_heights = []
-        for filename in f_order:
-            spectrum = shard.spectra[filename]
-            px_heights.append(spectrum.log_y[px])
-        if w_calibrator is None:
-            w_calibrator = np.array(px_heights)
-        else:
-            w_calibrator += px_heights
+        w_calibrator += shards[tuple(shardloc)].log_y[:, px]
 
     w_calibrator /= len(config["calibrators"])
 
     return (w_calibrator, z_calibrator, f_order)
 
 
-def compute_PCC_threshold(p_value, db_path):
+def compute_PCC_threshold(p_value, n_spectra, config):
 
     '''
     Computes the threshold PCC from user submitted p value.
@@ -54,31 +42,29 @@ def compute_PCC_threshold(p_value, db_path):
     histogram of PCCs generated by noise, and the xth percentile p value
     calculated by taking the xth percentile PCC in the simulation (see 
     Leet et al. Tracking Tellurics in High Resolution Spectra,
-    I. A Linear Regression Model, ApJ, 2019.) This is a temporary fix and will
-    be improved.
+    I. A Linear Regression Model, ApJ, 2019.) The table in config's
+    threshold_k_db_path was simulated this way for about 50 spectra.
+
+    If config's pcc_threshold_trials is set, the simulation is instead run
+    for the n_spectra calibration spectra with that many trials, and its 
+    thresholds are cached (see model/pcc_threshold.)
     '''
 
-    # 1) Read p_values and PCCs from the k threshold databse
-    p_values, PCCs = [], []
-    PVAL_I, PCC_I = 0, 1
-    with open(db_path) as db:
-        db_reader = csv.reader(db, delimiter=" ")
-        are_headers_read = False
-        for record in db_reader:
-            if are_headers_read:
-                p_values.append(float(record[PVAL_I]))
-                PCCs.append(float(record[PCC_I]))
-            else:
-                are_headers_read = True
-
-    # 2) Create mapping between p_values and PCCs by linear interpolation.
-    p_value_2_PCC = interpolate.interp1d(p_values, PCCs)
+    # 1) Use a simulation of n_spectra spectra if config asks for one
+    if config["pcc_threshold_trials"]:
+        return pcc_threshold.get_PCC_threshold(p_value, n_spectra, 
+                                               config["pcc_threshold_trials"],
+                                               config["pcc_threshold_cache_path"])
+
+    # 2) Read p_values and PCCs from the k threshold databse
+    p_values, PCCs = np.loadtxt(config["threshold_k_db_path"], skiprows=1, unpack=True)
     
-    # 3) Use mapping to determine threshold p_value for as long as p_value
-    # is between 0.1 and 0.00001
+    # 3) Use linear interpolation between p_values to determine threshold 
+    # p_value for as long as p_value is between 0.1 and 0.00001. p_values
+    # decrease through the database, and np.interp needs them increasing.
     if p_value > 0.1 or p_value < 0.00001:
         raise Exception("p_value in config outside of supported range 0.1-0.00001")
-    k = p_value_2_PCC(p_value)
+    k = np.interp(p_value, p_values[::-1], PCCs[::-1])
     return k
                 
 
@@ -106,24 +92,35 @@ def flag_high_PCC_pixels_in_shard(calibrators, k, shard, config):
     '''
 
     w_calibrator, z_calibrator, f_order = calibrators
-    for i in range(shard.hi_px - shard.lo_px):
-        
-        # 1) Order each pixel's spectrum intensities in the same order of
-        # spectra as the calibrators.
-        px_intensities = []
-        for filename in f_order:
-            spectrum = shard.spectra[filename]
-            px_intensities.append(spectrum.log_y[i])
-            
-        # 2) Record the pixel intensity's PCC with water and flag pixels
-        # with significant PCC at the config's p value.
-        PCC = np.corrcoef(w_calibrator, px_intensities)[0][1]
-        shard.w_PCCs[i] = PCC
-        shard.w_tel[i] = PCC > k
-
-        # 3) Record the pixel intensity's PCC with z and flag pixels
-        # with significant PCC at the config's p value.
-        PCC = np.corrcoef(z_calibrator, px_intensities)[0][1]
-        shard.z_PCCs[i] = (-PCC)
-        shard.z_tel[i] = (-PCC) > k
-            
+
+    # 1) Standardize each pixel's column of the shard's (spectra x pixels)
+    # log intensity cube once. The cube's rows are in the same order of
+    # spectra as the calibrators.
+    std_intensities = standardize(shard.log_y)
+
+    # 2) Record each pixel's PCC with water and flag pixels with significant
+    # PCC at the config's p value. The PCC of two standardized variables is
+    # the mean of their product, so all pixels' PCCs are a single product.
+    PCCs = np.dot(standardize(w_calibrator), std_intensities) / len(f_order)
+    shard.w_PCCs[:] = PCCs
+    shard.w_tel[:] = PCCs > k
+
+    # 3) Record each pixel's PCC with z and flag pixels with significant PCC
+    # at the config's p value.
+    PCCs = np.dot(standardize(z_calibrator), std_intensities) / len(f_order)
+    shard.z_PCCs[:] = -PCCs
+    shard.z_tel[:] = (-PCCs) > k
+
+
+def standardize(data):
+
+    '''
+    Standardizes data to zero mean and unit variance along its first axis.
+
+    Constant data has no defined PCC, and is standardized to nan, matching
+    np.corrcoef.
+    '''
+
+    data = np.asarray(data, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (data - data.mean(axis=0)) / data.std(axis=0)
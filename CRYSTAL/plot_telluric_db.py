@@ -4,6 +4,7 @@ import yaml
 import load_store.read_argv as read_argv
 import load_store.read_db as read_db
 import visualize.plot_telluric_db
+import visualize.render as render
 
 def plot_telluric_db():
 
@@ -17,8 +18,10 @@ def plot_telluric_db():
 
     # 1) LOAD DATA
     config = yaml.safe_load(file("config/config.yml", "r"))
+    render.start_renderer(config, "telluric_db")
     db = read_db.read_db(config)
     visualize.plot_telluric_db.plot_telluric_db(db, config)
+    render.stop_renderer()
     
 
 if __name__ == "__main__":
@@ -4,6 +4,7 @@ import yaml
 import load_store.read_argv as read_argv
 import load_store.read_db as read_db
 import visualize.plot_telluric_range
+import visualize.render as render
 
 def plot_telluric_range():
 
@@ -17,9 +18,11 @@ def plot_telluric_range():
 
     # 1) LOAD DATA
     config = yaml.safe_load(file("config/config.yml", "r"))
+    render.start_renderer(config, "telluric_range")
     db = read_db.read_db(config)
     wv_lo, wv_hi = read_argv.view_tellurics_read_argv(sys.argv)
     visualize.plot_telluric_range.plot_telluric_range(db, wv_lo, wv_hi)
+    render.stop_renderer()
 
 if __name__ == "__main__":
     plot_telluric_range()
@@ -29,27 +29,40 @@ def divide_orders(order_shards, config):
 
     shards = {}
     for order, shard in order_shards.iteritems():
-        if config["special_shard_ranges"] is not None and order in config["special_shard_ranges"]:
-            for rng_start, rng_end in config["special_shard_ranges"][order]:
-                shards[(order, rng_start, rng_end)] = take_shard_subsec(rng_start, rng_end, shard)
-        else:
-            for rng_start, rng_end in config["default_shard_ranges"]:
-                shards[(order, rng_start, rng_end)] = take_shard_subsec(rng_start, rng_end, shard)
+        for rng_start, rng_end in get_shard_ranges(order, config):
+            shards[(order, rng_start, rng_end)] = take_shard_subsec(rng_start, rng_end, shard)
     return shards
 
+def get_shard_addrs(orders, config):
+
+    '''
+    Returns the address (order, lo_px, hi_px) of each shard orders are divided into.
+    '''
+
+    return set((int(order), rng_start, rng_end) for order in orders
+               for rng_start, rng_end in get_shard_ranges(order, config))
+
+def get_shard_ranges(order, config):
+
+    '''
+    Returns the pixel ranges [rng_start, rng_end) that order is divided into.
+    '''
+
+    if config["special_shard_ranges"] is not None and order in config["special_shard_ranges"]:
+        return config["special_shard_ranges"][order]
+    return config["default_shard_ranges"]
 
 def take_shard_subsec(rng_start, rng_end, shard):
 
     '''
     Creates a shard from the pixel range [rng_start, rng_end).
+
+    The new shard's data cubes are views of the columns of shard's cubes in
+    the range, so no spectrum data is copied.
     '''
     
     subsec_shard = data_containers.shard.Shard(shard.order, rng_start, rng_end)
-    for filename, spectrum in shard.spectra.iteritems():
-        lin_x = spectrum.lin_x[rng_start:rng_end]
-        lin_y = spectrum.lin_y[rng_start:rng_end]
-        log_y = spectrum.log_y[rng_start:rng_end]
-        z = spectrum.z
-        subsec_spectrum = data_containers.shard.Spectrum_Data(lin_x, lin_y, log_y, z)
-        subsec_shard.spectra[filename] = subsec_spectrum
+    lin_y = None if shard.lin_y is None else shard.lin_y[:, rng_start:rng_end]
+    subsec_shard.set_spectra(shard.filenames, shard.lin_x[:, rng_start:rng_end], lin_y,
+                             shard.log_y[:, rng_start:rng_end], shard.z)
     return subsec_shard
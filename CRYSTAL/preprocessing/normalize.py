@@ -1,4 +1,3 @@
-import matplotlib.pyplot as plt
 import numpy as np
 
 def normalize(shards):
@@ -21,66 +20,90 @@ def remove_baseline(shard):
     '''
     Normalizes a shard.
 
-    Worker function function of normalize.
+    Worker function function of normalize. Every spectrum in the shard is
+    normalized at once: the sets' linear fits, the filtering of points below
+    them, and the polynomial fits are each done for all spectra together.
     '''
 
-    for spectrum in shard.spectra.itervalues():
+    SET_LEN = 100
+    POLY_DEG = 5
+
+    x, y = shard.lin_x, shard.log_y
+    n_px = y.shape[1]
+
+    # 1) Fit a line to each set of SET_LEN data points of each spectrum (the
+    # last set holds any remaining points), and flag the points on or above
+    # their set's line.
+    set_fits = np.empty(y.shape)
+    full_sets_len = n_px - n_px % SET_LEN
+    set_shape = (y.shape[0], full_sets_len // SET_LEN, SET_LEN)
+    set_fits[:, :full_sets_len] = fit_set_lines(x[:, :full_sets_len].reshape(set_shape),
+                                                y[:, :full_sets_len].reshape(set_shape)
+                                                ).reshape(y.shape[0], full_sets_len)
+    if full_sets_len < n_px:
+        set_fits[:, full_sets_len:] = fit_set_lines(x[:, full_sets_len:], y[:, full_sets_len:])
+    is_above_fit = y >= set_fits
+
+    # 2) Fit a polynomial to each spectrum's points above its sets' lines, 
+    # centered on their median wavelength. The fit is solved as a least 
+    # squares fit over all points weighted by whether they are above their 
+    # line. Each spectrum's wavelengths are scaled to [-1, 1] and fit in the
+    # Legendre basis, which spans the same polynomials as np.polyfit but 
+    # keeps the batched normal equations well conditioned.
+    median_x = np.nanmedian(np.where(is_above_fit, x, np.nan), axis=1)
+    centered_x = x - median_x[:, np.newaxis]
+    scaled_x = centered_x / np.abs(centered_x).max(axis=1)[:, np.newaxis]
+    basis = np.polynomial.legendre.legvander(scaled_x, POLY_DEG)
+    weights = is_above_fit.astype(float)
+    normal_matrix = np.einsum("spi,sp,spj->sij", basis, weights, basis)
+    normal_vector = np.einsum("spi,sp,sp->si", basis, weights, y)
+    coeffs = np.linalg.solve(normal_matrix, normal_vector[:, :, np.newaxis])[:, :, 0]
+    baselines = np.einsum("spi,si->sp", basis, coeffs)
+
+    # This plots the baseline fit. Useful for debugging
+    plot_baseline_fitter = False
+    if plot_baseline_fitter:
+        for i in range(y.shape[0]):
+            plot_baseline_fit(shard, x[i], y[i], set_fits[i], is_above_fit[i], baselines[i])
+
+    shard.set_log_y(y - baselines)
+
+def fit_set_lines(x, y):
 
-        set_len = 100
-        set_x, set_f, rdat_x, rdat_y = [], [], [], []
-        set_no = int(len(spectrum.log_y)/set_len)
-
-        for set_i in range(set_no+1):
-
-            #Select set of data points
-            x = np.array(spectrum.lin_x[set_i*set_len:(set_i+1)*set_len])
-            y = np.array(spectrum.log_y[set_i*set_len:(set_i+1)*set_len])
-
-            if len(x) == 0:
-                break 
-
-            #Fit and store linear fit to data points
-            f = np.poly1d(np.polyfit(x, y, 1))
-            set_x.append(x)
-            set_f.append(f)
-            
-            #Filter out data points below linear fit
-            for i in range(len(x)):
-                if(y[i] >= f(x[i])):
-                    rdat_x.append(x[i])
-                    rdat_y.append(y[i])
-
-        rdat_x = np.array(rdat_x)
-        rdat_y = np.array(rdat_y)
-        median_x = np.median(rdat_x)
-        rdat_x -= median_x
+    '''
+    Fits a line to each set of points along the last axis of x and y.
 
-        polyfit = np.poly1d(np.polyfit(rdat_x, rdat_y, 5))
+    Returns the value of each set's line at each of its points. The lines 
+    are the same as np.polyfit(x_set, y_set, 1) gives. A set whose points 
+    all have the same x is fit by a horizontal line.
+    '''
 
-        # This plots the baseline fit. Useful for debugging
-        plot_baseline_fitter = False
-        if plot_baseline_fitter:
-            plot_baseline_fit(spectrum, set_x, set_f, median_x, rdat_x, rdat_y, polyfit, shardloc)
-        
-        baselineY = polyfit(spectrum.lin_x - median_x)
-        spectrum.log_y -= baselineY
+    x_mean = x.mean(axis=-1)[..., np.newaxis]
+    y_mean = y.mean(axis=-1)[..., np.newaxis]
+    x_dev = x - x_mean
+    x_var = (x_dev * x_dev).sum(axis=-1)[..., np.newaxis]
+    xy_cov = (x_dev * (y - y_mean)).sum(axis=-1)[..., np.newaxis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        m = np.where(x_var > 0, xy_cov / x_var, 0.0)
+    return y_mean + m * x_dev
 
-def plot_baseline_fit(self, spectrum, set_x, set_f, median_x, rdat_x, rdat_y, polyfit, shardloc):
+def plot_baseline_fit(shard, x, y, set_fits, is_above_fit, baseline):
 
     '''
-    Plots the baseline fitter's fitting process.
+    Plots the baseline fitter's fitting process for a spectrum.
     '''
 
+    import matplotlib.pyplot as plt
     fig = plt.figure(facecolor='white')
-    plt.title("Logged data for order {}, px:({},{}) w/ baselines fitted".format(shardloc[0], shardloc[1], shardloc[2]))
+    plt.title("Logged data for order {}, px:({},{}) w/ baselines fitted".format(shard.order, 
+                                                                                shard.lo_px,
+                                                                                shard.hi_px))
     plt.xlabel("Wavelength (Angstroms)")
     plt.ylabel("Log(Signal strength)")
 
-    for set_i in range(len(set_x)):
-        plt.plot(set_x[set_i], set_f[set_i](set_x[set_i]), color="red")
-        
-    plt.plot(spectrum.lin_x, spectrum.log_y, color="blue")
-    plt.plot(rdat_x + median_x, rdat_y, color="green")
-    plt.plot(rdat_x + median_x, polyfit(rdat_x), color="orange")
+    plt.plot(x, set_fits, color="red")
+    plt.plot(x, y, color="blue")
+    plt.plot(x[is_above_fit], y[is_above_fit], color="green")
+    plt.plot(x, baseline, color="orange")
         
     plt.show()            
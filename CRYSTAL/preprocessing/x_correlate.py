@@ -1,43 +1,148 @@
-import matplotlib.pyplot as plt
 import numpy as np
 
 import data_containers.shard as shi
-import load_store.db_indicies as dbi
+
+###########
+# Globals #
+###########
+
+# Differences between the telluric model and the spectrum greater than this
+# are capped at this value when computing a shift's SSE.
+global DIFF_LIM
+DIFF_LIM = 0.1
+
+# Shift returned if no shift has a finite SSE.
+global DEFAULT_SHIFT
+DEFAULT_SHIFT = -20
 
 
 def x_correlate(cal_pxs, shards, db, config):
 
     '''
     XCorrelate the telluric model with the spectrum on the calibration pxs.
+
+    Finds the pixel shift in [-x_corr_shift, x_corr_shift] minimizing the
+    SSE between the intensity of the water calibration records and the
+    science spectrum at each record's shifted pixel.
+
+    In "direct" x_corr_mode every shift is evaluated. In "coarse_to_fine"
+    mode, every x_corr_coarse_step'th shift is evaluated, and then every
+    shift around the best of these, so wide shift ranges can be searched
+    at a fraction of the cost. If x_corr_subpixel is set, the best shift
+    is refined to a fraction of a pixel by fitting a parabola to its SSE
+    and its neighbours' SSEs.
     '''
-        
-    best_shift = -20
-    best_SSE = float('inf')
-    for shift in range(-config["x_corr_shift"], config["x_corr_shift"]+1):
-        SSE = 0
-        SSEs = {}
-
-        for r in db:
-            r_order = r[dbi.ORD_IND]
-            r_x = r[dbi.PX_IND] + shift
-            r_y = r[dbi.INT_IND]
-            if (r_order, r[dbi.PX_IND]) in cal_pxs and r[dbi.CLS_IND] == "w":
-                for shard in shards.itervalues():
-                    if shard.order == r_order and shard.lo_px <= r_x and r_x < shard.hi_px:
-                        s_y = shard.spectra.itervalues().next().log_y[r_x - shard.lo_px]
-                        DIFF_LIM = 0.1
-                        if r_y - s_y > DIFF_LIM:
-                            SSE += abs(DIFF_LIM)
-                        else:
-                            SSE += abs(r_y - s_y)
-                        SSEs[(r_order, r[dbi.PX_IND])] = abs(r_y - s_y)
-
-        #print "SSEs:{}".format(SSEs)
-        #print "shift:{} SSE:{}, best_shift:{}, best_SSE:{}".format(shift, SSE, best_shift, best_SSE)
-
-        if SSE < best_SSE:
-            best_shift = shift
-            best_SSE = SSE
-    
-    return best_shift   
-    
+
+    # 1) Gather the calibration records and the science spectrum of each order once
+    cal_rows = db.get_calibrator_rows(cal_pxs)
+    orders, pxs, r_y = db.order[cal_rows], db.px[cal_rows], db.med_intensity[cal_rows]
+    order_spectra = get_order_spectra(shards)
+    max_shift = config["x_corr_shift"]
+
+    # 2) Pick the shifts to evaluate. In coarse to fine mode, these are the shifts around the
+    # best coarse shift.
+    if config["x_corr_mode"] == "direct":
+        shifts = np.arange(-max_shift, max_shift + 1)
+    elif config["x_corr_mode"] == "coarse_to_fine":
+        step = config["x_corr_coarse_step"]
+        coarse_shifts = np.arange(-max_shift, max_shift + 1, step)
+        coarse_SSEs = compute_SSEs(coarse_shifts, orders, pxs, r_y, order_spectra)
+        coarse_shift = find_best_shift(coarse_shifts, coarse_SSEs)
+        if coarse_shift is None:
+            return DEFAULT_SHIFT
+        shifts = np.arange(max(coarse_shift - step + 1, -max_shift),
+                           min(coarse_shift + step - 1, max_shift) + 1)
+    else:
+        raise Exception("Unknown x_corr_mode {}".format(config["x_corr_mode"]))
+
+    # 3) Evaluate the SSE of every shift at once, and pick the best shift
+    SSEs = compute_SSEs(shifts, orders, pxs, r_y, order_spectra)
+    best_shift = find_best_shift(shifts, SSEs)
+    if best_shift is None:
+        return DEFAULT_SHIFT
+    if config["x_corr_subpixel"]:
+        return refine_shift(best_shift, shifts, SSEs)
+    return best_shift
+
+def get_order_spectra(shards):
+
+    '''
+    Joins the science spectrum's shards into a spectrum for each order.
+
+    Returns a dict mapping each order to its log intensity and a mask of the
+    pixels covered by a shard, each indexed by pixel number.
+    '''
+
+    order_lens = {}
+    for shard in shards.itervalues():
+        order_lens[shard.order] = max(order_lens.get(shard.order, 0), shard.hi_px)
+
+    order_spectra = {}
+    for order, order_len in order_lens.iteritems():
+        order_spectra[order] = (np.zeros(order_len) + np.nan, np.zeros(order_len, dtype=bool))
+    for shard in shards.itervalues():
+        log_y, is_covered = order_spectra[shard.order]
+        log_y[shard.lo_px:shard.hi_px] = shard.spectra.itervalues().next().log_y
+        is_covered[shard.lo_px:shard.hi_px] = True
+    return order_spectra
+
+def compute_SSEs(shifts, orders, pxs, r_y, order_spectra):
+
+    '''
+    Computes the SSE of the telluric model with the science spectrum at each shift.
+
+    orders, pxs and r_y are the order, pixel and intensity of each water
+    calibration record. Each record whose shifted pixel is covered by the
+    spectrum adds its difference with the spectrum, capped at DIFF_LIM, to
+    the shift's SSE.
+    '''
+
+    SSEs = np.zeros(len(shifts))
+    for order in np.unique(orders):
+        if order not in order_spectra:
+            continue
+        log_y, is_covered = order_spectra[order]
+        in_order = orders == order
+
+        # A row for each shift and a column for each record in the order
+        inds = pxs[in_order][np.newaxis, :] + shifts[:, np.newaxis]
+        is_found = (inds >= 0) & (inds < len(log_y))
+        is_found[is_found] = is_covered[inds[is_found]]
+        # Differences are only taken at found pixels, since the rest hold nan
+        diffs = (np.broadcast_to(r_y[in_order], inds.shape)[is_found] -
+                 log_y[inds[is_found]])
+        errs = np.zeros(inds.shape)
+        errs[is_found] = np.where(diffs > DIFF_LIM, DIFF_LIM, np.abs(diffs))
+        SSEs += errs.sum(axis=1)
+    return SSEs
+
+def find_best_shift(shifts, SSEs):
+
+    '''
+    Returns the first shift with the lowest finite SSE, or None if there is none.
+    '''
+
+    SSEs = np.where(np.isnan(SSEs), np.inf, SSEs)
+    if not np.isfinite(SSEs).any():
+        return None
+    return int(shifts[np.argmin(SSEs)])
+
+def refine_shift(best_shift, shifts, SSEs):
+
+    '''
+    Refines the best integer shift to a fraction of a pixel.
+
+    Fits a parabola through the SSEs of best_shift and its two neighbours
+    and returns the position of its minimum, which is within half a pixel
+    of best_shift. Returns best_shift if either neighbour was not evaluated
+    or the parabola has no minimum.
+    '''
+
+    i = int(np.searchsorted(shifts, best_shift))
+    if i == 0 or i == len(shifts) - 1:
+        return best_shift
+    lo_SSE, SSE, hi_SSE = SSEs[i-1], SSEs[i], SSEs[i+1]
+    curvature = lo_SSE - 2*SSE + hi_SSE
+    if not np.isfinite(curvature) or curvature <= 0:
+        return best_shift
+    return best_shift + 0.5*(lo_SSE - hi_SSE)/curvature
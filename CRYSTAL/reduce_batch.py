@@ -0,0 +1,178 @@
+import collections
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+import yaml
+
+import generate_telluric_model
+import load_store.read_argv as read_argv
+import load_store.read_db as read_db
+import load_store.write_spectrum as write_spectrum
+import model.get_calibrators as get_calibrators
+
+###########
+# Globals #
+###########
+
+# The telluric database, calibration pixels and config shared by every
+# reduction in the batch. Set before the pool's workers are forked so that
+# every worker inherits them.
+global _reduction
+_reduction = None
+
+# Seconds to wait for a reduction's result before checking that the pool's
+# workers are still alive.
+global RESULT_POLL_INTERVAL
+RESULT_POLL_INTERVAL = 1.0
+
+def reduce_batch():
+
+    '''
+    Reduces a batch of science spectra, e.g. a night's observations.
+
+    Takes fits files and directories of fits files as arguments, e.g.
+
+    python CRYSTAL/reduce_batch.py <fits file or directory> ...
+
+    The config, telluric database and calibration pixels are loaded once and
+    shared by every reduction. Spectra are reduced on a pool of
+    reduction_workers processes, and each spectrum's telluric model is
+    written in model_format, as generate_telluric_model.py does (e.g. with
+    model_format "container", the whole batch is written to one file.) A
+    spectrum that fails to reduce is reported and does not stop the batch.
+    Plots are disabled. The batch is refused if two of its spectra would
+    write the same model file (see check_model_filenames.)
+    '''
+
+    global _reduction
+
+    # 1) LOAD DATA
+    config = yaml.safe_load(file("config/config.yml", "r"))
+    disable_plots(config)
+    db = read_db.read_db(config)
+    cal_pxs = get_calibrators.get_calibrators(config)
+    filenames = read_argv.reduce_batch_read_argv(sys.argv)
+    check_model_filenames(filenames, config)
+    _reduction = (db, cal_pxs, config)
+
+    # 2) REDUCE SPECTRA
+    # Results are reported as each spectrum finishes.
+    # If the batch stops early (e.g. on KeyboardInterrupt), the pool's
+    # workers are terminated rather than left behind.
+    st_time = time.time()
+    failures = []
+    pool = None
+    if config["reduction_workers"] <= 1:
+        results = (reduce_file(filename) for filename in filenames)
+    else:
+        pool = multiprocessing.Pool(config["reduction_workers"])
+        results = get_pool_results(pool, pool.imap_unordered(reduce_file, filenames))
+    try:
+        for filename, result, error in results:
+            if error is None:
+                shift, mu, z, model_filename = result
+                print "{} shift:{} mu:{:.5f} z:{:.5f} model:{}".format(filename, shift, mu, z,
+                                                                     model_filename)
+            else:
+                print >> sys.stderr, "{} FAILED:\n{}".format(filename, error)
+                failures.append(filename)
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    # 3) REPORT
+    elapsed = time.time() - st_time
+    print "Reduced {} of {} spectra in {:.2f}s ({:.2f} spectra/s)".format(
+        len(filenames) - len(failures), len(filenames), elapsed,
+        len(filenames) / elapsed if elapsed > 0 else float("inf"))
+    if failures:
+        print >> sys.stderr, "Failed to reduce:\n" + "\n".join(failures)
+        sys.exit(1)
+
+def disable_plots(config):
+
+    '''
+    Turns off every plot in config.
+    '''
+
+    for key in config:
+        if key.startswith("plot_"):
+            config[key] = False
+
+def get_pool_results(pool, results):
+
+    '''
+    Yields each result of a pool's imap, raising an exception if a worker dies.
+
+    Each result is waited for RESULT_POLL_INTERVAL s at a time, since on
+    Python 2 a wait without a timeout can't be interrupted. In between, the
+    pool's workers are checked: a pool only replaces a worker that died
+    (e.g. killed by the OOM killer), and the result it was working on never
+    comes.
+    '''
+
+    worker_pids = set(worker.pid for worker in pool._pool)
+    while True:
+        try:
+            result = results.next(timeout=RESULT_POLL_INTERVAL)
+        except StopIteration:
+            return
+        except multiprocessing.TimeoutError:
+            if set(worker.pid for worker in pool._pool) != worker_pids:
+                raise Exception("A reduction worker died before finishing its spectrum")
+            continue
+        yield result
+
+def check_model_filenames(filenames, config):
+
+    '''
+    Raises an exception if two spectra of a batch would write the same model.
+
+    With model_output_path null, csv and binary models are written to the
+    current directory by name, so spectra with the same name in different
+    directories clash. Setting model_output_path, or the container
+    model_format, keeps them apart. A spectrum given twice always clashes.
+    '''
+
+    if config["model_format"] == "container":
+        outputs = [os.path.abspath(filename) for filename in filenames]
+    else:
+        outputs = [os.path.abspath(write_spectrum.get_model_filename(filename, config))
+                   for filename in filenames]
+
+    clashes = collections.defaultdict(list)
+    for filename, output in zip(filenames, outputs):
+        clashes[output].append(filename)
+    clashes = [clash for clash in clashes.itervalues() if len(clash) > 1]
+    if clashes:
+        raise Exception("These spectra would write the same model; set model_output_path to "
+                        "write models at their spectrum's path:\n" +
+                        "\n".join(", ".join(clash) for clash in clashes))
+
+def reduce_file(filename):
+
+    '''
+    Reduces a single spectrum of the batch.
+
+    Returns the filename, the results of generate_telluric_model.reduce_spectrum
+    and None, or, if the reduction raised an exception, the filename, None
+    and its traceback.
+    '''
+
+    db, cal_pxs, config = _reduction
+    try:
+        return filename, generate_telluric_model.reduce_spectrum(filename, db, cal_pxs, config), None
+    except Exception:
+        return filename, None, traceback.format_exc()
+
+
+if __name__ == "__main__":
+    reduce_batch()
@@ -0,0 +1,305 @@
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import yaml
+
+import generate_telluric_model
+import load_store.read_db as read_db
+import model.get_calibrators as get_calibrators
+import reduce_batch
+
+###########
+# Globals #
+###########
+
+# Bytes read from a client at a time
+RECV_SIZE = 4096
+
+# Seconds a send to or receive from a client may block for before the
+# client is dropped
+CLIENT_TIMEOUT = 10.0
+
+# Bytes a request may hold before its newline. Clients sending longer
+# requests are dropped, so a client can't grow its buffer without bound.
+MAX_REQUEST_LENGTH = 4096
+
+class Reduction_Service():
+
+    '''
+    Reduces science spectra on request, keeping its inputs loaded between requests.
+
+    The service loads the config, telluric database and calibration pixels
+    once, so each reduction only costs the reduction itself. Requests are
+    taken from a Unix socket, or by watching a drop directory for new fits
+    files. Before each reduction, the database is reloaded if its file has
+    been replaced since it was loaded. write_db replaces the database file
+    by renaming a complete file over it, so the service always reads a
+    complete database.
+
+    Parameters
+    ----------
+    config: dict
+        Configuration. Its plots are disabled.
+
+    Attributes
+    ----------
+    config: dict
+        (see parameters)
+
+    db: Telluric_DB
+        The telluric database.
+
+    db_stat: tuple
+        The inode, size and modification time of the database file when db
+        was loaded.
+
+    cal_pxs: list
+        The calibration pixels.
+
+    dropped_filenames: set
+        The fits files in the drop directory already reduced.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        reduce_batch.disable_plots(self.config)
+        self.db = None
+        self.db_stat = None
+        self.cal_pxs = get_calibrators.get_calibrators(config)
+        self.dropped_filenames = set()
+        self.reload_db()
+
+    def get_db_filename(self):
+        return os.path.join(self.config["cal_db_path"], self.config["cal_db_filename"])
+
+    def reload_db(self):
+
+        '''
+        Reloads the telluric database if its file has been replaced.
+        '''
+
+        st = os.stat(self.get_db_filename())
+        db_stat = (st.st_ino, st.st_size, st.st_mtime)
+        if db_stat != self.db_stat:
+            self.db = read_db.read_db(self.config)
+            self.db_stat = db_stat
+
+    def reduce(self, filename):
+
+        '''
+        Reduces a science spectrum.
+
+        Returns a dict of the reduction's results: the spectrum's filename,
+        and either its fitted shift, mu and z and the path of its telluric
+        model, or the traceback of the exception reducing it raised.
+        '''
+
+        try:
+            self.reload_db()
+            shift, mu, z, model_filename = generate_telluric_model.reduce_spectrum(
+                filename, self.db, self.cal_pxs, self.config)
+            return {"filename": filename, "shift": shift, "mu": float(mu), "z": float(z),
+                    "model": os.path.abspath(model_filename)}
+        except Exception:
+            return {"filename": filename, "error": traceback.format_exc()}
+
+    def serve(self):
+
+        '''
+        Serves reduction requests until interrupted.
+
+        If reduction_socket is set, listens on it for requests. Each request
+        is a line holding the path of a fits file, and is answered with a
+        line holding its results as JSON. An exception is raised if another
+        service is already listening on the socket; a socket file left
+        behind by a service that died is replaced. If reduction_drop_path is set,
+        scans it every reduction_poll_interval seconds and reduces each new
+        fits file, printing its results as JSON.
+
+        The listening socket and every connected client are waited on
+        together, and each client's requests are read into its own buffer
+        as they arrive. Clients with requests waiting are served a request
+        each in turn, so no client, idle or busy, holds up the others or
+        the drop directory scans.
+        '''
+
+        # Stop serving cleanly when terminated, as when interrupted
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        server = None
+        socket_path = self.config["reduction_socket"]
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                if is_served(socket_path):
+                    raise Exception("A reduction service is already listening on {}".format(
+                        socket_path))
+                os.remove(socket_path)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(socket_path)
+            server.listen(5)
+
+        # Each connected client's buffer of bytes received but not yet handled
+        clients = {}
+        next_scan = time.time()
+        try:
+            while True:
+                # 1) Wait for a connection or request, or until it is time to
+                # scan the drop directory. Don't wait if requests are waiting.
+                timeout = max(0.0, next_scan - time.time())
+                if any("\n" in buf for buf in clients.itervalues()):
+                    timeout = 0.0
+                if server is not None:
+                    readable, _, _ = select.select([server] + clients.keys(), [], [], timeout)
+                else:
+                    time.sleep(timeout)
+                    readable = []
+
+                # 2) Accept new clients and read what clients have sent
+                for sock in readable:
+                    if sock is server:
+                        client = server.accept()[0]
+                        client.settimeout(CLIENT_TIMEOUT)
+                        clients[client] = ""
+                    else:
+                        self.read_client(sock, clients)
+
+                # 3) Answer a request from each client with one waiting
+                for client in [client for client, buf in clients.iteritems() if "\n" in buf]:
+                    self.handle_request(client, clients)
+
+                # 4) Reduce new files in the drop directory
+                if time.time() >= next_scan:
+                    next_scan = time.time() + self.config["reduction_poll_interval"]
+                    if self.config["reduction_drop_path"] is not None:
+                        for filename in self.find_dropped_files():
+                            print json.dumps(self.reduce(filename))
+                            sys.stdout.flush()
+        finally:
+            for client in clients:
+                client.close()
+            if server is not None:
+                server.close()
+                os.remove(socket_path)
+
+    def read_client(self, client, clients):
+
+        '''
+        Reads the bytes a client has sent into its buffer in clients.
+
+        The client is closed and removed from clients once it disconnects,
+        or if it sends a request longer than MAX_REQUEST_LENGTH.
+        '''
+
+        try:
+            data = client.recv(RECV_SIZE)
+        except socket.error:
+            data = ""
+        if data:
+            clients[client] += data
+        if not data or len(clients[client].rsplit("\n", 1)[-1]) > MAX_REQUEST_LENGTH:
+            client.close()
+            del clients[client]
+
+    def handle_request(self, client, clients):
+
+        '''
+        Answers the first request in a client's buffer in clients.
+
+        The client is closed and removed from clients if the answer can't
+        be sent within CLIENT_TIMEOUT.
+        '''
+
+        filename, clients[client] = clients[client].split("\n", 1)
+        if not filename.strip():
+            return
+        try:
+            client.sendall(json.dumps(self.reduce(filename.strip())) + "\n")
+        except socket.error:
+            client.close()
+            del clients[client]
+
+    def find_dropped_files(self):
+
+        '''
+        Returns the new fits files in the drop directory.
+
+        Files modified within the last poll interval are skipped until a
+        later scan, so that files still being copied in are not reduced.
+        '''
+
+        drop_path = self.config["reduction_drop_path"]
+        now = time.time()
+        filenames = []
+        for filename in sorted(os.listdir(drop_path)):
+            path = os.path.join(drop_path, filename)
+            if (filename.endswith(".fits") and path not in self.dropped_filenames and
+                    now - os.path.getmtime(path) >= self.config["reduction_poll_interval"]):
+                self.dropped_filenames.add(path)
+                filenames.append(path)
+        return filenames
+
+def is_served(socket_path):
+
+    '''
+    Returns whether a service is listening on the Unix socket at socket_path.
+    '''
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        probe.close()
+
+def request_reduction(filenames, config):
+
+    '''
+    Asks the service on reduction_socket to reduce each fits file.
+
+    Returns the results of each reduction.
+    '''
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(config["reduction_socket"])
+    results = []
+    client_file = client.makefile("r")
+    for filename in filenames:
+        client.sendall(os.path.abspath(filename) + "\n")
+        results.append(json.loads(client_file.readline()))
+    client_file.close()
+    client.close()
+    return results
+
+def reduction_service():
+
+    '''
+    Runs the reduction service, or sends it requests.
+
+    python CRYSTAL/reduction_service.py
+
+    starts the service, and
+
+    python CRYSTAL/reduction_service.py <fits file> ...
+
+    asks the running service to reduce each fits file and prints its
+    results.
+    '''
+
+    config = yaml.safe_load(file("config/config.yml", "r"))
+    if len(sys.argv) > 1:
+        for result in request_reduction(sys.argv[1:], config):
+            print json.dumps(result)
+    else:
+        Reduction_Service(config).serve()
+
+
+if __name__ == "__main__":
+    reduction_service()
@@ -0,0 +1,162 @@
+# utility/utility.py would shadow the utility package in imports otherwise
+from __future__ import absolute_import
+
+import ctypes
+import multiprocessing
+import time
+
+import numpy as np
+
+import utility.stage_timer as stage_timer
+
+###########
+# Globals #
+###########
+
+# Shard attributes computed by calibration stages. Only these are passed
+# between the main process and its workers. Spectra are never passed: they
+# are stored in shared memory and inherited by each worker when it is forked.
+STATE_ATTRS = ["w_PCCs", "w_tel", "w_clusters", "z_PCCs", "z_tel", "z_clusters", "c_clusters",
+               "w_coeffs", "z_coeffs", "log_y_version"]
+
+# The shards being processed by the pool. Set before the pool's workers are
+# forked so that every worker inherits it.
+global _shards
+_shards = None
+
+def shared_array(shape, config):
+
+    '''
+    Returns an empty float array, in shared memory if calibration is parallel.
+
+    Writes that a worker makes to an array in shared memory (e.g. when it
+    normalizes a spectrum) are seen by the main process and by every other
+    worker.
+    '''
+
+    if config["workers"] <= 1:
+        return np.empty(shape)
+    raw = multiprocessing.RawArray(ctypes.c_double, int(np.prod(shape)))
+    return np.frombuffer(raw, dtype=np.float64).reshape(shape)
+
+class Shard_Pool():
+
+    '''
+    Runs chains of calibration stages on each shard in a process pool.
+
+    A stage is a callable taking a dictionary of shards, such as the module
+    level functions of the calibration modules (e.g. normalize.normalize)
+    or a functools.partial binding their other arguments. Each stage handles
+    each shard independently, so the pool runs a chain of stages on each
+    shard as a single task, and collects each shard's results when its chain
+    finishes.
+
+    If config's workers setting is 1 or less, no pool is created and each
+    stage is run on all shards in turn in the main process.
+
+    If a Stage_Timer timing shards is given, the wall and CPU time each
+    shard's chain of stages takes, and the peak memory of the process that
+    ran it while it did, are added to its current stage. Without a pool,
+    each shard's chain is then run on the shard alone.
+
+    Parameters
+    ----------
+    shards: dict
+        Dictionary mapping each shard's address to the shard. Its spectra
+        should be stored in arrays made with shared_array.
+
+    config: dict
+        Configuration.
+
+    timer: Stage_Timer
+        Timer to add each shard's time to, or None.
+    '''
+
+    def __init__(self, shards, config, timer=None):
+        global _shards
+        self.shards = shards
+        self.timer = timer if timer is not None and timer.per_shard else None
+        self.pool = None
+        if config["workers"] > 1:
+            _shards = shards
+            self.pool = multiprocessing.Pool(config["workers"])
+
+    def run(self, stages):
+
+        '''
+        Runs the chain of stages on each shard.
+        '''
+
+        if self.pool is None and self.timer is None:
+            for stage in stages:
+                stage(self.shards)
+            return
+
+        if self.pool is None:
+            for shard_addr, shard in self.shards.iteritems():
+                self.timer.update_peak_rss()
+                stage_timer.reset_peak_rss()
+                st_time, st_cpu_time = time.time(), stage_timer.get_cpu_time()
+                for stage in stages:
+                    stage({shard_addr: shard})
+                self.timer.add_shard_time(shard_addr, time.time() - st_time,
+                                          stage_timer.get_cpu_time() - st_cpu_time,
+                                          stage_timer.get_peak_rss_mb())
+            return
+
+        tasks = [(shard_addr, get_shard_state(shard), stages)
+                 for shard_addr, shard in self.shards.iteritems()]
+        for shard_addr, state, times in self.pool.imap_unordered(run_stages_on_shard, tasks):
+            set_shard_state(self.shards[shard_addr], state)
+            if self.timer is not None:
+                self.timer.add_shard_time(shard_addr, *times, in_worker=True)
+
+    def close(self):
+
+        '''
+        Shuts down the pool's workers.
+        '''
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+def get_shard_state(shard):
+
+    '''
+    Returns the calibration results stored in a shard.
+    '''
+
+    return dict((attr, getattr(shard, attr)) for attr in STATE_ATTRS)
+
+def set_shard_state(shard, state):
+
+    '''
+    Stores calibration results in a shard.
+    '''
+
+    for attr, value in state.iteritems():
+        setattr(shard, attr, value)
+
+def run_stages_on_shard(task):
+
+    '''
+    Runs a chain of stages on a single shard.
+
+    Worker function of Shard_Pool.run. The shard's spectra come from the
+    shards inherited by the worker, and its current calibration results from
+    the task. Returns the shard's new results, the wall and CPU time the
+    stages took, and the worker's peak memory while they ran.
+    '''
+
+    shard_addr, state, stages = task
+    stage_timer.reset_peak_rss()
+    st_time, st_cpu_time = time.time(), stage_timer.get_cpu_time()
+    shard = _shards[shard_addr]
+    set_shard_state(shard, state)
+    for stage in stages:
+        stage({shard_addr: shard})
+    times = (time.time() - st_time, stage_timer.get_cpu_time() - st_cpu_time,
+             stage_timer.get_peak_rss_mb())
+    return shard_addr, get_shard_state(shard), times
@@ -0,0 +1,276 @@
+import cProfile
+import json
+import os
+import resource
+import time
+
+###########
+# Globals #
+###########
+
+# Environment variables overriding config's instrument_report and
+# instrument_profile settings.
+REPORT_ENV = "CRYSTAL_INSTRUMENT_REPORT"
+PROFILE_ENV = "CRYSTAL_INSTRUMENT_PROFILE"
+
+# Linux files used to reset and read a process's peak resident memory
+CLEAR_REFS_FILENAME = "/proc/self/clear_refs"
+STATUS_FILENAME = "/proc/self/status"
+
+class Stage_Timer():
+
+    '''
+    Times the stages of a pipeline (e.g. calibration's LOAD, PREPROCESS, ...)
+
+    Call start with each stage's name as it begins; the previous stage ends
+    when the next one starts, or when stop is called. For each stage, the
+    wall time and CPU time it took and the process's peak resident memory
+    during it are recorded, in the order the stages ran. The peak is reset
+    as each stage starts (see reset_peak_rss), so that it is the stage's
+    own peak where the OS allows it.
+
+    Parameters
+    ----------
+    per_shard: bool
+        Whether Shard_Pools given this timer should record the time each
+        shard's stages take (see add_shard_time.)
+
+    profile: bool
+        Whether to profile each stage with cProfile (see dump_profile.)
+
+    Attributes
+    ----------
+    stages: list
+        A dict for each stage that has ended, holding its name, wall_time
+        (s), cpu_time (s, of the main process), peak_rss_mb (the main
+        process's peak resident memory in the stage, MB) and, if per_shard,
+        shards (a dict of each shard's wall_time, cpu_time and peak_rss_mb
+        in the stage) and, if any shard ran on a pool worker,
+        worker_peak_rss_mb (the largest peak of any worker in the stage.)
+
+    current_stage: string
+        The name of the stage running, or None.
+
+    profiles: dict
+        The cProfile.Profile of each stage, if profile.
+    '''
+
+    def __init__(self, per_shard=False, profile=False):
+        self.per_shard = per_shard
+        self.profile = profile
+        self.stages = []
+        self.current_stage = None
+        self.st_time = None
+        self.st_cpu_time = None
+        self.shards = {}
+        self.peak_rss_mb = None
+        self.worker_peak_rss_mb = None
+        self.profiles = {}
+
+    def start(self, stage):
+
+        '''
+        Ends the current stage, if any, and starts timing stage.
+        '''
+
+        self.stop()
+        self.current_stage = stage
+        self.shards = {}
+        self.worker_peak_rss_mb = None
+        reset_peak_rss()
+        self.peak_rss_mb = get_peak_rss_mb()
+        if self.profile:
+            self.profiles[stage] = cProfile.Profile()
+            self.profiles[stage].enable()
+        self.st_time = time.time()
+        self.st_cpu_time = get_cpu_time()
+
+    def stop(self):
+
+        '''
+        Ends the current stage, if any.
+        '''
+
+        if self.current_stage is None:
+            return
+        self.update_peak_rss()
+        stage = {"name": self.current_stage,
+                 "wall_time": time.time() - self.st_time,
+                 "cpu_time": get_cpu_time() - self.st_cpu_time,
+                 "peak_rss_mb": self.peak_rss_mb}
+        if self.profile:
+            self.profiles[self.current_stage].disable()
+        if self.per_shard:
+            stage["shards"] = self.shards
+        if self.worker_peak_rss_mb is not None:
+            stage["worker_peak_rss_mb"] = self.worker_peak_rss_mb
+        self.stages.append(stage)
+        self.current_stage = None
+
+    def update_peak_rss(self):
+
+        '''
+        Adds the main process's peak memory since it was last reset to the current stage.
+
+        Call this before resetting the peak in the middle of a stage.
+        '''
+
+        if self.current_stage is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb, get_peak_rss_mb())
+
+    def add_shard_time(self, shard_addr, wall_time, cpu_time, peak_rss_mb, in_worker=False):
+
+        '''
+        Adds the time and memory taken processing a shard to the current stage.
+
+        cpu_time and peak_rss_mb are the CPU time and peak resident memory
+        (MB) of the process which processed the shard while it did, which is
+        a pool worker if in_worker. Times added for the same shard in a
+        stage are summed, and the largest peak memory is kept.
+        '''
+
+        if self.current_stage is None:
+            return
+        if in_worker:
+            self.worker_peak_rss_mb = max(self.worker_peak_rss_mb, peak_rss_mb)
+        key = "{}:{}-{}".format(*shard_addr)
+        shard = self.shards.setdefault(key, {"wall_time": 0.0, "cpu_time": 0.0,
+                                             "peak_rss_mb": 0.0})
+        shard["wall_time"] += wall_time
+        shard["cpu_time"] += cpu_time
+        shard["peak_rss_mb"] = max(shard["peak_rss_mb"], peak_rss_mb)
+
+    def get_hottest_stage(self):
+
+        '''
+        Returns the name of the stage that took the longest, or None.
+        '''
+
+        if not self.stages:
+            return None
+        return max(self.stages, key=lambda stage: stage["wall_time"])["name"]
+
+    def dump_profile(self, filename):
+
+        '''
+        Writes the cProfile stats of the hottest stage to filename.
+
+        Returns the name of the stage dumped, or None if no stage was
+        profiled.
+        '''
+
+        stage = self.get_hottest_stage()
+        if stage not in self.profiles:
+            return None
+        self.profiles[stage].dump_stats(filename)
+        return stage
+
+    def get_report(self):
+
+        '''
+        Returns the recorded stages, their total wall and CPU time, and the
+        main process's peak memory over them.
+        '''
+
+        return {"stages": self.stages,
+                "wall_time": sum(stage["wall_time"] for stage in self.stages),
+                "cpu_time": sum(stage["cpu_time"] for stage in self.stages),
+                "peak_rss_mb": max([stage["peak_rss_mb"] for stage in self.stages] +
+                                   [get_peak_rss_mb()])}
+
+def get_timer(config):
+
+    '''
+    Returns a Stage_Timer for a run of a pipeline with config.
+
+    Shards are timed if a run report is to be written, and stages are
+    profiled if a profile is to be dumped (see get_instrument_filenames.)
+    '''
+
+    report_filename, profile_filename = get_instrument_filenames(config)
+    return Stage_Timer(per_shard=report_filename is not None,
+                       profile=profile_filename is not None)
+
+def get_instrument_filenames(config):
+
+    '''
+    Returns the filenames of the run report and profile to write, or None.
+
+    The CRYSTAL_INSTRUMENT_REPORT and CRYSTAL_INSTRUMENT_PROFILE environment
+    variables override config's instrument_report and instrument_profile.
+    '''
+
+    return (os.environ.get(REPORT_ENV, config["instrument_report"]) or None,
+            os.environ.get(PROFILE_ENV, config["instrument_profile"]) or None)
+
+def write_run_report(timer, pipeline, config, info=None):
+
+    '''
+    Writes out the instrumentation of a pipeline's run, if it is enabled.
+
+    The run report holds the pipeline's name, the time it ran, its timer's
+    report and the items of the dict info, as JSON. If a profile is to be
+    written, the hottest stage's profile is dumped, and its name is added
+    to the report.
+    '''
+
+    report_filename, profile_filename = get_instrument_filenames(config)
+    if report_filename is None and profile_filename is None:
+        return
+
+    report = timer.get_report()
+    report.update({"pipeline": pipeline,
+                   "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "workers": config["workers"]})
+    report.update(info or {})
+    if profile_filename is not None:
+        report["profiled_stage"] = timer.dump_profile(profile_filename)
+        report["profile"] = profile_filename
+    if report_filename is not None:
+        with open(report_filename, "w") as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
+
+def get_cpu_time():
+
+    '''
+    Returns the CPU time (user + system) used by the process so far, in s.
+    '''
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def reset_peak_rss():
+
+    '''
+    Resets the process's peak resident memory to its current resident memory.
+
+    Only supported on Linux. Returns whether the peak was reset; if not,
+    get_peak_rss_mb keeps returning the peak since the process started.
+    '''
+
+    try:
+        with open(CLEAR_REFS_FILENAME, "w") as clear_refs_file:
+            clear_refs_file.write("5")
+        return True
+    except (IOError, OSError):
+        return False
+
+def get_peak_rss_mb():
+
+    '''
+    Returns the peak resident memory of the process since reset_peak_rss, in MB.
+
+    Where the peak can't be reset, returns the peak since the process
+    started.
+    '''
+
+    try:
+        with open(STATUS_FILENAME, "r") as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    # VmHWM is in kB
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, OSError):
+        pass
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
@@ -4,6 +4,20 @@ def coadd_spectrum(shard):
 
     '''
     Coadds each spectrum in shard.
+
+    The coadd is cached in the shard's derived products, so it is only
+    recomputed after the shard's spectra change. If shard was built from the
+    sufficient statistics of its spectra, the coadd is computed from them.
+    '''
+
+    if shard.stats is not None:
+        return (shard.stats.wv_sum / shard.stats.n, shard.stats.y_sum / shard.stats.n)
+    return shard.get_derived("coadd", compute_coadd_spectrum)
+
+def compute_coadd_spectrum(shard):
+
+    '''
+    Computes the coadd of each spectrum in shard.
     '''
 
     shard_px = shard.hi_px - shard.lo_px
@@ -1,7 +1,7 @@
-import matplotlib.pyplot as plt
 import numpy as np
 
 import utility.utility as utility
+import visualize.render as render
 
 def plot_PCCs(shards, PCC_type, show=False):
 
@@ -21,27 +21,41 @@ def plot_shard_PCCs(shard, PCC_type):
     Plot a shard's pixels colored by PCC.
     '''
 
+    if PCC_type == "water":
+        PCCs = shard.w_PCCs
+    elif PCC_type == "airmass":
+        PCCs = shard.z_PCCs
+    else:
+        raise Exception("Could not plot unrecognized PCC type")
+
+    spectra = [(spectrum.lin_x, spectrum.log_y) for spectrum in shard.spectra.itervalues()]
+    title = "Order {}, px {}-{} PCC with {} calibrator".format(shard.order, shard.lo_px, 
+                                                               shard.hi_px, PCC_type)
+    render.show(draw_shard_PCCs, "{}_PCCs_order{}_px{}-{}".format(PCC_type, shard.order,
+                                                                 shard.lo_px, shard.hi_px),
+                title, PCC_type, spectra, PCCs)
+
+def draw_shard_PCCs(title, PCC_type, spectra, PCCs):
+
+    '''
+    Draws a shard's spectra colored by PCC.
+
+    Drawing function of plot_shard_PCCs.
+    '''
+
+    import matplotlib.pyplot as plt
     cmap = plt.get_cmap('Spectral_r')
 
     fig = plt.figure(facecolor = 'white')
-    for spectrum in shard.spectra.itervalues():
-        if PCC_type == "water":
-            plt.scatter(spectrum.lin_x, spectrum.log_y, c=shard.w_PCCs, 
-                        vmin=0.0, vmax=1.0, cmap=cmap)
-        elif PCC_type == "airmass":
-            plt.scatter(spectrum.lin_x, spectrum.log_y, c=shard.z_PCCs, 
-                        vmin=0.0, vmax=1.0, cmap=cmap)
-        else:
-            raise Exception("Could not plot unrecognized PCC type")
-
-    plt.title("Order {}, px {}-{} PCC with {} calibrator".format(shard.order, shard.lo_px, 
-                                                                 shard.hi_px, PCC_type))
+    for x, y in spectra:
+        plt.scatter(x, y, c=PCCs, vmin=0.0, vmax=1.0, cmap=cmap)
+
+    plt.title(title)
     plt.xlabel("Wavelength (Angstroms)")
     plt.ylabel("Log Space Signal Intensity")
     cb = plt.colorbar()
     cb.set_label("PCC with {} calibrator".format(PCC_type))
     plt.tight_layout()
-    plt.show()
     
 
 def plot_PCCs_flag_sig(shards, PCC_type, show=False, title=""):
@@ -74,30 +88,41 @@ def plot_shard_PCCs_flag_sig(shard, PCC_type, title):
     coadded_x, coadded_y = utility.coadd_spectrum(shard)
 
     # 2) Plot coadded spectrum's PCCs with cluster PCCs in black
+    if PCC_type == "water":
+        PCCs, clusters = shard.w_PCCs, shard.w_clusters
+    else:
+        PCCs, clusters = shard.z_PCCs, shard.z_clusters
+    plot_title = "Order {} px{}-{} (coadded), sig PCCs flagged {} {}".format(shard.order, 
+                                                                             shard.lo_px,
+                                                                             shard.hi_px, 
+                                                                             PCC_type, title)
+    render.show(draw_shard_PCCs_flag_sig,
+                "{}_PCCs_flag_sig_order{}_px{}-{}".format(PCC_type, shard.order, shard.lo_px,
+                                                          shard.hi_px),
+                plot_title, PCC_type, coadded_x, coadded_y, PCCs, clusters)
+
+def draw_shard_PCCs_flag_sig(title, PCC_type, coadded_x, coadded_y, PCCs, clusters):
+
+    '''
+    Draws a coadded spectrum colored by px PCC, w/ cluster px in black.
+
+    Drawing function of plot_shard_PCCs_flag_sig.
+    '''
+
+    import matplotlib.pyplot as plt
     cmap = plt.get_cmap('Spectral_r')
     fig = plt.figure(facecolor='white')
     plt.xlabel("Wavelength (Angstroms)")
     plt.ylabel("Signal strength")
-    plt.title("Order {} px{}-{} (coadded), sig PCCs flagged {} {}".format(shard.order, shard.lo_px,
-                                                                          shard.hi_px, PCC_type, 
-                                                                          title))
-    if PCC_type == "water":
-        for cluster in shard.w_clusters:
-            cluster_px = range(cluster[0], cluster[1]+1)
-            plt.scatter(coadded_x[cluster_px], coadded_y[cluster_px], color="k", zorder=2)
-        plt.scatter(coadded_x, coadded_y, c=shard.w_PCCs, 
-                    vmin=0.0, vmax=1.0, cmap=cmap, zorder=1)
-    else:
-        for cluster in shard.z_clusters:
-            cluster_px = range(cluster[0], cluster[1]+1)
-            plt.scatter(coadded_x[cluster_px], coadded_y[cluster_px], color="k", zorder=2)
-        plt.scatter(coadded_x, coadded_y, c=shard.z_PCCs, 
-                    vmin=0.0, vmax=1.0, cmap=cmap, zorder=1)
+    plt.title(title)
+    for cluster in clusters:
+        cluster_px = range(cluster[0], cluster[1]+1)
+        plt.scatter(coadded_x[cluster_px], coadded_y[cluster_px], color="k", zorder=2)
+    plt.scatter(coadded_x, coadded_y, c=PCCs, vmin=0.0, vmax=1.0, cmap=cmap, zorder=1)
 
     cb = plt.colorbar()
     cb.set_label("Pixel PCC with {}".format(PCC_type))
     plt.plot(coadded_x, coadded_y, color="orange", zorder=3)    
-    plt.show()
 
 
 
@@ -121,27 +146,41 @@ def plot_shard_px_classification(shard):
     '''
 
     coadded_x, coadded_y = utility.coadd_spectrum(shard)
+    title = "Order {} px{}-{} (coadded) pixel classification".format(shard.order, shard.lo_px,
+                                                                     shard.hi_px)
+    render.show(draw_shard_px_classification,
+                "px_classification_order{}_px{}-{}".format(shard.order, shard.lo_px,
+                                                           shard.hi_px),
+                title, coadded_x, coadded_y, shard.w_clusters, shard.z_clusters,
+                shard.c_clusters)
 
+def draw_shard_px_classification(title, coadded_x, coadded_y, w_clusters, z_clusters, 
+                                 c_clusters):
+
+    '''
+    Draws a coadded spectrum colored by classification type.
+
+    Drawing function of plot_shard_px_classification.
+    '''
+
+    import matplotlib.pyplot as plt
     fig = plt.figure(facecolor='white')
     plt.xlabel("Wavelength (Angstroms)")
     plt.ylabel("Signal strength")
-    plt.title("Order {} px{}-{} (coadded) pixel classification".format(shard.order, shard.lo_px,
-                                                                       shard.hi_px))
+    plt.title(title)
     plt.scatter(coadded_x, coadded_y, color="k", zorder=1)
     plt.plot(coadded_x, coadded_y, color="orange", zorder=3)
 
-    for cluster in shard.w_clusters:
+    for cluster in w_clusters:
         cluster_px = range(cluster[0], cluster[1]+1)
         plt.scatter(coadded_x[cluster_px], coadded_y[cluster_px], color="b", zorder=2)
 
-    for cluster in shard.z_clusters:
+    for cluster in z_clusters:
         cluster_px = range(cluster[0], cluster[1]+1)
         plt.scatter(coadded_x[cluster_px], coadded_y[cluster_px], color="r", zorder=2)
 
-    for cluster in shard.c_clusters:
+    for cluster in c_clusters:
         cluster_px = range(cluster[0], cluster[1]+1)
         plt.scatter(coadded_x[cluster_px], coadded_y[cluster_px], color="purple", zorder=2)
 
-    plt.show()
-
     
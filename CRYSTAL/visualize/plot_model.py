@@ -1,7 +1,7 @@
-import matplotlib.pyplot as plt
 import numpy as np
 
-import model.generate_model as mi
+import visualize.plot_shards as plot_shards
+import visualize.render as render
 
 def plot_model(shift, shards, model, show=False):
 
@@ -22,20 +22,17 @@ def plot_shard_model(shift, shard, model):
     '''
 
     spectrum = shard.spectra.itervalues().next() #only one spectrum in shard
+    shift = int(round(shift)) #plot sub-pixel shifts to the nearest pixel
 
     shard_model = np.ones(len(spectrum.log_y))
-    for row in model:
-        px = row[mi.PX_IND]
-        if row[mi.ORD_IND] == shard.order and shard.lo_px <= px and px < shard.hi_px:
-            shard_model[px - shard.lo_px + shift] = row[mi.INT_IND]
+    in_shard = ((model["order"] == shard.order) & (model["px"] >= shard.lo_px) &
+                (model["px"] < shard.hi_px))
+    inds = model["px"][in_shard] - shard.lo_px + shift
+    is_in_range = (inds >= 0) & (inds < len(shard_model))
+    shard_model[inds[is_in_range]] = model["intensity"][in_shard][is_in_range]
             
-    fig = plt.figure(facecolor = 'white')
-    plt.plot(spectrum.lin_x, np.exp(spectrum.log_y), color='purple', label='CHIRON Spectrum')
-    plt.plot(spectrum.lin_x, shard_model, label='Model')
-    plt.title("Order {} px {}-{}, spectrum and telluric model".format(shard.order, shard.lo_px,
-                                                                      shard.hi_px))
-    plt.xlabel("Wavelength (Angstroms)")
-    plt.ylabel("Signal strength")
-    plt.tight_layout()
-    plt.legend()
-    plt.show()
+    title = "Order {} px {}-{}, spectrum and telluric model".format(shard.order, shard.lo_px,
+                                                                    shard.hi_px)
+    render.show(plot_shards.draw_spectrum_vs_model,
+                "model_order{}_px{}-{}".format(shard.order, shard.lo_px, shard.hi_px),
+                title, spectrum.lin_x, np.exp(spectrum.log_y), shard_model, 'Model')
@@ -1,8 +1,9 @@
 import sys
 
-import matplotlib.pyplot as plt
 import numpy as np
 
+import visualize.render as render
+
 # Clusters are denoted by the 2-tuple (start_px, end_px). This set of globals
 # notes that the index of the start pixel, given by ST_IND, is 0, and the
 # index of the finish pixel, given by END_IND, is 1.
@@ -46,16 +47,14 @@ def plot_px_regression(shard_addr, px, calibrators, shards):
         return
     shard = shards[shard_addr]
     
-    px_depths = []
-    for filename in f_order:
-        px_depths.append(shard.spectra[filename].log_y[px])
+    px_depths = shard.log_y[:, px]
     
-    if px in shard.w_coeffs:
-        r_model = np.poly1d(shard.w_coeffs[px])
+    if not np.isnan(shard.w_coeffs[px]).any():
+        coeffs = shard.w_coeffs[px]
         calibrator = w_calibrator
         cal_lbl = "Water calibrator"
-    elif px in shard.z_coeffs:
-        r_model = np.poly1d(shard.z_coeffs[px])
+    elif not np.isnan(shard.z_coeffs[px]).any():
+        coeffs = shard.z_coeffs[px]
         calibrator = z_calibrator
         cal_lbl = "Airmass"
     else:
@@ -63,13 +62,28 @@ def plot_px_regression(shard_addr, px, calibrators, shards):
         sys.stderr.write(err_ms)
         return
 
+    title = "Px {}, shard (order {}, px {}-{}) regression w/ {}".format(px, 
+                                                                        shard.order, shard.lo_px,
+                                                                        shard.hi_px, cal_lbl)
+    render.show(draw_px_regression, "regression_order{}_px{}-{}_{}".format(shard.order,
+                                                                          shard.lo_px,
+                                                                          shard.hi_px, px),
+                title, px, cal_lbl, calibrator, px_depths, coeffs)
+
+def draw_px_regression(title, px, cal_lbl, calibrator, px_depths, coeffs):
+
+    '''
+    Draws a px's depths against its calibrator, with its regression model.
+
+    Drawing function of plot_px_regression.
+    '''
+
+    import matplotlib.pyplot as plt
+    r_model = np.poly1d(coeffs)
     fig = plt.figure(facecolor='white')
     plt.xlabel(cal_lbl)
-    plt.ylabel("Px {} log signal strength".format(px, shard.order))
-    plt.title("Px {}, shard (order {}, px {}-{}) regression w/ {}".format(px, 
-                                                                          shard.order, shard.lo_px,
-                                                                          shard.hi_px, cal_lbl))
+    plt.ylabel("Px {} log signal strength".format(px))
+    plt.title(title)
     plt.scatter(calibrator, px_depths, marker="X", color="k")
     plt.plot(sorted(calibrator), r_model(sorted(calibrator)),"r--", zorder=0)
-    plt.show()
         
@@ -1,7 +1,6 @@
-import matplotlib.pyplot as plt
 import numpy as np
 
-import load_store.db_indicies as dbi
+import visualize.render as render
 
 def plot_shard(shard, y_scale, x_units, append_to_title):
 
@@ -23,35 +22,59 @@ def plot_shard(shard, y_scale, x_units, append_to_title):
        String to append to plot title.
     '''
 
-    fig = plt.figure(facecolor='white')
     title = "Order:{}, px {}-{} spectra in {} space {}".format(shard.order, shard.lo_px, 
                                                                shard.hi_px, y_scale,
                                                                append_to_title)
-    plt.title(title)
-        
+
+    # Each spectrum is plotted as a line (x, y), where x is None when
+    # plotting against pixels.
+    lines = []
+    x_label, y_label = None, None
     for spectrum_name, spectrum in shard.spectra.iteritems():
-        if x_units == "pixels":
-            plt.xlabel("Pixels (Arbitrary 0)")
-            if y_scale == "linear":
-                plt.plot(spectrum.lin_y)
-                plt.ylabel("Signal Intensity (linear space)")
+        if y_scale == "linear":
+            y_label = "Signal Intensity (linear space)"
+            # Linear intensities are not kept if config drops them to save memory
+            if spectrum.lin_y is not None:
+                y = spectrum.lin_y
             else:
-                plt.plot(spectrum.log_y)
-                plt.ylabel("Signal Intensity (log space)")
+                y = np.exp(spectrum.log_y)
+        else:
+            y_label = "Signal Intensity (log space)"
+            y = spectrum.log_y
 
+        if x_units == "pixels":
+            x_label = "Pixels (Arbitrary 0)"
+            lines.append((None, y))
         elif x_units == "wavelength":
-            plt.xlabel("Wavelength (Angstroms)")
-            if y_scale == "linear":
-                plt.plot(spectrum.lin_x, spectrum.lin_y)
-                plt.ylabel("Signal Intensity (linear space)")
-            else:
-                plt.plot(spectrum.lin_x, spectrum.log_y)
-                plt.ylabel("Signal Intensity (log space)")
-
+            x_label = "Wavelength (Angstroms)"
+            lines.append((spectrum.lin_x, y))
         else:
             print "xUnits unrecognized"
 
-    plt.show()
+    render.show(draw_shard, "spectra_order{}_px{}-{}".format(shard.order, shard.lo_px,
+                                                            shard.hi_px),
+                title, x_label, y_label, lines)
+
+def draw_shard(title, x_label, y_label, lines):
+
+    '''
+    Draws a shard's spectra.
+
+    Drawing function of plot_shard.
+    '''
+
+    import matplotlib.pyplot as plt
+    fig = plt.figure(facecolor='white')
+    plt.title(title)
+    if x_label is not None:
+        plt.xlabel(x_label)
+    if y_label is not None:
+        plt.ylabel(y_label)
+    for x, y in lines:
+        if x is None:
+            plt.plot(y)
+        else:
+            plt.plot(x, y)
 
 
 def plot_shards(shards, x_units, y_scale, show=False, append_to_title=""):
@@ -105,22 +128,34 @@ def plot_shard_vs_xcorr_tel(db, shift, shard):
     '''
 
     spectrum = shard.spectra.itervalues().next() #only one spectrum in shard
+    shift = int(round(shift)) #plot sub-pixel shifts to the nearest pixel
 
     db_spectrum = np.ones(len(spectrum.log_y))
-    for record in db:
-        px = record[dbi.PX_IND] + shift
-        if record[dbi.ORD_IND] == shard.order and shard.lo_px <= px and px < shard.hi_px:
-            db_spectrum[px - shard.lo_px] = np.exp(record[dbi.INT_IND])
+    start, end = db.get_shard_rows(shard.order, shard.lo_px - shift, shard.hi_px - shift)
+    db_spectrum[db.px[start:end] + shift - shard.lo_px] = np.exp(db.med_intensity[start:end])
+
+    title = "Order {} px {}-{}, spectrum and xcorr, unscaled telluric model".format(shard.order, 
+                                                                                   shard.lo_px,
+                                                                                   shard.hi_px)
+    render.show(draw_spectrum_vs_model, "xcorr_order{}_px{}-{}".format(shard.order, shard.lo_px,
+                                                                      shard.hi_px),
+                title, spectrum.lin_x, np.exp(spectrum.log_y), db_spectrum, 'Telluric Spectrum')
 
+def draw_spectrum_vs_model(title, x, spectrum_y, model_y, model_label):
+
+    '''
+    Draws a spectrum against a telluric model.
+
+    Drawing function of plot_shard_vs_xcorr_tel and plot_model.
+    '''
+
+    import matplotlib.pyplot as plt
     fig = plt.figure(facecolor = 'white')
-    plt.plot(spectrum.lin_x, np.exp(spectrum.log_y), color='purple', label='CHIRON Spectrum')
-    plt.plot(spectrum.lin_x, db_spectrum, label='Telluric Spectrum')
-    plt.title("Order {} px {}-{}, spectrum and xcorr, unscaled telluric model".format(shard.order, 
-                                                                                     shard.lo_px,
-                                                                                     shard.hi_px))
+    plt.plot(x, spectrum_y, color='purple', label='CHIRON Spectrum')
+    plt.plot(x, model_y, label=model_label)
+    plt.title(title)
     plt.xlabel("Wavelength (Angstroms)")
     plt.ylabel("Signal strength")
     plt.tight_layout()
     plt.legend()
-    plt.show()
     
@@ -1,8 +1,7 @@
-from matplotlib.colors import LinearSegmentedColormap
-import matplotlib.pyplot as plt
 import numpy as np
 
 import load_store.db_indicies as dbi
+import visualize.render as render
 
 def plot_telluric_db(db, config):
 
@@ -22,6 +21,18 @@ def plot_telluric_db(db, config):
     for record in db:
         img[record[dbi.ORD_IND], record[dbi.PX_IND]] = CLASS_TO_FLOAT[record[dbi.CLS_IND]]
 
+    render.show(draw_telluric_db, "telluric_db", img)
+
+def draw_telluric_db(img):
+
+    '''
+    Draws the telluric database's image of pixel classes.
+
+    Drawing function of plot_telluric_db.
+    '''
+
+    from matplotlib.colors import LinearSegmentedColormap
+    import matplotlib.pyplot as plt
     cm_list = ((0.0, "white"), (0.3, "blue"), (0.6, "red"), (1.0, "purple"))
     cm = LinearSegmentedColormap.from_list("telluric_classes", cm_list, N=4)
 
@@ -32,4 +43,3 @@ def plot_telluric_db(db, config):
     plt.ylabel(r'Wavelength, ($\AA$)')
     plt.title("Pixels in telluric database")
     ax.set_yticklabels(["alpha", 4505, 4692, 4896, 5119, 5362, 5631, 5927, 6256, 6624])
-    plt.show()
@@ -1,7 +1,7 @@
-import matplotlib.pyplot as plt
 import numpy as np
 
 import load_store.db_indicies as dbi
+import visualize.render as render
 
 def plot_telluric_range(db, wv_lo, wv_hi):
 
@@ -52,17 +52,29 @@ def plot_telluric_range(db, wv_lo, wv_hi):
         plot_pts_x.append(wv_hi)
         plot_pts_y.append(1.0)
 
+    render.show(draw_telluric_range, "telluric_range_{}-{}".format(wv_lo, wv_hi), 
+                r'Telluric spectrum {}-{}$\AA$'.format(wv_lo, wv_hi), np.array(pts_x), 
+                np.array(pts_y), w_pts, z_pts, c_pts, plot_pts_x, plot_pts_y)
+
+def draw_telluric_range(title, pts_x, pts_y, w_pts, z_pts, c_pts, plot_pts_x, plot_pts_y):
+
+    '''
+    Draws the telluric pixels in a range, and the telluric spectrum through them.
+
+    Drawing function of plot_telluric_range.
+    '''
+
+    import matplotlib.pyplot as plt
     fig = plt.figure(facecolor="white")
-    plt.scatter(np.array(pts_x)[w_pts], np.array(pts_y)[w_pts], 
+    plt.scatter(pts_x[w_pts], pts_y[w_pts], 
                 color="b", marker="X", label="Water px", zorder=1)
-    plt.scatter(np.array(pts_x)[z_pts], np.array(pts_y)[z_pts], 
+    plt.scatter(pts_x[z_pts], pts_y[z_pts], 
                 color="r", marker="X", label="Non-water px", zorder=1)
-    plt.scatter(np.array(pts_x)[c_pts], np.array(pts_y)[c_pts], 
+    plt.scatter(pts_x[c_pts], pts_y[c_pts], 
                 color="purple", marker="X", label="Composite px", zorder=1)
     plt.plot(plot_pts_x, plot_pts_y, color="k", zorder=2)
-    plt.title(r'Telluric spectrum {}-{}$\AA$'.format(wv_lo, wv_hi))
+    plt.title(title)
     plt.xlabel(r'Wavelength ($\AA$)')
     plt.ylabel("Signal Strength")
     plt.legend()
-    plt.show()
         
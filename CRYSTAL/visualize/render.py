@@ -0,0 +1,180 @@
+import multiprocessing
+import os
+import sys
+import traceback
+
+###########
+# Globals #
+###########
+
+# Plots waiting to render per render worker. Submitting a plot when more
+# are waiting blocks until the oldest has rendered, so plots captured
+# faster than they render don't pile up in memory.
+global MAX_PENDING_PER_WORKER
+MAX_PENDING_PER_WORKER = 4
+
+# The renderer plots are sent to when they are rendered to files, or None
+# when they are shown in windows. Set by start_renderer.
+global _renderer
+_renderer = None
+
+class Plot_Renderer():
+
+    '''
+    Renders plots to png files on a pool of background processes.
+
+    Plots are submitted as a drawing function and the arrays it draws, and
+    rendered headlessly (with matplotlib's Agg backend) by the pool while
+    the pipeline carries on. Each plot is written to
+    <render_path>/<run>_<nnnn>_<name>.png, numbered in the order submitted.
+
+    Parameters
+    ----------
+    config: dict
+        Configuration. Its render_path and render_workers are used. If
+        render_workers is 0, plots are rendered to files in the main
+        process instead.
+
+    run: str
+        Name of the run plotted (e.g. "calibration"), which prefixes the
+        name of each plot's file.
+
+    Attributes
+    ----------
+    n_plots: int
+        Number of plots submitted.
+
+    jobs: list
+        The AsyncResult of each plot still waiting to render.
+
+    failures: list
+        The filename and traceback of each plot that failed to render.
+    '''
+
+    def __init__(self, config, run):
+        self.path = config["render_path"]
+        self.run = run
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        import matplotlib.pyplot as plt
+        plt.switch_backend("Agg")
+        self.n_plots = 0
+        self.jobs = []
+        self.failures = []
+        self.max_pending = MAX_PENDING_PER_WORKER * config["render_workers"]
+        self.pool = None
+        if config["render_workers"] > 0:
+            self.pool = multiprocessing.Pool(config["render_workers"])
+
+    def submit(self, draw, name, args):
+
+        '''
+        Renders the plot drawn by draw(*args) to a file named after name.
+        '''
+
+        self.n_plots += 1
+        filename = os.path.join(self.path,
+                                "{}_{:04d}_{}.png".format(self.run, self.n_plots, name))
+        if self.pool is None:
+            self.check_job(filename, render_plot((draw, filename, args)))
+            return
+
+        while len(self.jobs) >= self.max_pending:
+            self.check_job(*self.pop_job())
+        self.jobs.append((filename,
+                          self.pool.apply_async(render_plot, [(draw, filename, args)])))
+
+    def pop_job(self):
+
+        '''
+        Waits for the oldest plot waiting to render, and returns its result.
+        '''
+
+        filename, job = self.jobs.pop(0)
+        return filename, job.get()
+
+    def check_job(self, filename, error):
+
+        '''
+        Records a plot which failed to render.
+        '''
+
+        if error is not None:
+            self.failures.append((filename, error))
+
+    def close(self):
+
+        '''
+        Waits for every plot to render, shuts down the pool, and reports failures.
+        '''
+
+        while self.jobs:
+            self.check_job(*self.pop_job())
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        for filename, error in self.failures:
+            sys.stderr.write("Failed to render {}:\n{}".format(filename, error))
+
+def render_plot(job):
+
+    '''
+    Draws a plot and writes it to a file.
+
+    Worker function of Plot_Renderer. Returns None, or the traceback if the
+    plot failed to render.
+    '''
+
+    import matplotlib.pyplot as plt
+    draw, filename, args = job
+    try:
+        draw(*args)
+        plt.savefig(filename)
+        return None
+    except Exception:
+        return traceback.format_exc()
+    finally:
+        plt.close("all")
+
+def start_renderer(config, run):
+
+    '''
+    Starts rendering the plots of a run to files if config's render_path is set.
+
+    Call this before loading data, so that the render workers forked don't
+    hold a copy of it.
+    '''
+
+    global _renderer
+    if config["render_path"] and _renderer is None:
+        _renderer = Plot_Renderer(config, run)
+
+def stop_renderer():
+
+    '''
+    Waits for every plot submitted to render, and stops rendering plots to files.
+    '''
+
+    global _renderer
+    if _renderer is not None:
+        _renderer.close()
+        _renderer = None
+
+def show(draw, name, *args):
+
+    '''
+    Shows the plot drawn by draw(*args).
+
+    If plots are rendered to files (see start_renderer), the plot is
+    rendered in the background to a png named after name instead of shown
+    in a window. draw must be a module level function, and should only be
+    passed the arrays it draws, since they are copied to a render worker.
+    '''
+
+    import matplotlib.pyplot as plt
+    if _renderer is None:
+        draw(*args)
+        plt.show()
+    else:
+        _renderer.submit(draw, name, args)